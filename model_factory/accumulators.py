@@ -0,0 +1,120 @@
+import math
+from typing import Tuple
+
+import torch
+
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+
+class RunningMean:
+    """
+    Mean of a per-batch scalar kept as a detached tensor on the scalar's
+    device, so accumulating it neither keeps the autograd graph alive nor
+    synchronizes with the device every batch.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.total = None
+        self.count = 0
+
+    def update(self, value: torch.Tensor) -> None:
+        value = value.detach()
+        self.total = value if self.total is None else self.total + value
+        self.count += 1
+
+    def compute(self) -> float:
+        if not self.count:
+            return math.nan
+        return float(self.total) / self.count
+
+
+class PredictionBuffer:
+    """
+    Preallocated buffers holding the predictions and targets of an epoch.
+    Both are allocated once, on the first recorded batch, with room for
+    n_samples rows, and every batch is copied into the next free rows, so
+    memory stays flat however long the epoch is. A buffer that runs out of
+    rows (e.g. a dataset whose length was underestimated) doubles once
+    instead of failing.
+
+    Args:
+        n_samples {int} -- number of rows to preallocate, e.g. len(dataset)
+        device {torch.device} -- device the buffers live on
+    """
+    def __init__(self, n_samples: int, device: torch.device = None):
+        self.n_samples = n_samples
+        self.device = device
+        self.predictions = None
+        self.targets = None
+        self.size = 0
+
+    def _allocate(self, like: torch.Tensor, rows: int) -> torch.Tensor:
+        return torch.empty((rows, ) + tuple(like.shape[1:]),
+                           dtype=like.dtype,
+                           device=self.device or like.device)
+
+    def _grow(self, rows: int) -> None:
+        capacity = max(rows, 2 * len(self.predictions))
+        LOGGER.info(f'Growing prediction buffer to {capacity} rows')
+        for name in ('predictions', 'targets'):
+            old = getattr(self, name)
+            new = self._allocate(like=old, rows=capacity)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def update(self, predictions: torch.Tensor, targets: torch.Tensor) -> None:
+        predictions, targets = predictions.detach(), targets.detach()
+        if self.predictions is None:
+            rows = max(self.n_samples, len(predictions))
+            self.predictions = self._allocate(like=predictions, rows=rows)
+            self.targets = self._allocate(like=targets, rows=rows)
+        end = self.size + len(predictions)
+        if end > len(self.predictions):
+            self._grow(rows=end)
+        self.predictions[self.size:end] = predictions
+        self.targets[self.size:end] = targets
+        self.size = end
+
+    def compute(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.predictions[:self.size], self.targets[:self.size]
+
+
+class EpochAccumulator:
+    """
+    Loss and outputs of one training or evaluation epoch in bounded memory.
+    The loss of every batch goes into a RunningMean; predictions and
+    targets are only recorded for every metrics_every_n-th batch, which
+    trades exact training metrics for less copying on long epochs.
+
+    Args:
+        n_samples {int} -- number of samples in the epoch, e.g. len(dataset)
+        device {torch.device} -- device of the prediction buffers
+        metrics_every_n {int} -- record outputs of one batch in every n
+    """
+    def __init__(self,
+                 n_samples: int,
+                 device: torch.device = None,
+                 metrics_every_n: int = 1):
+        self.metrics_every_n = max(metrics_every_n, 1)
+        self.loss = RunningMean()
+        self.outputs = PredictionBuffer(
+            n_samples=-(-n_samples // self.metrics_every_n), device=device)
+        self.batches = 0
+
+    def step(self, loss: torch.Tensor) -> bool:
+        """Adds a batch loss and returns whether to record its outputs"""
+        self.loss.update(loss)
+        record = self.batches % self.metrics_every_n == 0
+        self.batches += 1
+        return record
+
+    def record(self, predictions: torch.Tensor, targets: torch.Tensor) -> None:
+        self.outputs.update(predictions=predictions, targets=targets)
+
+    def compute(self) -> Tuple[float, torch.Tensor, torch.Tensor]:
+        predictions, targets = self.outputs.compute()
+        return self.loss.compute(), predictions, targets
@@ -0,0 +1,136 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import encoders
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+STATISTICS = ('count', 'sum', 'mean', 'std', 'min', 'max')
+
+
+def _group_statistics(codes: np.array, values: np.array, n_groups: int,
+                      statistics: List[str]) -> Dict[str, np.array]:
+    """
+    Per-group statistics of values with bincount and segment reductions;
+    codes and values must be sorted by code
+    """
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    counts = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+    tables = {'count': counts, 'sum': sums, 'mean': means}
+    if 'std' in statistics:
+        squares = np.bincount(codes,
+                              weights=(values - means[codes])**2,
+                              minlength=n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tables['std'] = np.sqrt(squares / (counts - 1))
+    if 'min' in statistics or 'max' in statistics:
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        for name, reduce in (('min', np.minimum), ('max', np.maximum)):
+            table = np.full(n_groups, np.nan)
+            if len(codes):
+                table[codes[starts]] = reduce.reduceat(values, starts)
+            tables[name] = table
+    return {statistic: tables[statistic] for statistic in statistics}
+
+
+class AggregationFeatureBuilder:
+    """
+    Group statistics of value columns per key column, e.g. how often each
+    question occurs. Each key is factorized once by a CategoricalEncoder
+    and sorted once, and every statistic of every value column is computed
+    in one pass of bincount and segment reductions over the integer codes,
+    then broadcast back to rows by indexing the per-group tables with the
+    codes. The
+    fitted vocabularies and tables are reused to transform new data; keys
+    that were not seen in fit get a count and sum of 0 and NaN for the
+    other statistics.
+
+    Missing keys form their own group, and NaN values are skipped like in
+    pandas. count is the number of non-missing values in the group.
+
+    Args:
+        keys {List[str]} -- columns to group by
+        statistics {List[str]} -- any of count, sum, mean, std, min, max
+        values {List[str]} -- numeric columns to aggregate; with None only
+        count is computed, per key
+    """
+    def __init__(self,
+                 keys: List[str],
+                 statistics: List[str] = ['count'],
+                 values: List[str] = None):
+        unknown = set(statistics) - set(STATISTICS)
+        if unknown:
+            raise ValueError(f'Unsupported statistics: {sorted(unknown)}')
+        self.keys = keys
+        self.statistics = statistics
+        self.values = values
+        self.encoder = encoders.CategoricalEncoder(columns=[], sort=False)
+        self.tables: Dict[str, np.array] = {}
+
+    def _feature_name(self, key: str, value: str, statistic: str) -> str:
+        if value is None:
+            return f'{key}_{statistic}'
+        return f'{key}_{value}_{statistic}'
+
+    def _fit(self, df: pd.DataFrame) -> Dict[str, np.array]:
+        """Fits the tables and returns the codes of every key"""
+        self.tables = {}
+        key_codes = {}
+        for key in self.keys:
+            codes = self.encoder.fit_transform_column(key, df[key])
+            key_codes[key] = codes
+            # the last group is the unknown bucket, empty during fit
+            n_groups = self.encoder.cardinalities[key]
+            if self.values is None:
+                self.tables[self._feature_name(
+                    key, None, 'count')] = (np.bincount(
+                        codes, minlength=n_groups).astype(np.float64))
+                continue
+            # sorted once per key so min and max are segment reductions
+            order = np.argsort(codes, kind='mergesort')
+            for value in self.values:
+                tables = _group_statistics(
+                    codes=codes[order],
+                    values=df[value].to_numpy(dtype=np.float64)[order],
+                    n_groups=n_groups,
+                    statistics=self.statistics)
+                for statistic, table in tables.items():
+                    self.tables[self._feature_name(key, value,
+                                                   statistic)] = table
+        LOGGER.info(f'Fitted {len(self.tables)} aggregation features over '
+                    f'{len(df)} rows')
+        return key_codes
+
+    def _broadcast(self, codes: Dict[str, np.array],
+                   index: pd.Index) -> pd.DataFrame:
+        features = {}
+        for key in self.keys:
+            for value in self.values or [None]:
+                statistics = self.statistics if value is not None else [
+                    'count'
+                ]
+                for statistic in statistics:
+                    name = self._feature_name(key, value, statistic)
+                    features[name] = self.tables[name][codes[key]]
+        return pd.DataFrame(features, index=index)
+
+    def fit(self, df: pd.DataFrame) -> 'AggregationFeatureBuilder':
+        self._fit(df)
+        return self
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        codes = {
+            key: self.encoder.transform_column(key, df[key])
+            for key in self.keys
+        }
+        return self._broadcast(codes=codes, index=df.index)
+
+    def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        return self._broadcast(codes=self._fit(df), index=df.index)
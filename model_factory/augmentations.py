@@ -0,0 +1,153 @@
+from typing import Tuple
+
+import numpy as np
+import torch
+
+
+def single_channel_stats(mean: Tuple[float],
+                         std: Tuple[float]) -> Tuple[float, float]:
+    """Collapses per-channel RGB statistics into grayscale ones"""
+    return float(np.mean(mean)), float(np.mean(std))
+
+
+class BatchNormalize:
+    """
+    Normalizes a collated batch of uint8 images of shape (B, 1, H, W) on the
+    device it lives on. With channels=3 the grayscale channel is broadcast
+    to RGB using the per-channel statistics, so 3-channel models can still
+    be fed from single-channel datasets.
+
+    Args:
+        mean {Tuple[float]} -- per-channel mean
+        std {Tuple[float]} -- per-channel standard deviation
+        channels {int} -- number of channels the model expects (1 or 3)
+        max_pixel_value {float} -- value images are scaled by
+    """
+    def __init__(self,
+                 mean: Tuple[float],
+                 std: Tuple[float],
+                 channels: int = 1,
+                 max_pixel_value: float = 255.0):
+        if channels == 1:
+            mean, std = single_channel_stats(mean=mean, std=std)
+        mean = torch.tensor(mean, dtype=torch.float).reshape(1, -1, 1, 1)
+        std = torch.tensor(std, dtype=torch.float).reshape(1, -1, 1, 1)
+        self.scale = 1.0 / (std * max_pixel_value)
+        self.shift = -mean / std
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        if images.dim() == 3:
+            images = images.unsqueeze(1)
+        scale = self.scale.to(images.device)
+        shift = self.shift.to(images.device)
+        return torch.addcmul(shift, images.float(), scale)
+
+
+class BatchShiftScaleRotate:
+    """
+    Batched equivalent of albumentations.ShiftScaleRotate. Every image in
+    a (B, C, H, W) batch gets its own random affine transform, applied in a
+    single grid-sample call with reflected borders. Parameters are drawn
+    from the same distributions as the albumentations transform.
+
+    Args:
+        shift_limit {float} -- maximum shift as a fraction of image size
+        scale_limit {float} -- maximum relative change of scale
+        rotate_limit {float} -- maximum rotation in degrees
+        p {float} -- probability of transforming each image
+        seed {int} -- optional seed for reproducible augmentations
+    """
+    def __init__(self,
+                 shift_limit: float = 0.0625,
+                 scale_limit: float = 0.1,
+                 rotate_limit: float = 5,
+                 p: float = 0.9,
+                 seed: int = None):
+        self.shift_limit = shift_limit
+        self.scale_limit = scale_limit
+        self.rotate_limit = rotate_limit
+        self.p = p
+        self.generator = torch.Generator()
+        if seed is None:
+            # an unseeded Generator always starts from the same default seed
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def _uniform(self, limit: float, size: int) -> torch.Tensor:
+        return (torch.rand(size, generator=self.generator) * 2 - 1) * limit
+
+    def sample_params(self, batch_size: int) -> Tuple[torch.Tensor]:
+        angle = self._uniform(self.rotate_limit, batch_size)
+        scale = 1 + self._uniform(self.scale_limit, batch_size)
+        dx = self._uniform(self.shift_limit, batch_size)
+        dy = self._uniform(self.shift_limit, batch_size)
+        apply = torch.rand(batch_size, generator=self.generator) < self.p
+        angle[~apply] = 0
+        scale[~apply] = 1
+        dx[~apply] = 0
+        dy[~apply] = 0
+        return angle, scale, dx, dy
+
+    @staticmethod
+    def warp(images: torch.Tensor, angle: torch.Tensor, scale: torch.Tensor,
+             dx: torch.Tensor, dy: torch.Tensor) -> torch.Tensor:
+        """
+        Applies per-image rotation (degrees, counter-clockwise like
+        cv2.getRotationMatrix2D), scale and shift (fraction of width/height)
+        about the image centre.
+        """
+        height, width = images.shape[-2:]
+        radians = torch.deg2rad(angle)
+        cos = torch.cos(radians) / scale
+        sin = torch.sin(radians) / scale
+        # inverse of the cv2 affine matrix, expressed in normalized coords
+        theta = torch.stack([
+            torch.stack([cos, -sin * height / width], dim=1),
+            torch.stack([sin * width / height, cos], dim=1)
+        ],
+                            dim=1)
+        # cv2 rotates about pixel (W / 2, H / 2), half a pixel off centre
+        centre = torch.tensor([1 / width, 1 / height]).reshape(1, 2, 1)
+        shift = torch.stack([2 * dx, 2 * dy], dim=1).unsqueeze(2)
+        theta = torch.cat([theta, centre - theta @ (centre + shift)], dim=2)
+        theta = theta.to(device=images.device, dtype=images.dtype)
+        grid = torch.nn.functional.affine_grid(theta,
+                                               list(images.shape),
+                                               align_corners=False)
+        return torch.nn.functional.grid_sample(images,
+                                               grid,
+                                               mode='bilinear',
+                                               padding_mode='reflection',
+                                               align_corners=False)
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        angle, scale, dx, dy = self.sample_params(batch_size=images.shape[0])
+        return self.warp(images, angle=angle, scale=scale, dx=dx, dy=dy)
+
+
+class BatchAugmentation:
+    """
+    Training-time batch stage: shift/scale/rotate on the raw single
+    channel, followed by a fused normalize (and RGB broadcast if the model
+    expects 3 channels).
+
+    Args:
+        mean {Tuple[float]} -- per-channel mean
+        std {Tuple[float]} -- per-channel standard deviation
+        channels {int} -- number of channels the model expects (1 or 3)
+        seed {int} -- optional seed for reproducible augmentations
+    """
+    def __init__(self,
+                 mean: Tuple[float],
+                 std: Tuple[float],
+                 channels: int = 1,
+                 seed: int = None):
+        self.shift_scale_rotate = BatchShiftScaleRotate(seed=seed)
+        self.normalize = BatchNormalize(mean=mean, std=std, channels=channels)
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        if images.dim() == 3:
+            images = images.unsqueeze(1)
+        images = self.shift_scale_rotate(images.float())
+        return self.normalize(images)
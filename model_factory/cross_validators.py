@@ -1,3 +1,4 @@
+import json
 import os
 from abc import ABC
 from pathlib import Path
@@ -5,39 +6,597 @@ from typing import Any, Dict, List, Tuple
 
 import numpy as np
 import pandas as pd
-from iterstrat.ml_stratifiers import MultilabelStratifiedKFold
+import pyarrow as pa
+import pyarrow.parquet as pq
 from sklearn import model_selection
 
 from utils import get_logger
 
 LOGGER = get_logger(__name__)
 
+ROW_COLUMN = 'csv_row'
+
+
+def fold_table_path(csv_path: str) -> str:
+    return str(Path(csv_path).with_suffix('.parquet'))
+
+
+def fold_index_path(data_path: str) -> str:
+    return str(Path(data_path).with_suffix('.folds.npy'))
+
+
+def resolve_folds_path(csv_path: str) -> str:
+    """
+    File to read the folds of csv_path (e.g. train-folds.csv) from: the
+    csv itself or its fold table when a validator wrote them, otherwise the
+    source csv (train.csv) when only its fold index was written.
+    """
+    if os.path.isfile(csv_path) or os.path.isfile(fold_table_path(csv_path)):
+        return csv_path
+    source_path = csv_path.replace('-folds.csv', '.csv')
+    if os.path.isfile(fold_index_path(source_path)):
+        return source_path
+    return csv_path
+
+
+def _is_fresh(path: str, source_path: str) -> bool:
+    return os.path.isfile(path) and (
+        not os.path.isfile(source_path)
+        or os.path.getmtime(path) >= os.path.getmtime(source_path))
+
+
+def write_fold_table(train: pd.DataFrame, csv_path: str) -> str:
+    """
+    Writes the columnar twin of a train-folds csv: rows sorted by kfold,
+    one parquet row group per fold, plus the original csv row number so
+    row-aligned artifacts (e.g. token caches) can still be indexed.
+
+    Args:
+        train {pd.DataFrame} -- training data with a kfold column
+        csv_path {str} -- path the folds csv is written to
+
+    Returns:
+        table_path {str} -- path of the parquet fold table
+    """
+    table_path = fold_table_path(csv_path)
+    order = np.argsort(train.kfold.values, kind='mergesort')
+    train = train.assign(**{ROW_COLUMN: np.arange(len(train))}).iloc[order]
+    table = pa.Table.from_pandas(train, preserve_index=False)
+    folds, counts = np.unique(train.kfold.values, return_counts=True)
+    tmp_path = f'{table_path}.tmp{os.getpid()}'
+    writer = pq.ParquetWriter(tmp_path, table.schema)
+    for offset, length in zip(np.cumsum(counts) - counts, counts):
+        writer.write_table(table.slice(offset, length), row_group_size=length)
+    writer.close()
+    os.replace(tmp_path, table_path)
+    LOGGER.info(f'Wrote {len(folds)} fold row groups to {table_path}')
+    return table_path
+
+
+def _fold_row_groups(parquet_file: pq.ParquetFile,
+                     folds: List[int]) -> List[int]:
+    column = parquet_file.schema.names.index('kfold')
+    row_groups = []
+    for i in range(parquet_file.metadata.num_row_groups):
+        stats = parquet_file.metadata.row_group(i).column(column).statistics
+        if stats is None or not stats.has_min_max or any(
+                stats.min <= fold <= stats.max for fold in folds):
+            row_groups.append(i)
+    return row_groups
+
+
+def read_folds(csv_path: str,
+               folds: List[int],
+               columns: List[str] = None) -> pd.DataFrame:
+    """
+    Loads the rows of the given folds. Reads only the matching row groups
+    and requested columns of the parquet fold table when it is at least as
+    new as the csv. Otherwise parses the csv, taking kfold from the int8
+    fold index written by FoldAssigner when there is a fresh one.
+
+    Args:
+        csv_path {str} -- path to train-folds.csv, or the training csv
+        next to its fold index (see resolve_folds_path)
+        folds {List[int]} -- folds to load
+        columns {List[str]} -- columns to load, all if None
+
+    Returns:
+        df {pd.DataFrame} -- requested columns plus kfold and csv_row
+    """
+    folds = list(folds)
+    table_path = fold_table_path(csv_path)
+    index_path = fold_index_path(csv_path)
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + ['kfold']))
+    if _is_fresh(table_path, source_path=csv_path):
+        parquet_file = pq.ParquetFile(table_path)
+        df = parquet_file.read_row_groups(
+            _fold_row_groups(parquet_file, folds=folds),
+            columns=columns + [ROW_COLUMN] if columns else None).to_pandas()
+        # restore csv order so both paths return identical frames
+        df = df.sort_values(ROW_COLUMN, kind='mergesort')
+    elif _is_fresh(index_path, source_path=csv_path):
+        kfold = np.load(index_path)
+        df = pd.read_csv(
+            csv_path,
+            usecols=[column for column in columns
+                     if column != 'kfold'] if columns else None)
+        if len(df) != len(kfold):
+            raise ValueError(f'{index_path} has {len(kfold)} folds for '
+                             f'{len(df)} rows of {csv_path}')
+        df['kfold'] = kfold
+        df[ROW_COLUMN] = np.arange(len(df))
+    else:
+        df = pd.read_csv(csv_path, usecols=columns)
+        df[ROW_COLUMN] = np.arange(len(df))
+    return df.loc[df.kfold.isin(folds)].reset_index(drop=True)
+
+
+def label_indicators(y: np.array) -> np.array:
+    """
+    Boolean (n_rows, n_labels) label matrix. A binary matrix is used as it
+    is, any other 2D array is read as one class column per task (e.g.
+    grapheme_root, vowel_diacritic and consonant_diacritic) and one-hot
+    encoded column by column.
+    """
+    y = np.asarray(y)
+    if y.ndim == 1:
+        y = y[:, None]
+    if np.isin(y, (0, 1)).all():
+        return y.astype(bool)
+    columns = []
+    for column in y.T:
+        _, codes = np.unique(column, return_inverse=True)
+        one_hot = np.zeros((len(column), codes.max() + 1), dtype=bool)
+        one_hot[np.arange(len(column)), codes] = True
+        columns.append(one_hot)
+    return np.hstack(columns)
+
+
+class IterativeStratifiedKFold:
+    """
+    Vectorized multilabel stratified k-fold. Follows the iterative
+    stratification of Sechidis et al. used by iterstrat: labels are taken
+    rarest first and their examples are given to the folds that still want
+    the most of that label. Instead of placing one example at a time, all
+    unassigned examples of a label are placed in one step: the label's
+    remaining per-fold demand is turned into integer fold quotas and the
+    examples, grouped by their full label set, are dealt out in a weighted
+    round robin so co-occurring labels are spread with them.
+
+    Args:
+        n_splits {int} -- number of folds
+        shuffle {bool} -- shuffle examples before dealing them out
+        random_state {int} -- seed used when shuffling
+    """
+    def __init__(self,
+                 n_splits: int = 5,
+                 shuffle: bool = False,
+                 random_state: int = None):
+        self.n_splits = n_splits
+        self.shuffle = shuffle
+        self.random_state = random_state
+
+    def get_n_splits(self, X=None, y=None, groups=None) -> int:
+        return self.n_splits
+
+    def _quotas(self, n_rows: int, demand: np.array,
+                row_demand: np.array) -> np.array:
+        """
+        Splits n_rows over the folds in proportion to demand, rounding in
+        favour of the folds that are furthest below their size
+        """
+        demand = np.maximum(demand, 0).astype(np.float64)
+        if demand.sum() <= 0:
+            demand = np.ones(self.n_splits)
+        share = n_rows * demand / demand.sum()
+        quotas = np.floor(share).astype(np.int64)
+        remainder = n_rows - quotas.sum()
+        # folds owed at least half a row come first, then the emptiest folds
+        priority = np.lexsort((-row_demand, share - quotas < 0.5))
+        quotas[priority[:remainder]] += 1
+        return quotas
+
+    def _deal(self, quotas: np.array) -> np.array:
+        """Fold of each of sum(quotas) slots, folds interleaved by weight"""
+        folds = np.repeat(np.arange(self.n_splits), quotas)
+        rank = np.concatenate([np.arange(quota) for quota in quotas])
+        position = (rank + 0.5) / np.repeat(np.maximum(quotas, 1), quotas)
+        return folds[np.argsort(position, kind='mergesort')]
+
+    @staticmethod
+    def _signatures(labels: np.array) -> np.array:
+        """Rank of every row's label set, equal for equal label sets"""
+        packed = np.packbits(labels, axis=1)
+        padding = -packed.shape[1] % 8
+        words = np.ascontiguousarray(np.pad(packed,
+                                            ((0, 0),
+                                             (0, padding)))).view('>u8')
+        order = np.lexsort(words.T[::-1])
+        changed = np.r_[True, (np.diff(words[order], axis=0) != 0).any(axis=1)]
+        signatures = np.empty(len(labels), dtype=np.int64)
+        signatures[order] = np.cumsum(changed)
+        return signatures
+
+    def assign(self, y: np.array) -> np.array:
+        """int8 fold of every row of y"""
+        labels = label_indicators(y)
+        n_rows = len(labels)
+        order = (np.random.RandomState(self.random_state).permutation(n_rows)
+                 if self.shuffle else np.arange(n_rows))
+        labels = np.asfortranarray(labels[order])
+        folds = np.full(n_rows, -1, dtype=np.int8)
+        label_demand = np.outer(np.full(self.n_splits, 1 / self.n_splits),
+                                labels.sum(axis=0))
+        row_demand = np.full(self.n_splits, n_rows / self.n_splits)
+        remaining = labels.sum(axis=0).astype(np.int64)
+        signatures = self._signatures(labels)
+        while remaining.any():
+            label = np.where(remaining > 0, remaining,
+                             np.iinfo(np.int64).max).argmin()
+            rows = np.flatnonzero(labels[:, label] & (folds < 0))
+            # rows with the same label set are adjacent, so dealing them
+            # round robin spreads every label combination across folds
+            rows = rows[np.argsort(signatures[rows], kind='mergesort')]
+            quotas = self._quotas(len(rows), label_demand[:, label],
+                                  row_demand)
+            folds[rows] = self._deal(quotas)
+            assigned = np.eye(self.n_splits)[folds[rows]].T
+            fold_labels = assigned @ labels[rows].astype(np.float64)
+            label_demand -= fold_labels
+            row_demand -= quotas
+            remaining -= fold_labels.sum(axis=0).astype(np.int64)
+        rows = np.flatnonzero(folds < 0)
+        if len(rows):
+            folds[rows] = self._deal(
+                self._quotas(len(rows), row_demand, row_demand))
+        assigned = np.empty_like(folds)
+        assigned[order] = folds
+        return assigned
+
+    def split(self, X, y: np.array, groups=None):
+        folds = self.assign(y)
+        for fold in range(self.n_splits):
+            yield np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+
+
+class FoldAssigner:
+    """
+    Assigns every row of a dataset to one of n_splits validation folds in
+    a single pass and returns the assignment as an int8 array aligned to
+    the rows, so the data itself never has to be rewritten.
+
+    Args:
+        strategy {str} -- one of kfold, stratified, multilabel or group
+        n_splits {int} -- number of folds
+        shuffle {bool} -- shuffle rows before splitting (ignored by group)
+        random_state {int} -- seed used when shuffling
+    """
+    STRATEGIES = ('kfold', 'stratified', 'multilabel', 'group')
+
+    def __init__(self,
+                 strategy: str = 'kfold',
+                 n_splits: int = 5,
+                 shuffle: bool = True,
+                 random_state: int = 123):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'Unknown fold strategy: {strategy}')
+        if not 2 <= n_splits <= np.iinfo(np.int8).max:
+            raise ValueError(f'n_splits must be in [2, 127], got {n_splits}')
+        self.strategy = strategy
+        self.n_splits = n_splits
+        self.shuffle = shuffle
+        self.random_state = random_state
+
+    @property
+    def splitter(self) -> Any:
+        random_state = self.random_state if self.shuffle else None
+        if self.strategy == 'stratified':
+            return model_selection.StratifiedKFold(n_splits=self.n_splits,
+                                                   shuffle=self.shuffle,
+                                                   random_state=random_state)
+        if self.strategy == 'multilabel':
+            return IterativeStratifiedKFold(n_splits=self.n_splits,
+                                            shuffle=self.shuffle,
+                                            random_state=random_state)
+        if self.strategy == 'group':
+            return model_selection.GroupKFold(n_splits=self.n_splits)
+        return model_selection.KFold(n_splits=self.n_splits,
+                                     shuffle=self.shuffle,
+                                     random_state=random_state)
+
+    def assign(self,
+               n_rows: int,
+               y: np.array = None,
+               groups: np.array = None) -> np.array:
+        folds = np.full(n_rows, -1, dtype=np.int8)
+        # splitters only look at the number of rows of X
+        X = np.empty((n_rows, 0))
+        if self.strategy != 'group':
+            groups = None
+        for fold, (_, val_idx) in enumerate(self.splitter.split(X, y, groups)):
+            folds[val_idx] = fold
+        LOGGER.info(
+            f'Fold sizes: {np.bincount(folds, minlength=self.n_splits)}')
+        return folds
+
+
+class HashFoldAssigner:
+    """
+    Out-of-core fold assignment. The csv is read in chunks of only the key
+    and stratification columns, and each row's fold depends only on a
+    stable hash, so assignments never change when rows are appended.
+
+    Without stratification the fold is hash(key) % n_splits. With it, the
+    rows of each class are dealt into folds in blocks of n_splits (a
+    per-class reservoir that fills every fold once per block) with a
+    hash-chosen rotation per block, which keeps every class balanced to
+    within one row per fold.
+
+    The assignment state (rows seen, per-class counts, last key) is saved
+    next to the fold index so that later calls only process appended rows.
+
+    Args:
+        key {str} -- column hashed to assign folds, e.g. a row id
+        n_splits {int} -- number of folds
+        stratify {str} -- optional class column to balance across folds
+        salt {str} -- 16 character hash key
+        chunk_size {int} -- rows read per chunk
+    """
+    def __init__(self,
+                 key: str,
+                 n_splits: int = 5,
+                 stratify: str = None,
+                 salt: str = '0123456789123456',
+                 chunk_size: int = 1000000):
+        self.key = key
+        self.n_splits = n_splits
+        self.stratify = stratify
+        self.salt = salt
+        self.chunk_size = chunk_size
+
+    @property
+    def config(self) -> Dict:
+        return {
+            'key': self.key,
+            'n_splits': self.n_splits,
+            'stratify': self.stratify,
+            'salt': self.salt
+        }
+
+    def _hash(self, values: pd.Series) -> np.array:
+        return pd.util.hash_pandas_object(values,
+                                          index=False,
+                                          hash_key=self.salt).values
+
+    def assign_chunk(self, chunk: pd.DataFrame,
+                     class_counts: Dict[str, int]) -> np.array:
+        """Folds of a chunk; updates class_counts in place"""
+        if self.stratify is None:
+            return (self._hash(chunk[self.key]) % self.n_splits).astype(
+                np.int8)
+        classes = chunk[self.stratify].fillna('nan')
+        offsets = classes.map(class_counts).fillna(0).astype(np.int64)
+        occurrence = offsets.values + classes.groupby(
+            classes).cumcount().values
+        block = occurrence // self.n_splits
+        rotation = self._hash(classes + ':' + pd.Series(block).astype(
+            str).values) % self.n_splits
+        for label, count in classes.value_counts().items():
+            class_counts[label] = class_counts.get(label, 0) + int(count)
+        return ((occurrence + rotation.astype(np.int64)) %
+                self.n_splits).astype(np.int8)
+
+    def assign_csv(self, csv_path: str, index_path: str) -> np.array:
+        """Assigns folds to the rows of csv_path not yet in index_path"""
+        state_path = f'{index_path}.state.json'
+        state = {'n_rows': 0, 'class_counts': {}, 'last_key': None}
+        folds = [np.empty(0, dtype=np.int8)]
+        if os.path.isfile(state_path) and os.path.isfile(index_path):
+            with open(state_path) as f:
+                saved = json.load(f)
+            if saved['config'] == self.config:
+                state = saved
+                folds = [np.load(index_path)]
+        columns = [self.key] + ([self.stratify] if self.stratify else [])
+        # re-read the last assigned row to check the file was only appended to
+        skip = max(state['n_rows'] - 1, 0)
+        reader = pd.read_csv(csv_path,
+                             usecols=columns,
+                             dtype=str,
+                             skiprows=range(1, skip + 1),
+                             chunksize=self.chunk_size)
+        for i, chunk in enumerate(reader):
+            if i == 0 and state['n_rows']:
+                if chunk[self.key].iloc[0] != state['last_key']:
+                    raise ValueError(
+                        f'{csv_path} changed before row {state["n_rows"]}; '
+                        f'remove {state_path} to reassign all folds')
+                chunk = chunk.iloc[1:]
+            if not len(chunk):
+                continue
+            folds.append(
+                self.assign_chunk(chunk, class_counts=state['class_counts']))
+            state['n_rows'] += len(chunk)
+            state['last_key'] = chunk[self.key].iloc[-1]
+        folds = np.concatenate(folds)
+        np.save(index_path, folds)
+        with open(state_path, 'w') as f:
+            json.dump({**state, 'config': self.config}, f)
+        LOGGER.info(
+            f'Fold sizes: {np.bincount(folds, minlength=self.n_splits)}')
+        return folds
+
+
+class PurgedEraKFold:
+    """
+    Era-grouped k-fold for time-ordered data such as Numerai. Eras are
+    split into n_splits contiguous blocks; each block is the test fold and
+    training uses the remaining eras, minus purge_eras before the block and
+    embargo_eras after it so overlapping targets do not leak. With
+    walk_forward only eras before the block are trained on.
+
+    Era boundaries are computed once, so every fold is built from a few
+    slices of the era-sorted row order instead of per-row masks, and folds
+    are returned as index arrays into the original rows.
+
+    Args:
+        n_splits {int} -- number of folds
+        purge_eras {int} -- eras dropped from training before a test block
+        embargo_eras {int} -- eras dropped from training after a test block
+        walk_forward {bool} -- only train on eras before the test block
+    """
+    def __init__(self,
+                 n_splits: int = 5,
+                 purge_eras: int = 0,
+                 embargo_eras: int = 0,
+                 walk_forward: bool = False):
+        self.n_splits = n_splits
+        self.purge_eras = purge_eras
+        self.embargo_eras = embargo_eras
+        self.walk_forward = walk_forward
+
+    def get_n_splits(self, X=None, y=None, groups=None) -> int:
+        return self.n_splits
+
+    @staticmethod
+    def era_boundaries(eras: np.array) -> Tuple[np.array, np.array]:
+        """
+        Era-sorted row order and the start of every era in it, plus the
+        end of the last era
+        """
+        eras = np.asarray(eras)
+        if len(eras) < 2 or (eras[1:] >= eras[:-1]).all():
+            order = np.arange(len(eras))
+        else:
+            order = np.argsort(eras, kind='mergesort')
+        starts = np.flatnonzero(np.r_[True,
+                                      eras[order][1:] != eras[order][:-1]])
+        return order, np.r_[starts, len(eras)]
+
+    def split(self, X=None, y=None, groups: np.array = None):
+        """Yields (train, test) row indexes; groups holds the era codes"""
+        order, boundaries = self.era_boundaries(groups)
+        n_eras = len(boundaries) - 1
+        if n_eras < self.n_splits:
+            raise ValueError(
+                f'Cannot split {n_eras} eras into {self.n_splits} folds')
+        blocks = np.linspace(0, n_eras, self.n_splits + 1).astype(np.int64)
+        for first, last in zip(blocks[:-1], blocks[1:]):
+            before = boundaries[max(first - self.purge_eras, 0)]
+            after = boundaries[min(last + self.embargo_eras, n_eras)]
+            test = order[boundaries[first]:boundaries[last]]
+            train = order[:before]
+            if not self.walk_forward:
+                train = np.concatenate([train, order[after:]])
+            if not len(train):
+                continue
+            yield train, test
+
 
 class CrossValidator(ABC):
-    def __init__(self, input_path: str, output_path: str, target: Any):
+    """
+    Assigns folds to a training file and loads train/validation splits.
+    The int8 fold index is always written next to input_path; when
+    output_path is given the full data is also written there as a csv
+    with a kfold column, plus its parquet fold table.
+
+    Args:
+        input_path {str} -- training csv
+        output_path {str} -- optional train-folds csv to write
+        target {Any} -- target column(s) used for stratification
+        n_splits {int} -- number of folds
+        strategy {str} -- fold strategy, see FoldAssigner
+        shuffle {bool} -- shuffle rows before splitting
+        group {str} -- column holding the groups of the group strategy
+        hash_key {str} -- when given, folds are assigned out of core from
+        a hash of this column (see HashFoldAssigner), stratified by target
+        for the stratified strategy; only the fold index is written
+    """
+    strategy = 'kfold'
+    shuffle = True
+
+    def __init__(self,
+                 input_path: str,
+                 output_path: str,
+                 target: Any,
+                 n_splits: int = 5,
+                 strategy: str = None,
+                 shuffle: bool = None,
+                 group: str = None,
+                 hash_key: str = None):
         super().__init__()
         self.input_path = input_path
         self.output_path = output_path
         self.target = target
+        self.group = group
+        self.hash_key = hash_key
+        self.fold_assigner = FoldAssigner(
+            strategy=strategy or self.strategy,
+            n_splits=n_splits,
+            shuffle=self.shuffle if shuffle is None else shuffle)
         self.fold_mapping = {
-            0: [1, 2, 3, 4],
-            1: [0, 2, 3, 4],
-            2: [0, 1, 3, 4],
-            3: [0, 1, 2, 4],
-            4: [0, 1, 2, 3],
+            fold: [other for other in range(n_splits) if other != fold]
+            for fold in range(n_splits)
         }
 
     @staticmethod
-    def load_train_for_cv(input_path: str) -> pd.DataFrame:
-        train = pd.read_csv(input_path)
+    def load_train_for_cv(input_path: str,
+                          columns: List[Any] = None) -> pd.DataFrame:
+        train = pd.read_csv(input_path, usecols=columns)
         train['kfold'] = -1
         return train
 
+    @property
+    def cv_columns(self) -> List[str]:
+        """Columns needed to assign folds"""
+        targets = [] if self.target is None else ([self.target] if isinstance(
+            self.target, str) else list(self.target))
+        return targets + ([self.group] if self.group else [])
+
+    def assign_folds_out_of_core(self) -> pd.DataFrame:
+        stratified = self.fold_assigner.strategy == 'stratified'
+        stratify = self.target if stratified else None
+        assigner = HashFoldAssigner(key=self.hash_key,
+                                    n_splits=self.fold_assigner.n_splits,
+                                    stratify=stratify)
+        folds = assigner.assign_csv(csv_path=self.input_path,
+                                    index_path=fold_index_path(
+                                        self.input_path))
+        return pd.DataFrame({'kfold': folds})
+
+    def assign_folds(self, save: bool = True) -> pd.DataFrame:
+        if self.hash_key:
+            return self.assign_folds_out_of_core()
+        # without output_path only the fold assignment inputs are loaded
+        columns = None if self.output_path else self.cv_columns or [0]
+        train = self.load_train_for_cv(input_path=self.input_path,
+                                       columns=columns)
+        y = None if self.target is None else train[self.target].values
+        groups = train[self.group].values if self.group else None
+        train['kfold'] = self.fold_assigner.assign(n_rows=len(train),
+                                                   y=y,
+                                                   groups=groups)
+        if save:
+            self.save_folds(train=train)
+        return train
+
+    def save_folds(self, train: pd.DataFrame) -> None:
+        index_path = fold_index_path(self.input_path)
+        LOGGER.info(f'Saving fold index to disk at {index_path}')
+        np.save(index_path, train.kfold.values.astype(np.int8))
+        if self.output_path:
+            LOGGER.info(f'Saving train folds to disk at {self.output_path}')
+            train.to_csv(self.output_path, index=False)
+            write_fold_table(train=train, csv_path=self.output_path)
+
     def split_data(self, fold: int,
                    input_path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
         LOGGER.info(f'Loading training data from: {input_path}')
         LOGGER.info(f'Fold: {fold}')
-        df = pd.read_csv(input_path)
+        df = read_folds(csv_path=input_path,
+                        folds=self.fold_mapping.get(fold) + [fold])
+        df = df.drop(ROW_COLUMN, axis=1)
         train = df.loc[df.kfold.isin(
             self.fold_mapping.get(fold))].reset_index(drop=True)
         valid = df.loc[df.kfold == fold]
@@ -63,86 +622,36 @@ class CrossValidator(ABC):
 
 
 class CategoricalChallengeCrossValidator(CrossValidator):
-    def __init__(self, input_path: str, output_path: str, target: str):
-        super().__init__(input_path, output_path, target)
+    strategy = 'stratified'
 
     def apply_stratified_kfold(self) -> None:
-        train = self.load_train_for_cv(input_path=self.input_path)
-        kf = model_selection.StratifiedKFold(n_splits=5,
-                                             shuffle=True,
-                                             random_state=123)
-        for fold, (train_idx, val_idx) in enumerate(
-                kf.split(X=train, y=train[self.target].values)):
-            LOGGER.info(f'Train index: {len(train_idx)}, Val index: {val_idx}')
-            train.loc[val_idx, 'kfold'] = fold
-
-        LOGGER.info(f'Saving train folds to disk at {self.output_path}')
-        train.to_csv(self.output_path, index=False)
+        self.assign_folds()
 
 
 class QuoraCrossValidator(CrossValidator):
-    def __init__(self, input_path: str, output_path: str, target: str):
-        super().__init__(input_path, output_path, target)
+    strategy = 'stratified'
 
     def apply_stratified_kfold(self) -> None:
-        train = self.load_train_for_cv(input_path=self.input_path)
-        kf = model_selection.StratifiedKFold(n_splits=5,
-                                             shuffle=True,
-                                             random_state=123)
-        for fold, (train_idx, val_idx) in enumerate(
-                kf.split(X=train, y=train[self.target].values)):
-            LOGGER.info(f'Train index: {len(train_idx)}, Val index: {val_idx}')
-            train.loc[val_idx, 'kfold'] = fold
-
-        LOGGER.info(f'Saving train folds to disk at {self.output_path}')
-        train.to_csv(self.output_path, index=False)
+        self.assign_folds()
 
 
 class BengaliCrossValidator(CrossValidator):
-    def __init__(self, input_path: str, output_path: str, target: str):
-        super().__init__(input_path, output_path, target)
+    strategy = 'multilabel'
+    shuffle = False
 
-    def _split_data(self,
-                    train: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        X = train.image_id.values
-        y = train[self.target].values
-        return X, y
-
-    def apply_multilabel_stratified_kfold(self, save: bool = True) -> None:
-        train = self.load_train_for_cv(input_path=self.input_path)
-        X, y = self._split_data(train=train)
-        mskf = MultilabelStratifiedKFold(n_splits=5)
-        for fold, (train_idx, val_idx) in enumerate(mskf.split(X, y)):
-            LOGGER.info(f'Train index: {len(train_idx)}, Val index: {val_idx}')
-            train.loc[val_idx, 'kfold'] = fold
-
-        LOGGER.info(f'Saving train folds to disk at {self.output_path}')
-        if save:
-            train.to_csv(self.output_path, index=False)
-        return train
+    def apply_multilabel_stratified_kfold(self,
+                                          save: bool = True) -> pd.DataFrame:
+        return self.assign_folds(save=save)
 
 
 class GoogleQACrossValidator(CrossValidator):
-    def __init__(self, input_path: str, output_path: str, target: str):
-        super().__init__(input_path, output_path, target)
-
     @staticmethod
     def get_targets(target_path: str) -> List[str]:
         df = pd.read_csv(target_path)
         return list(df.drop('qa_id', axis=1).columns)
 
     def apply_kfold(self, save: bool = True) -> pd.DataFrame:
-        train = self.load_train_for_cv(input_path=self.input_path)
-        kf = model_selection.KFold(n_splits=5, shuffle=True, random_state=123)
-        for fold, (train_idx, val_idx) in enumerate(
-                kf.split(X=train, y=train[self.target].values)):
-            LOGGER.info(f'Train index: {len(train_idx)}, Val index: {val_idx}')
-            train.loc[val_idx, 'kfold'] = fold
-
-        LOGGER.info(f'Saving train folds to disk at {self.output_path}')
-        if save:
-            train.to_csv(self.output_path, index=False)
-        return train
+        return self.assign_folds(save=save)
 
 
 class IMDBCrossValidator(CrossValidator):
@@ -150,14 +659,4 @@ class IMDBCrossValidator(CrossValidator):
         super().__init__(input_path, output_path, target)
 
     def apply_kfold(self, save: bool = True) -> pd.DataFrame:
-        train = self.load_train_for_cv(input_path=self.input_path)
-        kf = model_selection.KFold(n_splits=5, shuffle=True, random_state=123)
-        for fold, (train_idx, val_idx) in enumerate(
-                kf.split(X=train, y=train[self.target].values)):
-            LOGGER.info(f'Train index: {len(train_idx)}, Val index: {val_idx}')
-            train.loc[val_idx, 'kfold'] = fold
-
-        LOGGER.info(f'Saving train folds to disk at {self.output_path}')
-        if save:
-            train.to_csv(self.output_path, index=False)
-        return train
+        return self.assign_folds(save=save)
@@ -1,19 +1,23 @@
 import glob
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Tuple, Optional, Sequence
 
 import albumentations
 import joblib
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import torch
 import torchvision
 from PIL import Image
 from sklearn import model_selection
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, IterableDataset
 from tqdm import tqdm
 
 import cross_validators
+import image_store
+import token_cache
 import utils
 
 LOGGER = utils.get_logger(__name__)
@@ -26,20 +30,29 @@ class BengaliDataSetTrain(Dataset):
     Args:
         train_path {str} - path to train-folds.csv
         pickle_path {str} - path to pickled images
+        image_store_path {str} - path to a packed image store, used instead
+        of pickle_path when given
         folds {List[int]} - key for dataset fold
         image_height {int} - height of images
         image_width {int} - width of images
         mean {Tuple[float]} - mean for image augmentation
         std {Tuple[float]} - variance for image augmentation
+        single_channel {bool} - return uint8 (1, H, W) images and leave
+        normalization to augmentations.BatchNormalize
+        batch_augmentation {bool} - return raw uint8 (1, H, W) images and
+        leave all augmentation to augmentations.BatchAugmentation
     """
     def __init__(self,
                  train_path: str,
                  pickle_path: str = None,
+                 image_store_path: str = None,
                  folds: List[int] = [0],
                  image_height: int = None,
                  image_width: int = None,
                  mean: Tuple[float] = None,
-                 std: Tuple[float] = None):
+                 std: Tuple[float] = None,
+                 single_channel: bool = False,
+                 batch_augmentation: bool = False):
         super().__init__()
         self.train_path = train_path
         self.folds = folds
@@ -48,25 +61,51 @@ class BengaliDataSetTrain(Dataset):
         self.mean = mean
         self.std = std
         self.pickle_path = pickle_path
+        self.image_store_path = image_store_path
+        self.single_channel = single_channel
+        self.batch_augmentation = batch_augmentation
         self.create_attributes
         self.create_augmentations
 
     @property
     def create_attributes(self) -> None:
         def _load_df() -> pd.DataFrame:
-            df = pd.read_csv(self.train_path)
-            df = df.drop('grapheme', axis=1)
-            return df.loc[df.kfold.isin(self.folds)].reset_index(drop=True)
+            columns = [
+                'image_id', 'grapheme_root', 'vowel_diacritic',
+                'consonant_diacritic'
+            ]
+            return cross_validators.read_folds(
+                csv_path=cross_validators.resolve_folds_path(self.train_path),
+                folds=self.folds,
+                columns=columns)
 
         df = _load_df()
         self.image_ids = df.image_id.values
         self.grapheme_root = df.grapheme_root.values
         self.vowel_diacritic = df.vowel_diacritic.values
         self.consonant_diacritic = df.consonant_diacritic.values
+        if self.image_store_path:
+            self.image_store = image_store.PackedImageStore(
+                self.image_store_path)
+            self.shards, self.rows = self.image_store.locate(self.image_ids)
 
     @property
     def create_augmentations(self) -> None:
-        if len(self.folds) > 1:
+        if self.batch_augmentation:
+            # augmentation runs on the collated batch, see augmentations.py
+            self.aug = None
+        elif self.single_channel:
+            # images are stored at their native size so Resize is skipped
+            if len(self.folds) > 1:
+                self.aug = None
+            else:
+                self.aug = albumentations.Compose([
+                    albumentations.ShiftScaleRotate(shift_limit=0.0625,
+                                                    scale_limit=0.1,
+                                                    rotate_limit=5,
+                                                    p=0.9)
+                ])
+        elif len(self.folds) > 1:
             self.aug = albumentations.Compose([
                 albumentations.Resize(self.image_height,
                                       self.image_width,
@@ -93,9 +132,14 @@ class BengaliDataSetTrain(Dataset):
         return len(self.image_ids)
 
     def __getitem__(self, item: int) -> Dict:
-        def _prepare_image() -> Image:
-            image = joblib.load(
+        def _load_image() -> np.array:
+            if self.image_store_path:
+                return self.image_store.get(self.shards[item], self.rows[item])
+            return joblib.load(
                 f"{self.pickle_path}/{self.image_ids[item]}.pkl")
+
+        def _prepare_image() -> Image:
+            image = _load_image()
             image = image.reshape(self.image_height,
                                   self.image_width).astype(float)
             return Image.fromarray(image).convert("RGB")
@@ -104,10 +148,17 @@ class BengaliDataSetTrain(Dataset):
             image = self.aug(image=np.array(image))["image"]
             return np.transpose(image, (2, 0, 1)).astype(np.float32)
 
+        def _prepare_single_channel_image() -> np.array:
+            image = _load_image().reshape(self.image_height, self.image_width)
+            if self.aug is not None:
+                image = self.aug(
+                    image=np.asarray(image, dtype=np.uint8))["image"]
+            return np.array(image, dtype=np.uint8)[np.newaxis]
+
         def _return_image_dict(image) -> Dict:
             return {
                 "image":
-                torch.tensor(image, dtype=torch.float),
+                image,
                 "grapheme_root":
                 torch.tensor(self.grapheme_root[item], dtype=torch.long),
                 "vowel_diacritic":
@@ -116,9 +167,12 @@ class BengaliDataSetTrain(Dataset):
                 torch.tensor(self.consonant_diacritic[item], dtype=torch.long),
             }
 
+        if self.single_channel or self.batch_augmentation:
+            image = _prepare_single_channel_image()
+            return _return_image_dict(image=torch.from_numpy(image))
         image = _prepare_image()
         image = _augment_image(image=image)
-        return _return_image_dict(image=image)
+        return _return_image_dict(image=torch.tensor(image, dtype=torch.float))
 
 
 class BengaliDataSetTest(Dataset):
@@ -131,26 +185,33 @@ class BengaliDataSetTest(Dataset):
         image_width {int} - width of images
         mean {Tuple[float]} - mean for image augmentation
         std {Tuple[float]} - variance for image augmentation
+        single_channel {bool} - return uint8 (1, H, W) images and leave
+        normalization to augmentations.BatchNormalize
     """
     def __init__(self,
                  df: pd.DataFrame,
                  image_height: int = None,
                  image_width: int = None,
                  mean: float = None,
-                 std: float = None):
+                 std: float = None,
+                 single_channel: bool = False):
         super().__init__()
         self.df = df
         self.image_height = image_height
         self.image_width = image_width
         self.mean = mean
         self.std = std
+        self.single_channel = single_channel
         self.create_attributes
         self.create_augmentations
 
     @property
     def create_attributes(self) -> None:
         self.image_id = self.df.image_id.values
-        self.image_arr = self.df.iloc[:, 1:].values
+        if self.single_channel:
+            self.image_arr = self.df.iloc[:, 1:].to_numpy(dtype=np.uint8)
+        else:
+            self.image_arr = self.df.iloc[:, 1:].values
 
     @property
     def create_augmentations(self) -> None:
@@ -184,12 +245,143 @@ class BengaliDataSetTest(Dataset):
                 "image_id": image_id
             }
 
+        if self.single_channel:
+            image = self.image_arr[item, :].reshape(1, self.image_height,
+                                                    self.image_width)
+            return {
+                "image": torch.from_numpy(image.copy()),
+                "image_id": _get_image_id()
+            }
         image = _prepare_image()
         augmented_image = _augment_image(image=image)
         image_id = _get_image_id()
         return _return_image_dict(image=augmented_image, image_id=image_id)
 
 
+class BengaliDataSetTestStream(IterableDataset):
+    """
+    Streaming dataset for inference. Reads the test parquet files one row
+    group at a time as uint8 arrays while the next row group is prefetched
+    in a background thread, so memory is bounded by two row groups however
+    large the test set is. Row groups are split between DataLoader workers.
+
+    Args:
+        parquet_paths {List[str]} - paths to test parquet files
+        image_height {int} - height of images
+        image_width {int} - width of images
+        mean {Tuple[float]} - mean for image augmentation
+        std {Tuple[float]} - variance for image augmentation
+        single_channel {bool} - return uint8 (1, H, W) images and leave
+        normalization to augmentations.BatchNormalize
+    """
+    def __init__(self,
+                 parquet_paths: List[str],
+                 image_height: int = None,
+                 image_width: int = None,
+                 mean: Tuple[float] = None,
+                 std: Tuple[float] = None,
+                 single_channel: bool = False):
+        super().__init__()
+        self.parquet_paths = parquet_paths
+        self.image_height = image_height
+        self.image_width = image_width
+        self.mean = mean
+        self.std = std
+        self.single_channel = single_channel
+        self.create_attributes
+        self.create_augmentations
+
+    @property
+    def create_attributes(self) -> None:
+        self.row_groups = [
+            (path, row_group) for path in self.parquet_paths
+            for row_group in range(pq.ParquetFile(path).num_row_groups)
+        ]
+
+    @property
+    def create_augmentations(self) -> None:
+        if self.single_channel:
+            self.aug = None
+            return
+        self.aug = albumentations.Compose([
+            albumentations.Resize(self.image_height,
+                                  self.image_width,
+                                  always_apply=True),
+            albumentations.Normalize(self.mean, self.std, always_apply=True)
+        ])
+
+    @staticmethod
+    def read_row_group(path: str, row_group: int) -> Tuple[np.array, np.array]:
+        table = pq.ParquetFile(path).read_row_group(row_group)
+        id_column = table.column_names.index('image_id')
+        image_ids = np.array(table.column(id_column).to_pylist())
+        images = np.empty((table.num_rows, table.num_columns - 1),
+                          dtype=np.uint8)
+        pixel_columns = [
+            idx for idx in range(table.num_columns) if idx != id_column
+        ]
+        for position, idx in enumerate(pixel_columns):
+            images[:, position] = table.column(idx).to_numpy()
+        return image_ids, images
+
+    def _worker_row_groups(self) -> List[Tuple[str, int]]:
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is None:
+            return self.row_groups
+        return self.row_groups[worker_info.id::worker_info.num_workers]
+
+    def _transform(self, image: np.array) -> torch.Tensor:
+        if self.single_channel:
+            return torch.from_numpy(
+                image.reshape(1, self.image_height, self.image_width).copy())
+        image = image.reshape(self.image_height,
+                              self.image_width).astype(float)
+        image = np.array(Image.fromarray(image).convert("RGB"))
+        image = self.aug(image=image)["image"]
+        return torch.tensor(np.transpose(image, (2, 0, 1)), dtype=torch.float)
+
+    def __iter__(self):
+        row_groups = self._worker_row_groups()
+        if not row_groups:
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self.read_row_group, *row_groups[0])
+            for next_row_group in row_groups[1:] + [None]:
+                image_ids, images = pending.result()
+                if next_row_group is not None:
+                    pending = executor.submit(self.read_row_group,
+                                              *next_row_group)
+                for idx, image_id in enumerate(image_ids):
+                    yield {
+                        "image": self._transform(images[idx]),
+                        "image_id": image_id
+                    }
+                del image_ids, images
+
+
+def pad_token_inputs(inputs: Dict[str, np.array],
+                     max_len: int = None) -> Dict[str, torch.Tensor]:
+    """Right-pads cached token fields with zeros to max_len, if given"""
+    padded = {}
+    for field, name in zip(token_cache.FIELDS,
+                           ("ids", "token_type_ids", "attention_mask")):
+        array = np.zeros(max_len or len(inputs[field]), dtype=np.int64)
+        array[:len(inputs[field])] = inputs[field]
+        padded[name] = torch.from_numpy(array)
+    return padded
+
+
+def approximate_token_lengths(texts: List[np.array], max_len: int) -> np.array:
+    """
+    Cheap token length estimate (whitespace words plus special tokens)
+    used to bucket samples when no token cache is available
+    """
+    words = sum(
+        pd.Series(text).astype(str).str.split().str.len().values
+        for text in texts)
+    return np.minimum(words + len(texts) + 1, max_len)
+
+
 class GoogleQADataSetTrain(Dataset):
     """
     Google QuestionAnswer dataset to train and
@@ -205,17 +397,34 @@ class GoogleQADataSetTrain(Dataset):
         folds {List[int]} -- Folds to use for training/validation.
         tokenizer {transformers.BertTokenzier} -- Tokenizer to turn text into tokens.
         max_len {int} -- Maximum length of a sentence.
+        cache_dir {str} -- Directory of pre-tokenized caches; when given the
+        data is tokenized once with a fast tokenizer (see token_cache.py).
+        tokenizer_name {str} -- Name of the pretrained fast tokenizer used to
+        build the cache.
+        dynamic_padding {bool} -- Return unpadded token tensors, to be padded
+        per batch by samplers.PaddingCollator.
 
     Returns:
         torch.Dataset
     """
-    def __init__(self, data_folder: str, folds: List[int], tokenizer: Any,
-                 max_len: int):
+    def __init__(self,
+                 data_folder: str,
+                 folds: List[int],
+                 tokenizer: Any,
+                 max_len: int,
+                 cache_dir: str = None,
+                 tokenizer_name: str = 'bert-base-uncased',
+                 dynamic_padding: bool = False):
         super().__init__()
         self.data_folder = data_folder
         self.folds = folds
+        self.folds_path = cross_validators.resolve_folds_path(
+            f'{data_folder}/train-folds.csv')
         self.tokenizer = tokenizer
         self.max_len = max_len
+        self.cache_dir = cache_dir
+        self.tokenizer_name = tokenizer_name
+        self.dynamic_padding = dynamic_padding
         self.create_attributes
 
     @property
@@ -224,21 +433,56 @@ class GoogleQADataSetTrain(Dataset):
             return cross_validators.GoogleQACrossValidator.get_targets(
                 f'{self.data_folder}/sample_submission.csv')
 
-        def _get_features() -> pd.DataFrame:
-            df = pd.read_csv(f'{self.data_folder}/train-folds.csv')
-            return df.loc[df.kfold.isin(self.folds)].reset_index(drop=True)
+        def _get_features(test_columns: List[str]) -> pd.DataFrame:
+            df = cross_validators.read_folds(
+                csv_path=self.folds_path,
+                folds=self.folds,
+                columns=['question_title', 'question_body', 'answer'] +
+                test_columns)
+            self.rows = df[cross_validators.ROW_COLUMN].values
+            return df
+
+        def _get_token_cache() -> token_cache.TokenCache:
+            return token_cache.TokenCache(
+                cache_dir=self.cache_dir,
+                data_path=self.folds_path,
+                tokenizer_name=self.tokenizer_name,
+                max_len=self.max_len,
+                first_columns=['question_title', 'question_body'],
+                second_columns=['answer'])
 
         test_columns = _get_targets()
-        df = _get_features()
+        df = _get_features(test_columns=test_columns)
         self.question_title = df.question_title.values
         self.question_body = df.question_body.values
         self.answer = df.answer.values
         self.targets = df[test_columns].values
+        self.token_cache = _get_token_cache() if self.cache_dir else None
 
     def __len__(self):
         return len(self.answer)
 
+    @property
+    def padded_length(self) -> int:
+        return None if self.dynamic_padding else self.max_len
+
+    @property
+    def lengths(self) -> np.array:
+        """Token length of every sample, used for length bucketing"""
+        if self.token_cache is not None:
+            return self.token_cache.lengths[self.rows]
+        return approximate_token_lengths(
+            texts=[self.question_title, self.question_body, self.answer],
+            max_len=self.max_len)
+
     def __getitem__(self, item: int) -> Dict:
+        if self.token_cache is not None:
+            return {
+                **pad_token_inputs(self.token_cache.get(self.rows[item]),
+                                   max_len=self.padded_length), "targets":
+                torch.tensor(self.targets[item, :], dtype=torch.float)
+            }
+
         def _preprocess(array: np.array) -> str:
             string = str(array)
             return " ".join(string.split())
@@ -263,7 +507,7 @@ class GoogleQADataSetTrain(Dataset):
                                                     body=question_body,
                                                     answer=answer)
 
-        padding = self.max_len - len(ids)
+        padding = 0 if self.dynamic_padding else self.max_len - len(ids)
         ids = _add_padding(ids, padding)
         token_type_ids = _add_padding(token_type_ids, padding)
         mask = _add_padding(mask, padding)
@@ -289,15 +533,30 @@ class GoogleQADataSetTest(Dataset):
         data_folder {str} -- Path to unzipped Google Question Answer Kaggle dataset
         tokenizer {transformers.BertTokenzier} -- Tokenizer to turn text into tokens.
         max_len {int} -- Maximum length of a sentence.
+        cache_dir {str} -- Directory of pre-tokenized caches; when given the
+        data is tokenized once with a fast tokenizer (see token_cache.py).
+        tokenizer_name {str} -- Name of the pretrained fast tokenizer used to
+        build the cache.
+        dynamic_padding {bool} -- Return unpadded token tensors, to be padded
+        per batch by samplers.PaddingCollator.
 
     Returns:
         torch.Dataset
     """
-    def __init__(self, data_folder: str, tokenizer: Any, max_len: int):
+    def __init__(self,
+                 data_folder: str,
+                 tokenizer: Any,
+                 max_len: int,
+                 cache_dir: str = None,
+                 tokenizer_name: str = 'bert-base-uncased',
+                 dynamic_padding: bool = False):
         super().__init__()
         self.data_folder = data_folder
         self.tokenizer = tokenizer
         self.max_len = max_len
+        self.cache_dir = cache_dir
+        self.tokenizer_name = tokenizer_name
+        self.dynamic_padding = dynamic_padding
         self.create_attributes
 
     @property
@@ -305,15 +564,42 @@ class GoogleQADataSetTest(Dataset):
         def _get_data() -> pd.DataFrame:
             return pd.read_csv(f'{self.data_folder}/test.csv')
 
+        def _get_token_cache() -> token_cache.TokenCache:
+            return token_cache.TokenCache(
+                cache_dir=self.cache_dir,
+                data_path=f'{self.data_folder}/test.csv',
+                tokenizer_name=self.tokenizer_name,
+                max_len=self.max_len,
+                first_columns=['question_title', 'question_body'],
+                second_columns=['answer'])
+
         df = _get_data()
         self.question_title = df.question_title.values
         self.question_body = df.question_body.values
         self.answer = df.answer.values
+        self.token_cache = _get_token_cache() if self.cache_dir else None
 
     def __len__(self):
         return len(self.answer)
 
+    @property
+    def padded_length(self) -> int:
+        return None if self.dynamic_padding else self.max_len
+
+    @property
+    def lengths(self) -> np.array:
+        """Token length of every sample, used for length bucketing"""
+        if self.token_cache is not None:
+            return self.token_cache.lengths
+        return approximate_token_lengths(
+            texts=[self.question_title, self.question_body, self.answer],
+            max_len=self.max_len)
+
     def __getitem__(self, item):
+        if self.token_cache is not None:
+            return pad_token_inputs(self.token_cache.get(item),
+                                    max_len=self.padded_length)
+
         def _preprocess(array: np.array) -> str:
             string = str(array)
             return " ".join(string.split())
@@ -338,7 +624,7 @@ class GoogleQADataSetTest(Dataset):
                                                     body=question_body,
                                                     answer=answer)
 
-        padding = self.max_len - len(ids)
+        padding = 0 if self.dynamic_padding else self.max_len - len(ids)
         ids = _add_padding(ids, padding)
         token_type_ids = _add_padding(token_type_ids, padding)
         mask = _add_padding(mask, padding)
@@ -365,24 +651,51 @@ class IMDBDataSet(Dataset):
         folds {List[int]} -- Folds to use for training/validation.
         tokenizer {transformers.BertTokenzier} -- Tokenizer to turn text into tokens.
         max_len {int} -- Maximum length of a sentence.
+        cache_dir {str} -- Directory of pre-tokenized caches; when given the
+        data is tokenized once with a fast tokenizer (see token_cache.py).
+        tokenizer_name {str} -- Name of the pretrained fast tokenizer used to
+        build the cache.
+        dynamic_padding {bool} -- Return unpadded token tensors, to be padded
+        per batch by samplers.PaddingCollator.
 
     Returns:
         torch.Dataset
     """
-    def __init__(self, data_folder: str, folds: List[int], tokenizer: Any,
-                 max_len: int):
+    def __init__(self,
+                 data_folder: str,
+                 folds: List[int],
+                 tokenizer: Any,
+                 max_len: int,
+                 cache_dir: str = None,
+                 tokenizer_name: str = 'bert-base-uncased',
+                 dynamic_padding: bool = False):
         super().__init__()
         self.data_folder = data_folder
         self.folds = folds
+        self.folds_path = cross_validators.resolve_folds_path(
+            f'{data_folder}/train-folds.csv')
         self.tokenizer = tokenizer
         self.max_len = max_len
+        self.cache_dir = cache_dir
+        self.tokenizer_name = tokenizer_name
+        self.dynamic_padding = dynamic_padding
         self.create_attributes
 
     @property
     def create_attributes(self) -> None:
         def _get_data() -> pd.DataFrame:
-            df = pd.read_csv(f'{self.data_folder}/train-folds.csv')
-            return df.loc[df.kfold.isin(self.folds)].reset_index(drop=True)
+            df = cross_validators.read_folds(csv_path=self.folds_path,
+                                             folds=self.folds,
+                                             columns=['review', 'sentiment'])
+            self.rows = df[cross_validators.ROW_COLUMN].values
+            return df
+
+        def _get_token_cache() -> token_cache.TokenCache:
+            return token_cache.TokenCache(cache_dir=self.cache_dir,
+                                          data_path=self.folds_path,
+                                          tokenizer_name=self.tokenizer_name,
+                                          max_len=self.max_len,
+                                          first_columns=['review'])
 
         df = _get_data()
         self.review = df.review.values
@@ -390,11 +703,31 @@ class IMDBDataSet(Dataset):
             "positive": 1,
             "negative": 0
         }).values
+        self.token_cache = _get_token_cache() if self.cache_dir else None
 
     def __len__(self):
         return len(self.review)
 
+    @property
+    def padded_length(self) -> int:
+        return None if self.dynamic_padding else self.max_len
+
+    @property
+    def lengths(self) -> np.array:
+        """Token length of every sample, used for length bucketing"""
+        if self.token_cache is not None:
+            return self.token_cache.lengths[self.rows]
+        return approximate_token_lengths(texts=[self.review],
+                                         max_len=self.max_len)
+
     def __getitem__(self, item: int) -> Dict:
+        if self.token_cache is not None:
+            return {
+                **pad_token_inputs(self.token_cache.get(self.rows[item]),
+                                   max_len=self.padded_length), "targets":
+                torch.tensor(self.targets[item], dtype=torch.float)
+            }
+
         def _preprocess(array: np.array) -> str:
             string = str(array)
             return " ".join(string.split())
@@ -416,7 +749,7 @@ class IMDBDataSet(Dataset):
         targets = _preprocess(array=self.targets[item])
         ids, token_type_ids, mask = _encode_strings(review=review)
 
-        padding = self.max_len - len(ids)
+        padding = 0 if self.dynamic_padding else self.max_len - len(ids)
         ids = _add_padding(ids, padding)
         token_type_ids = _add_padding(token_type_ids, padding)
         mask = _add_padding(mask, padding)
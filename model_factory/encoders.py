@@ -0,0 +1,129 @@
+from typing import Dict, List, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+
+class CategoricalEncoder:
+    """
+    Label encoder for many categorical columns at once. Numeric columns
+    are factorized as numbers, with missing values as their last category;
+    other columns are read as strings with missing values replaced by a
+    placeholder. Vocabularies are the sorted arrays of distinct values, so
+    codes match sklearn's LabelEncoder on the same values. Columns are
+    fitted in parallel with pd.factorize and transformed with a hash
+    lookup; values that were not seen during fit go to an unknown bucket,
+    code len(vocabulary). The vocabularies can be saved and loaded so
+    inference reuses the mapping.
+
+    Args:
+        columns {List[str]} -- columns to encode, all columns if None
+        missing {str} -- placeholder for missing values of string columns
+        n_jobs {int} -- number of columns fitted concurrently
+        sort {bool} -- sort vocabularies; without sorting codes follow the
+        order of first appearance, which is faster on large columns
+        as_str {bool} -- read numeric columns as strings too, which sorts
+        them lexicographically like LabelEncoder on values.astype(str)
+    """
+    def __init__(self,
+                 columns: List[str] = None,
+                 missing: str = '-1',
+                 n_jobs: int = -1,
+                 sort: bool = True,
+                 as_str: bool = False):
+        self.columns = columns
+        self.missing = missing
+        self.n_jobs = n_jobs
+        self.sort = sort
+        self.as_str = as_str
+        self.vocabularies: Dict[str, np.array] = {}
+
+    def _values(self, values: pd.Series) -> np.array:
+        if not self.as_str and pd.api.types.is_numeric_dtype(values):
+            return values.to_numpy()
+        return values.fillna(self.missing).astype(str).to_numpy()
+
+    def _factorize(self, values: pd.Series) -> Tuple[np.array, np.array]:
+        codes, vocabulary = pd.factorize(self._values(values), sort=self.sort)
+        vocabulary = np.asarray(vocabulary)
+        if vocabulary.dtype == object:
+            vocabulary = vocabulary.astype(str)
+        missing = codes == -1
+        if missing.any():
+            codes[missing] = len(vocabulary)
+            vocabulary = np.append(vocabulary, np.nan)
+        return codes.astype(np.int32), vocabulary
+
+    def _fit_column(self, values: pd.Series) -> np.array:
+        return self._factorize(values)[1]
+
+    def fit(self, df: pd.DataFrame) -> 'CategoricalEncoder':
+        columns = list(df.columns) if self.columns is None else self.columns
+        vocabularies = joblib.Parallel(n_jobs=self.n_jobs, prefer='threads')(
+            joblib.delayed(self._fit_column)(df[column]) for column in columns)
+        self.columns = columns
+        self.vocabularies = dict(zip(columns, vocabularies))
+        LOGGER.info(f'Fitted {len(columns)} categorical columns with '
+                    f'{sum(map(len, vocabularies))} categories')
+        return self
+
+    @property
+    def cardinalities(self) -> Dict[str, int]:
+        """Number of codes of each column, including the unknown bucket"""
+        return {
+            column: len(vocabulary) + 1
+            for column, vocabulary in self.vocabularies.items()
+        }
+
+    def transform_column(self, column: str, values: pd.Series) -> np.array:
+        vocabulary = self.vocabularies[column]
+        codes = pd.Index(vocabulary).get_indexer(self._values(values))
+        codes[codes == -1] = len(vocabulary)
+        return codes.astype(np.int32)
+
+    def fit_transform_column(self, column: str, values: pd.Series) -> np.array:
+        """Fits a single column and returns its codes from the same pass"""
+        codes, self.vocabularies[column] = self._factorize(values)
+        if self.columns is None:
+            self.columns = []
+        if column not in self.columns:
+            self.columns.append(column)
+        return codes
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Copy of df with the encoded columns replaced by int32 codes"""
+        encoded = df.copy()
+        for column in self.columns:
+            encoded[column] = self.transform_column(column, df[column])
+        return encoded
+
+    def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        return self.fit(df).transform(df)
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(path,
+                            __columns__=np.array(self.columns, dtype=str),
+                            __missing__=np.array(self.missing),
+                            __as_str__=np.array(self.as_str),
+                            **{
+                                f'vocabulary_{idx}': self.vocabularies[column]
+                                for idx, column in enumerate(self.columns)
+                            })
+
+    @classmethod
+    def load(cls, path: str) -> 'CategoricalEncoder':
+        with np.load(path) as arrays:
+            columns = arrays['__columns__'].tolist()
+            encoder = cls(columns=columns,
+                          missing=str(arrays['__missing__']),
+                          as_str=bool(arrays['__as_str__']))
+            encoder.vocabularies = {
+                column: arrays[f'vocabulary_{idx}']
+                for idx, column in enumerate(columns)
+            }
+        return encoder
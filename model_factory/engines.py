@@ -1,4 +1,5 @@
 import os
+import time
 import types
 from abc import ABC, abstractmethod
 from collections import defaultdict
@@ -14,7 +15,12 @@ import transformers
 import yaml
 from torch.utils.data import DataLoader
 
+import augmentations
 import datasets
+import numerai_cache
+import quantization
+import round_sync
+import samplers
 import trainers
 import utils
 
@@ -52,6 +58,45 @@ class Engine(ABC):
     def __init__(self, trainer: trainers.BaseTrainer):
         self.trainer = trainer
 
+    def set_precision(self, precision: str = 'fp32') -> None:
+        """
+        Sets the precision of the forward pass and loss of a torch trainer,
+        fp32 or bf16 autocast
+        """
+        if precision not in trainers.PRECISIONS:
+            raise ValueError(f'precision must be one of {trainers.PRECISIONS}')
+        self.trainer.precision = precision
+        LOGGER.info(f'Training with {precision} precision')
+
+    def compare_precision(self, data_loader: DataLoader) -> Dict[str, Dict]:
+        """
+        Evaluates data_loader with the current weights in fp32 and in the
+        trainer's precision, and logs the throughput and score deltas
+
+        Returns:
+            results {Dict} -- loss, score and samples per second of both
+        """
+        precision = self.trainer.precision
+        results = {}
+        for mode in ('fp32', precision):
+            self.trainer.precision = mode
+            start = time.perf_counter()
+            loss, score = self.trainer.evaluate(data_loader)
+            elapsed = time.perf_counter() - start
+            results[mode] = {
+                'loss': loss,
+                'score': score,
+                'samples_per_second': len(data_loader.dataset) / elapsed
+            }
+        self.trainer.precision = precision
+        fp32, mixed = results['fp32'], results[precision]
+        LOGGER.info(
+            f'{precision} vs fp32: '
+            f'{mixed["samples_per_second"] / fp32["samples_per_second"]:.2f}x '
+            f'throughput, score delta {mixed["score"] - fp32["score"]:+.4f}, '
+            f'loss delta {mixed["loss"] - fp32["loss"]:+.4f}')
+        return results
+
     @abstractmethod
     def run_training_engine(self):
         """Wraps logic to train and evaluate"""
@@ -63,6 +108,40 @@ class Engine(ABC):
         raise NotImplementedError()
 
 
+def get_token_loader(dataset: Any,
+                     batch_size: int,
+                     shuffle: bool,
+                     num_workers: int,
+                     data_params: Dict,
+                     keep_order: bool = False) -> DataLoader:
+    """
+    Builds a DataLoader for a BERT dataset. With data_params.dynamic_padding
+    batches are padded to their longest sequence instead of max_len and,
+    unless keep_order is set, drawn from length buckets. Test loaders keep
+    the dataset order so predictions line up with the submission rows.
+    """
+    if not data_params.get("dynamic_padding"):
+        return DataLoader(dataset=dataset,
+                          batch_size=batch_size,
+                          shuffle=shuffle,
+                          num_workers=num_workers)
+    if keep_order:
+        return DataLoader(dataset=dataset,
+                          batch_size=batch_size,
+                          shuffle=False,
+                          collate_fn=samplers.PaddingCollator(),
+                          num_workers=num_workers)
+    batch_sampler = samplers.BucketBatchSampler(lengths=dataset.lengths,
+                                                batch_size=batch_size,
+                                                bucket_size=data_params.get(
+                                                    "bucket_size", 100),
+                                                shuffle=shuffle)
+    return DataLoader(dataset=dataset,
+                      batch_sampler=batch_sampler,
+                      collate_fn=samplers.PaddingCollator(),
+                      num_workers=num_workers)
+
+
 # requires CUDA to be enabled for OSX
 class BengaliEngine(Engine):
     """
@@ -79,6 +158,8 @@ class BengaliEngine(Engine):
             - train_path {str}: "inputs/train-folds.csv",
             - test_path {str}: "inputs",
             - pickle_path {str}: "inputs/pickled_images",
+            - image_store_path {str}: "inputs/image_store" (optional,
+              replaces pickle_path)
             - model_dir {str}: "trained_models",
             - train_folds {List[int]}: [0],
             - val_folds {List[int]}: [4],
@@ -89,18 +170,60 @@ class BengaliEngine(Engine):
             - image_height {int}: 137,
             - image_width {int}: 236,
             - mean {Tuple[float]}: (0.485, 0.456, 0.406),
-            - std {Tuple[float]}: (0.229, 0.239, 0.225)
+            - std {Tuple[float]}: (0.229, 0.239, 0.225),
+            - single_channel {bool}: False (optional, feeds uint8 grayscale
+              images to a model converted with `to_single_channel`)
+            - augmentation_stage {str}: "sample" (optional, "batch" moves
+              augmentation and normalization after collation)
+            - stream_test {bool}: False (optional, streams the test parquet
+              files row group by row group during inference)
+            - num_workers {int}: 4 (optional, DataLoader workers)
+            - device {str}: "cuda:1" (optional, trains on this device only
+              instead of data parallel over every GPU)
+            - metrics_every_n {int}: 1 (optional, training metrics are
+              computed on every n-th batch)
+            - precision {str}: "fp32" (optional, "bf16" runs the forward
+              pass and loss under bfloat16 autocast)
+            - compare_precision {bool}: False (optional, evaluates the
+              final model in fp32 and in precision and logs the deltas)
+            - checkpoint_path {str}: "checkpoint.pt" (optional, early
+              stopping checkpoint, one per concurrently trained fold)
     """
     def __init__(self, trainer: trainers.BaseTrainer, params: Dict):
         super().__init__(trainer)
         self.training_constructor = datasets.BengaliDataSetTrain
         self.val_constructor = datasets.BengaliDataSetTrain
         self.test_constructor = datasets.BengaliDataSetTest
+        self.test_stream_constructor = datasets.BengaliDataSetTestStream
         self.params = params
         self.get_available_device_ids
+        self.setup_image_transforms
+        self.trainer.metrics_every_n = self.params.get("metrics_every_n", 1)
+        self.set_precision(self.params.get("precision", "fp32"))
+        self.trainer.early_stopping.path = self.params.get(
+            "checkpoint_path", self.trainer.early_stopping.path)
         self.model_name = None
         self.model_state_path = None
 
+    @property
+    def setup_image_transforms(self) -> None:
+        self.single_channel = self.params.get("single_channel", False)
+        self.batch_augmentation = self.params.get("augmentation_stage",
+                                                  "sample") == "batch"
+        channels = 1 if self.single_channel else 3
+        normalize = augmentations.BatchNormalize(mean=self.params["mean"],
+                                                 std=self.params["std"],
+                                                 channels=channels)
+        if self.batch_augmentation:
+            self.trainer.train_transform = augmentations.BatchAugmentation(
+                mean=self.params["mean"],
+                std=self.params["std"],
+                channels=channels)
+            self.trainer.eval_transform = normalize
+        elif self.single_channel:
+            self.trainer.train_transform = normalize
+            self.trainer.eval_transform = normalize
+
     @property
     def get_available_device_ids(self) -> None:
         self.device_ids = [id for id in range(torch.cuda.device_count())]
@@ -119,15 +242,18 @@ class BengaliEngine(Engine):
             self, f'{name}_set',
             constructor(train_path=self.params["train_path"],
                         pickle_path=self.params["pickle_path"],
+                        image_store_path=self.params.get("image_store_path"),
                         folds=folds,
                         image_height=self.params["image_height"],
                         image_width=self.params["image_width"],
                         mean=self.params["mean"],
-                        std=self.params["std"]))
+                        std=self.params["std"],
+                        single_channel=self.single_channel,
+                        batch_augmentation=self.batch_augmentation))
         return DataLoader(dataset=getattr(self, f'{name}_set'),
                           batch_size=batch_size,
                           shuffle=True,
-                          num_workers=4)
+                          num_workers=self.params.get("num_workers", 4))
 
     def _get_all_testing_loaders(self) -> List[DataLoader]:
         def _get_loader(df: pd.DataFrame) -> DataLoader:
@@ -136,12 +262,30 @@ class BengaliEngine(Engine):
                 image_height=self.params["image_height"],
                 image_width=self.params["image_width"],
                 mean=self.params["mean"],
-                std=self.params["std"])
+                std=self.params["std"],
+                single_channel=self.single_channel or self.batch_augmentation)
             return DataLoader(dataset=test_set,
                               batch_size=self.params["test_batch_size"],
                               shuffle=False,
                               num_workers=4)
 
+        def _get_stream_loader() -> DataLoader:
+            test_set = self.test_stream_constructor(
+                parquet_paths=[
+                    f"{self.params['test_path']}/test_image_data_{idx}.parquet"
+                    for idx in range(4)
+                ],
+                image_height=self.params["image_height"],
+                image_width=self.params["image_width"],
+                mean=self.params["mean"],
+                std=self.params["std"],
+                single_channel=self.single_channel or self.batch_augmentation)
+            return DataLoader(dataset=test_set,
+                              batch_size=self.params["test_batch_size"],
+                              num_workers=1)
+
+        if self.params.get("stream_test"):
+            return [_get_stream_loader()]
         loaders = []
         for idx in range(4):
             df = pd.read_parquet(
@@ -151,9 +295,11 @@ class BengaliEngine(Engine):
 
     def run_training_engine(self,
                             save_to_s3: bool = False,
-                            creds: Dict = None) -> None:
+                            creds: Dict = None) -> Dict:
         """
         Trains a ResNet34 model for the BengaliAI bengali grapheme competition.
+        Returns the validation folds, best validation score and checkpoint
+        path of the run.
 
         Args:
             save_to_s3 {bool} - save model to s3 bucket
@@ -170,7 +316,9 @@ class BengaliEngine(Engine):
             f'Validating the model using folds {self.params["val_folds"]}')
         LOGGER.info(f'Using {len(self.device_ids)} GPUs')
         LOGGER.info(f'GPU ids: {self.device_ids}')
-        if len(self.device_ids) > 1:
+        if self.params.get("device"):
+            self.trainer.device = torch.device(self.params["device"])
+        elif len(self.device_ids) > 1:
             LOGGER.info(f'Master Node: {self.available_devices[0]}')
             torch.cuda.set_device(self.available_devices[0])
             self.trainer.device = torch.device("cuda")
@@ -209,6 +357,13 @@ class BengaliEngine(Engine):
             if self.trainer.early_stopping.early_stop:
                 LOGGER.info(f"Early stopping at epoch: {epoch}")
                 break
+        if self.params.get("compare_precision"):
+            self.compare_precision(data_loader=val)
+        return {
+            "val_folds": self.params["val_folds"],
+            "best_score": best_score,
+            "model_state_path": self.model_state_path
+        }
 
     def run_inference_engine(self,
                              model_name: str,
@@ -244,7 +399,7 @@ class BengaliEngine(Engine):
             testing_loaders = self._get_all_testing_loaders()
             for loader in testing_loaders:
                 for batch, data in enumerate(loader):
-                    image = self.trainer._load_to_gpu_float(data["image"])
+                    image = self.trainer._get_image(data=data, train=False)
                     grapheme, vowel, consonant = self.trainer.model(image)
                     for idx, img_id in enumerate(data["image_id"]):
                         predictions["grapheme"].append(
@@ -315,11 +470,18 @@ class GoogleQAEngine(Engine):
     def __init__(self, trainer: trainers.BaseTrainer, config_file: str):
         super().__init__(trainer)
         self.params: Dict = self.get_params(config_file)
-        self.train_contructor = datasets.GoogleQADataSetTrain
-        self.val_contructor = datasets.GoogleQADataSetTrain
-        self.test_contructor = datasets.GoogleQADataSetTest
+        self.train_constructor = datasets.GoogleQADataSetTrain
+        self.val_constructor = datasets.GoogleQADataSetTrain
+        self.test_constructor = datasets.GoogleQADataSetTest
+        self.tokenizer_name = 'bert-base-uncased'
         self.tokenizer = transformers.BertTokenizer.from_pretrained(
-            'bert-base-uncased', do_lower_case=True)
+            self.tokenizer_name, do_lower_case=True)
+        self.trainer.batch_stats = samplers.BatchShapeStats(
+            max_len=self.params["data_params"].get("max_len"))
+        self.trainer.metrics_every_n = self.params["training_params"].get(
+            "metrics_every_n", 1)
+        self.set_precision(self.params["training_params"].get(
+            "precision", "fp32"))
 
     def _get_training_loader(self, folds: List[int], name: str) -> DataLoader:
         if name == "val":
@@ -332,23 +494,34 @@ class GoogleQAEngine(Engine):
             constructor(
                 data_folder=self.params["data_params"].get("train_path"),
                 folds=folds,
-                tokenizer=self.tokenzier,
-                max_len=self.params["data_params"].get("max_len")))
-        return DataLoader(dataset=getattr(self, f'{name}_set'),
-                          batch_size=batch_size,
-                          shuffle=True,
-                          num_workers=4)
+                tokenizer=self.tokenizer,
+                max_len=self.params["data_params"].get("max_len"),
+                cache_dir=self.params["data_params"].get("cache_dir"),
+                tokenizer_name=self.tokenizer_name,
+                dynamic_padding=self.params["data_params"].get(
+                    "dynamic_padding", False)))
+        return get_token_loader(dataset=getattr(self, f'{name}_set'),
+                                batch_size=batch_size,
+                                shuffle=name == "train",
+                                num_workers=4,
+                                data_params=self.params["data_params"])
 
     def _get_testing_loader(self, folds: List[int]) -> DataLoader:
         test_set = self.test_constructor(
             data_folder=self.params["data_params"].get("test_path"),
             folds=folds,
-            tokenizer=self.tokenzier,
-            max_len=self.params["data_params"].get("max_len"))
-        return DataLoader(dataset=test_set,
-                          batch_size=self.params["test_batch_size"],
-                          shuffle=False,
-                          num_workers=4)
+            tokenizer=self.tokenizer,
+            max_len=self.params["data_params"].get("max_len"),
+            cache_dir=self.params["data_params"].get("cache_dir"),
+            tokenizer_name=self.tokenizer_name,
+            dynamic_padding=self.params["data_params"].get(
+                "dynamic_padding", False))
+        return get_token_loader(dataset=test_set,
+                                batch_size=self.params["test_batch_size"],
+                                shuffle=False,
+                                num_workers=4,
+                                data_params=self.params["data_params"],
+                                keep_order=True)
 
     @staticmethod
     def get_params(config_file: str) -> Dict:
@@ -400,6 +573,8 @@ class GoogleQAEngine(Engine):
             if self.trainer.early_stopping.early_stop:
                 LOGGER.info(f'Early stopping at epoch: {epoch}')
                 break
+        if self.params["training_params"].get("compare_precision"):
+            self.compare_precision(data_loader=val)
 
     def run_inference_engine(self):
         pass
@@ -409,11 +584,18 @@ class IMDBEngine(Engine):
     def __init__(self, trainer: trainers.BaseTrainer, config_file: str):
         super().__init__(trainer)
         self.params: Dict = self.get_params(config_file)
-        self.train_contructor = datasets.IMDBDataSet
-        self.val_contructor = datasets.IMDBDataSet
-        self.test_contructor = datasets.IMDBDataSet
+        self.train_constructor = datasets.IMDBDataSet
+        self.val_constructor = datasets.IMDBDataSet
+        self.test_constructor = datasets.IMDBDataSet
+        self.tokenizer_name = 'bert-base-uncased'
         self.tokenizer = transformers.BertTokenizer.from_pretrained(
-            'bert-base-uncased', do_lower_case=True)
+            self.tokenizer_name, do_lower_case=True)
+        self.trainer.batch_stats = samplers.BatchShapeStats(
+            max_len=self.params["data_params"].get("max_len"))
+        self.trainer.metrics_every_n = self.params["training_params"].get(
+            "metrics_every_n", 1)
+        self.set_precision(self.params["training_params"].get(
+            "precision", "fp32"))
 
     def _get_training_loader(self, folds: List[int], name: str) -> DataLoader:
         if name == "val":
@@ -426,12 +608,17 @@ class IMDBEngine(Engine):
             constructor(
                 data_folder=self.params["data_params"].get("train_path"),
                 folds=folds,
-                tokenizer=self.tokenzier,
-                max_len=self.params["data_params"].get("max_len")))
-        return DataLoader(dataset=getattr(self, f'{name}_set'),
-                          batch_size=batch_size,
-                          shuffle=True,
-                          num_workers=4)
+                tokenizer=self.tokenizer,
+                max_len=self.params["data_params"].get("max_len"),
+                cache_dir=self.params["data_params"].get("cache_dir"),
+                tokenizer_name=self.tokenizer_name,
+                dynamic_padding=self.params["data_params"].get(
+                    "dynamic_padding", False)))
+        return get_token_loader(dataset=getattr(self, f'{name}_set'),
+                                batch_size=batch_size,
+                                shuffle=name == "train",
+                                num_workers=4,
+                                data_params=self.params["data_params"])
 
     def _get_testing_loader(self) -> DataLoader:
         setattr(
@@ -439,12 +626,18 @@ class IMDBEngine(Engine):
             self.test_constructor(
                 data_folder=self.params["data_params"].get("test_path"),
                 folds=self.params["training_params"].get("test_folds"),
-                tokenizer=self.tokenzier,
-                max_len=self.params["data_params"].get("max_len")))
-        return DataLoader(dataset=getattr(self, 'test_set'),
-                          batch_size=self.params["test_batch_size"],
-                          shuffle=False,
-                          num_workers=1)
+                tokenizer=self.tokenizer,
+                max_len=self.params["data_params"].get("max_len"),
+                cache_dir=self.params["data_params"].get("cache_dir"),
+                tokenizer_name=self.tokenizer_name,
+                dynamic_padding=self.params["data_params"].get(
+                    "dynamic_padding", False)))
+        return get_token_loader(dataset=getattr(self, 'test_set'),
+                                batch_size=self.params["test_batch_size"],
+                                shuffle=False,
+                                num_workers=1,
+                                data_params=self.params["data_params"],
+                                keep_order=True)
 
     @staticmethod
     def get_params(config_file: str) -> Dict:
@@ -496,6 +689,8 @@ class IMDBEngine(Engine):
             if self.trainer.early_stopping.early_stop:
                 LOGGER.info(f'Early stopping at epoch: {epoch}')
                 break
+        if self.params["training_params"].get("compare_precision"):
+            self.compare_precision(data_loader=val)
 
     def run_inference_engine(self):
         pass
@@ -525,6 +720,7 @@ class NumerAIEngine:
         self.load_trainer_params
         self.setup_trainers
         self.setup_data
+        self.setup_features
 
     @property
     def load_trainer_params(self) -> None:
@@ -541,20 +737,71 @@ class NumerAIEngine:
 
     @property
     def setup_data(self):
+        cache_dir = self.trainer_params.get('data_cache_dir')
+        cache = numerai_cache.NumerAIDataCache(
+            cache_dir) if cache_dir else None
+        self.cache = cache
         if self.trainer_params['get_current_data']:
             napi = numerapi.NumerAPI(verbosity="info")
-            if napi.check_new_round():
+            if cache is not None:
+                round_number = napi.get_current_round()
+                self.data = cache.load_round(round_number=round_number)
+                if self.data is not None:
+                    LOGGER.info(f'Loaded round {round_number} from cache')
+                    return
+            if self.trainer_params.get('round_cache_dir'):
+                self.data = self.sync_tournament_data(cache=cache)
+            elif napi.check_new_round():
                 LOGGER.info('Loading current dataset from NumerAPI..')
                 self.data = self.get_tournament_data()
+                if cache is not None:
+                    self.data = cache.save(data=self.data,
+                                           zip_path='numerai_dataset.zip',
+                                           round_number=round_number)
         else:
             if os.path.isfile(self.trainer_params['local_data']):
                 LOGGER.info(
                     f"Loading data locally from {self.trainer_params['local_data']}"
                 )
-                self.data = nx.load_zip(self.trainer_params['local_data'])
+                if cache is not None:
+                    self.data = cache.load(
+                        zip_path=self.trainer_params['local_data'],
+                        round_number=self.trainer_params.get('round'))
+                else:
+                    self.data = nx.load_zip(self.trainer_params['local_data'])
             else:
                 return FileNotFoundError('local data not found')
 
+    @property
+    def setup_features(self) -> None:
+        """
+        uint8 codes of the features, shared by every tournament's trainer.
+        Rounds opened from the data cache reuse the codes stored with them.
+        """
+        self.features = getattr(self, 'data', None)
+        if self.features is None or not self.trainer_params.get(
+                'quantize_features', True):
+            return
+        features = None
+        if self.cache is not None:
+            features = self.cache.quantize(self.data)
+        if features is None:
+            features = quantization.QuantizedData.from_data(self.data)
+        self.features = features
+
+    def sync_tournament_data(
+            self,
+            cache: numerai_cache.NumerAIDataCache = None) -> nx.data.Data:
+        """Loads the current round through the local round cache"""
+        sync = round_sync.RoundSync(
+            cache_dir=self.trainer_params['round_cache_dir'],
+            backend=round_sync.NumerAPIBackend())
+        round_number = sync.backend.napi.get_current_round()
+        zip_path = sync.sync(round_number=round_number)
+        if cache is not None:
+            return cache.load(zip_path=zip_path, round_number=round_number)
+        return nx.load_zip(zip_path)
+
     @staticmethod
     def get_tournament_data() -> nx.data.Data:
         try:
@@ -566,7 +813,10 @@ class NumerAIEngine:
 
     def run_training_engine(self) -> None:
         for trainer in self.trainers:
-            trainer.train_model(data=self.data)
+            if self.trainer_params.get('cross_validation'):
+                trainer.cross_validate(data=self.features['train'],
+                                       eval_data=self.features['validation'])
+            trainer.train_model(data=self.features)
             trainer.save_model_locally()
             trainer.save_to_s3()
 
@@ -575,7 +825,7 @@ class NumerAIEngine:
         for trainer, tournament in zip(self.trainers, self.tourament_names):
             trainer.load_from_s3()
             predictions = trainer.make_predictions_and_prepare_submission(
-                data=self.data, submit=self.submit)
+                data=self.features, submit=self.submit)
             self.evaluate_predictions(predictions=predictions,
                                       trainer=trainer,
                                       tournament=tournament)
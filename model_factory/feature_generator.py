@@ -1,6 +1,7 @@
+import functools
 import os
 from abc import ABC, abstractmethod
-from typing import Any, List, Tuple
+from typing import Any, Callable, Dict, List, Tuple
 
 import joblib
 import nltk
@@ -8,31 +9,152 @@ import numpy as np
 import pandas as pd
 from nltk.stem import SnowballStemmer
 from nltk.tokenize import word_tokenize
-from sklearn import metrics, preprocessing
+from sklearn import metrics
+from sklearn.feature_extraction.text import CountVectorizer
 
+import aggregations
 import dispatcher
+import encoders
+import feature_store
 import utils
 
 nltk.download('punkt')
 
 LOGGER = utils.get_logger(__name__)
 
+# stemmer and stem cache of the current worker process
+_STEM_CACHE: Dict[int, Callable[[str], str]] = {}
 
-def label_encode_all_features(train: pd.DataFrame, val: pd.DataFrame) -> Tuple:
-    for col in train.columns:
-        LOGGER.info(f'Preprocessing column {col}')
-        lbl = preprocessing.LabelEncoder()
-        lbl.fit(train[col].values.tolist() + val[col].values.tolist())
-        train[col] = lbl.transform(train[col].values)
-        val[col] = lbl.transform(val[col].values)
 
-    return train, val
+def _get_stem(cache_size: int) -> Callable[[str], str]:
+    if cache_size not in _STEM_CACHE:
+        stemmer = SnowballStemmer('english')
+        _STEM_CACHE[cache_size] = functools.lru_cache(maxsize=cache_size)(
+            stemmer.stem)
+    return _STEM_CACHE[cache_size]
+
+
+def _preprocess_chunk(texts: List[str],
+                      cache_size: int) -> Tuple[np.array, np.array, np.array]:
+    """Chunk-local int32 stem codes, the stem of every code and row lengths"""
+    stem = _get_stem(cache_size)
+    stems = []
+    lengths = np.empty(len(texts), dtype=np.int64)
+    for row, text in enumerate(texts):
+        tokens = word_tokenize(" ".join(text.split()))
+        stems.extend(stem(token) for token in tokens)
+        lengths[row] = len(tokens)
+    codes, uniques = pd.factorize(np.array(stems, dtype=object))
+    return codes.astype(np.int32), np.asarray(uniques, dtype=object), lengths
+
+
+class TokenizedText:
+    """
+    Ragged stemmed tokens of a text column: row i holds the stems
+    vocabulary[ids[offsets[i]:offsets[i + 1]]].
+
+    Args:
+        ids {np.array} -- flat int32 stem ids
+        offsets {np.array} -- int64 start of every row in ids, plus the end
+        vocabulary {np.array} -- stem of every id
+    """
+    def __init__(self, ids: np.array, offsets: np.array, vocabulary: np.array):
+        self.ids = ids
+        self.offsets = offsets
+        self.vocabulary = vocabulary
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item: int) -> List[str]:
+        ids = self.ids[self.offsets[item]:self.offsets[item + 1]]
+        return self.vocabulary[ids].tolist()
+
+    @property
+    def lengths(self) -> np.array:
+        return np.diff(self.offsets)
+
+
+class TextPreprocessor:
+    """
+    Collapses whitespace, tokenizes and stems text columns in chunks over a
+    process pool. Every worker keeps one SnowballStemmer and an LRU cache of
+    stems, which covers most tokens since word frequencies are Zipfian.
+    Chunks come back as local codes and are merged into one vocabulary
+    shared by all columns.
+
+    Args:
+        n_jobs {int} -- number of worker processes
+        chunk_size {int} -- rows processed per task
+        cache_size {int} -- stems memoized per worker
+    """
+    def __init__(self,
+                 n_jobs: int = -1,
+                 chunk_size: int = 10000,
+                 cache_size: int = 1 << 16):
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+
+    def transform(self, df: pd.DataFrame,
+                  columns: List[str]) -> Dict[str, TokenizedText]:
+        texts = {
+            column: df[column].fillna('').astype(str).tolist()
+            for column in columns
+        }
+        tasks = [(column, start) for column in columns
+                 for start in range(0, len(df), self.chunk_size)]
+        results = joblib.Parallel(n_jobs=self.n_jobs)(
+            joblib.delayed(_preprocess_chunk)(
+                texts=texts[column][start:start + self.chunk_size],
+                cache_size=self.cache_size) for column, start in tasks)
+        vocabulary = np.asarray(pd.unique(
+            np.concatenate([uniques for _, uniques, _ in results])),
+                                dtype=object)
+        stem_ids = pd.Index(vocabulary)
+        columns_ids = {column: [] for column in columns}
+        columns_lengths = {column: [] for column in columns}
+        for (column, _), (codes, uniques, lengths) in zip(tasks, results):
+            chunk_ids = stem_ids.get_indexer(uniques).astype(np.int32)
+            columns_ids[column].append(chunk_ids[codes])
+            columns_lengths[column].append(lengths)
+        tokenized = {}
+        for column in columns:
+            lengths = np.concatenate(columns_lengths[column])
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            tokenized[column] = TokenizedText(ids=np.concatenate(
+                columns_ids[column]),
+                                              offsets=offsets,
+                                              vocabulary=vocabulary)
+        LOGGER.info(f'Preprocessed {len(df)} rows of {columns}: '
+                    f'{len(vocabulary)} distinct stems')
+        return tokenized
+
+
+def label_encode_all_features(train: pd.DataFrame, val: pd.DataFrame) -> Tuple:
+    encoder = encoders.CategoricalEncoder(columns=list(train.columns)).fit(
+        pd.concat([train, val], ignore_index=True))
+    return encoder.transform(train), encoder.transform(val)
 
 
 class FeatureGenerator(ABC):
-    def __init__(self, name: str):
+    """
+    Base class of feature generators. With a feature store, features made
+    through load_or_create_features are computed once per input data,
+    generator version, method and parameters and reloaded afterwards; bump
+    version whenever a subclass changes how its features are computed.
+
+    Args:
+        name {str} -- name of the generator
+        store {FeatureStore} -- optional store of computed features
+    """
+    version = 1
+
+    def __init__(self, name: str, store: feature_store.FeatureStore = None):
         super().__init__()
         self.name = name
+        self.store = store
 
     def __repr__(self):
         return self.name
@@ -44,21 +166,50 @@ class FeatureGenerator(ABC):
     def create_features(self) -> Tuple:
         pass
 
+    def features_key(self, X: pd.DataFrame, method: str, params: Dict) -> str:
+        return self.store.key(data_hash=feature_store.hash_frame(X),
+                              generator=type(self).__name__,
+                              version=self.version,
+                              method=method,
+                              params=params)
+
+    def load_or_create_features(self, method: str, X: pd.DataFrame,
+                                **params) -> feature_store.FeatureSet:
+        """
+        Features from getattr(self, method)(X, **params), loaded from the
+        store when they were computed before
+        """
+        if self.store is None:
+            raise ValueError(f'{self.name} has no feature store')
+        key = self.features_key(X=X, method=method, params=params)
+        if self.store.has(key):
+            LOGGER.info(f'Loading {method} features of {self.name} from store')
+            return self.store.open(key)
+        features = getattr(self, method)(X, **params)
+        return self.store.save(key=key,
+                               features=features,
+                               description={
+                                   'generator': type(self).__name__,
+                                   'version': self.version,
+                                   'method': method,
+                                   'params': params
+                               })
+
     def save_features(self, X: pd.DataFrame) -> None:
         X.to_csv(f"X_{self.name}.csv", index=False)
 
 
 class QuoraFeatureGenerator(FeatureGenerator):
-    def __init__(self, name: str):
-        super().__init__(name)
+    def __init__(self, name: str, store: feature_store.FeatureStore = None):
+        super().__init__(name, store)
+        self._overlap = None
 
-    def create_features(self, X: pd.DataFrame) -> pd.DataFrame:
-        def _preprocess(X: pd.DataFrame):
-            X.apply(self.remove_spaces, axis=1)
-            X.apply(self.tokenize_words, axis=1)
-            X.apply(self.stemm_words, axis=1)
-
-        return _preprocess(X=X)
+    def create_features(self,
+                        X: pd.DataFrame,
+                        columns: List[str] = ['question1', 'question2'],
+                        n_jobs: int = -1) -> Dict[str, TokenizedText]:
+        """Whitespace-normalized, tokenized and stemmed question columns"""
+        return TextPreprocessor(n_jobs=n_jobs).transform(df=X, columns=columns)
 
     def remove_spaces(self, text: str) -> str:
         processed_string = text.strip().split()
@@ -68,48 +219,96 @@ class QuoraFeatureGenerator(FeatureGenerator):
         return word_tokenize(text)
 
     def stemm_words(self, text: str) -> str:
-        stemmer = SnowballStemmer('english')
-        return stemmer.stem(text)
+        return _get_stem(cache_size=1 << 16)(text)
 
     def create_frequency_feats(self, df: pd.DataFrame, feat: str,
                                stat: str) -> pd.DataFrame:
-        return df.groupby(feat)[feat].transform(stat)
+        # statistics other than count aggregate the key itself, which the
+        # builder can only do for numeric keys
+        if stat not in aggregations.STATISTICS or (
+                stat != 'count'
+                and not pd.api.types.is_numeric_dtype(df[feat])):
+            return df.groupby(feat)[feat].transform(stat)
+        builder = aggregations.AggregationFeatureBuilder(
+            keys=[feat],
+            statistics=[stat],
+            values=None if stat == 'count' else [feat])
+        # groupby leaves rows with a missing key out
+        return builder.fit_transform(df).iloc[:, 0].where(df[feat].notna())
+
+    def create_aggregation_feats(self,
+                                 df: pd.DataFrame,
+                                 keys: List[str],
+                                 statistics: List[str] = ['count'],
+                                 values: List[str] = None) -> pd.DataFrame:
+        """Every statistic of values per key, one factorization per key"""
+        return aggregations.AggregationFeatureBuilder(
+            keys=keys, statistics=statistics, values=values).fit_transform(df)
 
     def create_length_feats(self, df: pd.DataFrame, feat: str) -> pd.DataFrame:
         return df[feat].str.len()
 
     def create_n_words_feats(self, df: pd.DataFrame,
                              feat: str) -> pd.DataFrame:
-        return df[feat].apply(lambda x: len(x.split()))
+        return df[feat].fillna('').str.split().str.len()
 
-    def create_quora_total_words_feats(self, df: pd.DataFrame) -> pd.DataFrame:
-        def _normalize(row: pd.Series) -> float:
-            word1 = set(
-                map(lambda x: x.lower().strip(), row['question1'].split()))
-            word2 = set(
-                map(lambda x: x.lower().strip(), row['question2'].split()))
-            return 1.0 * (len(word1) + len(word2))
+    def create_quora_overlap_feats(
+        self,
+        df: pd.DataFrame,
+        columns: Tuple[str, str] = ('question1', 'question2')
+    ) -> pd.DataFrame:
+        """
+        Word count and overlap features of a question pair in one pass.
+        Both columns are lowercased, split on whitespace and counted into
+        a single sparse bag of words with a shared vocabulary, so every
+        feature is a row sum or an elementwise product of sparse matrices.
+
+        Args:
+            df {pd.DataFrame} -- data holding the question columns
+            columns {Tuple[str, str]} -- the two text columns to compare
+
+        Returns:
+            features {pd.DataFrame} -- n words of each column plus the
+            total, common and shared unique words of the pair
+        """
+        first, second = columns
+        text = pd.concat([df[first], df[second]]).fillna('').str.lower()
+        counts = CountVectorizer(analyzer=str.split,
+                                 dtype=np.int32).fit_transform(text.values)
+        words1, words2 = counts[:len(df)], counts[len(df):]
+        unique1 = words1.getnnz(axis=1)
+        unique2 = words2.getnnz(axis=1)
+        total = 1.0 * (unique1 + unique2)
+        common = 1.0 * words1.multiply(words2).getnnz(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shared = common / total
+        return pd.DataFrame(
+            {
+                f'{first}_n_words': np.asarray(words1.sum(axis=1)).ravel(),
+                f'{second}_n_words': np.asarray(words2.sum(axis=1)).ravel(),
+                'total_words': total,
+                'common_words': common,
+                'shared_words': shared
+            },
+            index=df.index)
 
-        return df.apply(_normalize, axis=1)
+    def _overlap_feats(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        create_quora_overlap_feats of df, computed once for consecutive
+        calls with the same frame; a frame modified in place in between
+        must be passed as a copy.
+        """
+        if self._overlap is None or self._overlap[0] is not df:
+            self._overlap = (df, self.create_quora_overlap_feats(df))
+        return self._overlap[1]
+
+    def create_quora_total_words_feats(self, df: pd.DataFrame) -> pd.DataFrame:
+        return self._overlap_feats(df)['total_words']
 
     def create_quora_common_words_feats(self,
                                         df: pd.DataFrame) -> pd.DataFrame:
-        def _normalize(row: pd.Series) -> float:
-            word1 = set(
-                map(lambda x: x.lower().strip(), row['question1'].split()))
-            word2 = set(
-                map(lambda x: x.lower().strip(), row['question2'].split()))
-            return 1.0 * len(word1 & word2)
-
-        return df.apply(_normalize, axis=1)
+        return self._overlap_feats(df)['common_words']
 
     def create_quora_shared_words_feats(self,
                                         df: pd.DataFrame) -> pd.DataFrame:
-        def _normalize(row: pd.Series) -> float:
-            word1 = set(
-                map(lambda x: x.lower().strip(), row['question1'].split()))
-            word2 = set(
-                map(lambda x: x.lower().strip(), row['question2'].split()))
-            return 1.0 * len(word1 & word2) / (len(word1) + len(word2))
-
-        return df.apply(_normalize, axis=1)
+        return self._overlap_feats(df)['shared_words']
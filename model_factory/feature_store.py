@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, List
+
+import pandas as pd
+
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+META_FILE = 'meta.json'
+FEATURES_FILE = 'features.parquet'
+
+
+def hash_frame(df: pd.DataFrame) -> str:
+    """sha256 of the index, columns and values of a DataFrame"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in df.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+class FeatureSet:
+    """
+    Lazily loaded features of one store entry. Columns are read from the
+    parquet file on first access, so a trainer only pays for the columns
+    it uses.
+
+    Args:
+        path {str} -- directory of the store entry
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(f'{path}/{META_FILE}') as f:
+            self.meta = json.load(f)
+        self._columns: Dict[str, pd.Series] = {}
+
+    def __len__(self):
+        return self.meta['n_rows']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_columns'] = {}
+        return state
+
+    @property
+    def columns(self) -> List[str]:
+        return self.meta['columns']
+
+    def __getitem__(self, column: str) -> pd.Series:
+        return self.load(columns=[column])[column]
+
+    def load(self, columns: List[str] = None) -> pd.DataFrame:
+        columns = self.columns if columns is None else list(columns)
+        missing = [column for column in columns if column not in self._columns]
+        if missing:
+            df = pd.read_parquet(f'{self.path}/{FEATURES_FILE}',
+                                 columns=missing)
+            df.index = pd.RangeIndex(len(df))
+            self._columns.update({column: df[column] for column in missing})
+        return pd.DataFrame(
+            {column: self._columns[column]
+             for column in columns})
+
+
+class FeatureStore:
+    """
+    On-disk cache of computed features. Entries are keyed by a hash of the
+    input data, the generator class and version, the method that made the
+    features and its parameters, and are stored as one parquet file per
+    entry so columns can be loaded individually. Entries are written to a
+    temporary directory and renamed into place.
+
+    Args:
+        root {str} -- directory of the store
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(data_hash: str, generator: str, version: Any, method: str,
+            params: Dict) -> str:
+        description = json.dumps(
+            {
+                'data': data_hash,
+                'generator': generator,
+                'version': version,
+                'method': method,
+                'params': params
+            },
+            sort_keys=True,
+            default=str)
+        return hashlib.sha256(description.encode()).hexdigest()[:16]
+
+    def path(self, key: str) -> str:
+        return f'{self.root}/{key}'
+
+    def has(self, key: str) -> bool:
+        return os.path.isfile(f'{self.path(key)}/{META_FILE}')
+
+    def open(self, key: str) -> FeatureSet:
+        return FeatureSet(self.path(key))
+
+    def save(self,
+             key: str,
+             features: pd.DataFrame,
+             description: Dict = None) -> FeatureSet:
+        if isinstance(features, pd.Series):
+            features = features.to_frame()
+        features = features.copy()
+        features.columns = [str(column) for column in features.columns]
+        path = self.path(key)
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        os.makedirs(tmp_path, exist_ok=True)
+        features.reset_index(drop=True).to_parquet(
+            f'{tmp_path}/{FEATURES_FILE}', index=False)
+        with open(f'{tmp_path}/{META_FILE}', 'w') as f:
+            json.dump(
+                {
+                    'columns': list(features.columns),
+                    'n_rows': len(features),
+                    'description': description or {}
+                },
+                f,
+                default=str)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another writer stored the key first, keep its entry
+            shutil.rmtree(tmp_path)
+            if not self.has(key):
+                raise
+            return self.open(key)
+        LOGGER.info(f'Stored {features.shape} features at {path}')
+        return self.open(key)
+
+    def remove(self, key: str) -> None:
+        shutil.rmtree(self.path(key), ignore_errors=True)
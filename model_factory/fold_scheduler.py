@@ -0,0 +1,251 @@
+import json
+import multiprocessing
+import os
+import traceback
+from typing import Dict, List
+
+import joblib
+import numpy as np
+import pandas as pd
+import torch
+
+import cross_validators
+import engines
+import image_store
+import trainers
+import utils
+from dispatcher import MODEL_DISPATCHER
+
+LOGGER = utils.get_logger(__name__)
+
+SHARD_NAME = 'decoded'
+
+
+def decode_training_images(train_path: str,
+                           output_dir: str,
+                           pickle_path: str = None,
+                           image_store_path: str = None,
+                           image_height: int = 137,
+                           image_width: int = 236,
+                           n_jobs: int = -1) -> str:
+    """
+    Decodes every training image once into a single uint8 array laid out
+    as a PackedImageStore, with image i at row i of the training csv. Put
+    output_dir on /dev/shm and every fold process memory-maps the same
+    pages, so a fold's dataset is just its subset of row indexes.
+
+    Args:
+        train_path {str} -- path to train-folds.csv
+        output_dir {str} -- directory of the decoded store
+        pickle_path {str} -- path to pickled images
+        image_store_path {str} -- packed image store, used instead of
+        pickle_path when given
+        image_height {int} -- height of images
+        image_width {int} -- width of images
+        n_jobs {int} -- threads unpickling images
+
+    Returns:
+        output_dir {str} -- path to pass as image_store_path
+    """
+    index_path = f'{output_dir}/{image_store.INDEX_FILE}'
+    image_ids = pd.read_csv(cross_validators.resolve_folds_path(train_path),
+                            usecols=['image_id']).image_id.values
+    if os.path.isfile(index_path) and np.array_equal(
+            pd.read_parquet(index_path).image_id.values, image_ids):
+        LOGGER.info(f'Reusing decoded training images at {output_dir}')
+        return output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    images = np.lib.format.open_memmap(f'{output_dir}/{SHARD_NAME}.npy',
+                                       mode='w+',
+                                       dtype=np.uint8,
+                                       shape=(len(image_ids), image_height,
+                                              image_width))
+    if image_store_path:
+        store = image_store.PackedImageStore(image_store_path)
+        shards, rows = store.locate(image_ids)
+        for shard in np.unique(shards):
+            positions = np.flatnonzero(shards == shard)
+            images[positions] = store.shards[shard][rows[positions]]
+    else:
+
+        def _decode(positions: np.array) -> None:
+            for position in positions:
+                image = joblib.load(f'{pickle_path}/{image_ids[position]}.pkl')
+                images[position] = np.asarray(image, dtype=np.uint8).reshape(
+                    image_height, image_width)
+
+        joblib.Parallel(n_jobs=n_jobs, prefer='threads')(
+            joblib.delayed(_decode)(positions) for positions in np.array_split(
+                np.arange(len(image_ids)), max(len(image_ids) // 1024, 1)))
+    images.flush()
+    pd.DataFrame({
+        'image_id': image_ids,
+        'shard': SHARD_NAME,
+        'row': np.arange(len(image_ids), dtype=np.int64)
+    }).to_parquet(index_path, index=False)
+    LOGGER.info(f'Decoded {len(image_ids)} training images to {output_dir}')
+    return output_dir
+
+
+def remove_decoded_images(output_dir: str) -> None:
+    """Deletes the store written by decode_training_images"""
+    for name in (f'{SHARD_NAME}.npy', image_store.INDEX_FILE):
+        path = f'{output_dir}/{name}'
+        if os.path.isfile(path):
+            os.remove(path)
+    LOGGER.info(f'Removed decoded training images from {output_dir}')
+
+
+def plan_fold_resources(n_folds: int, n_concurrent: int) -> List[Dict]:
+    """
+    Splits CPU cores and GPUs between the folds that run at the same time:
+    each slot gets an equal share of cores, divided between DataLoader
+    workers and torch threads, and GPUs are handed out round robin
+    """
+    cores = os.cpu_count() or 1
+    gpus = torch.cuda.device_count()
+    cores_per_slot = max(cores // n_concurrent, 1)
+    num_workers = cores_per_slot // 2
+    resources = []
+    for fold in range(n_folds):
+        slot = fold % n_concurrent
+        resources.append({
+            'device': f'cuda:{slot % gpus}' if gpus else 'cpu',
+            'num_workers': num_workers,
+            'num_threads': max(cores_per_slot - num_workers, 1)
+        })
+    return resources
+
+
+def _train_fold(task: Dict) -> Dict:
+    torch.set_num_threads(task['num_threads'])
+    params = task['params']
+    model = MODEL_DISPATCHER.get(task['model_name'])
+    if params.get('single_channel'):
+        model.to_single_channel(mean=params['mean'], std=params['std'])
+    trainer = trainers.BengaliTrainer(model=model,
+                                      model_name=task['model_name'])
+    engine = engines.BengaliEngine(trainer=trainer, params=params)
+    return engine.run_training_engine(save_to_s3=task['save_to_s3'],
+                                      creds=task['creds'])
+
+
+def _fold_process(index: int, task: Dict, queue) -> None:
+    try:
+        queue.put((index, _train_fold(task), None))
+    except Exception:
+        queue.put((index, None, traceback.format_exc()))
+
+
+def _run_processes(tasks: List[Dict], n_concurrent: int,
+                   start_method: str) -> List[Dict]:
+    """
+    Runs _train_fold on every task in its own process, n_concurrent at a
+    time. Unlike pool workers these processes are not daemonic, so each
+    fold can start its own DataLoader workers.
+    """
+    context = multiprocessing.get_context(start_method)
+    queue = context.Queue()
+    pending = list(enumerate(tasks))
+    running = {}
+    results = [None] * len(tasks)
+    while pending or running:
+        while pending and len(running) < n_concurrent:
+            index, task = pending.pop(0)
+            running[index] = context.Process(target=_fold_process,
+                                             args=(index, task, queue))
+            running[index].start()
+        index, result, error = queue.get()
+        running.pop(index).join()
+        if error is not None:
+            for process in running.values():
+                process.terminate()
+            raise RuntimeError(f'Fold {index} failed:\n{error}')
+        results[index] = result
+    return results
+
+
+def run_folds(model_name: str,
+              engine_params: Dict,
+              folds: Dict[int, Dict[str, List[int]]],
+              shared_dir: str,
+              n_concurrent: int = 2,
+              save_to_s3: bool = False,
+              creds: Dict = None,
+              keep_decoded: bool = False,
+              start_method: str = 'spawn') -> pd.DataFrame:
+    """
+    Trains one Bengali model per entry of folds, n_concurrent at a time in
+    separate processes. The training images are decoded once into
+    shared_dir and every fold reads its subset of rows from there. The
+    decoded copy is removed once the folds finish unless keep_decoded is
+    set, in which case the next run with the same images reuses it.
+    Every fold writes its early stopping checkpoint to its own file in
+    model_dir.
+
+    Args:
+        model_name {str} -- key of the model in MODEL_DISPATCHER
+        engine_params {Dict} -- BengaliEngine params shared by every fold
+        folds {Dict} -- loop -> {"train": [...], "val": [...]} folds
+        shared_dir {str} -- directory for the decoded images, e.g. on
+        /dev/shm
+        n_concurrent {int} -- folds trained at the same time
+        save_to_s3 {bool} -- save checkpoints to s3
+        creds {Dict} -- AWS credentials
+        keep_decoded {bool} -- leave the decoded images in shared_dir
+        start_method {str} -- multiprocessing start method of the fold
+        processes; spawn gives every fold a fresh CUDA context
+
+    Returns:
+        results {pd.DataFrame} -- val folds, best score and checkpoint of
+        every fold, also written next to the checkpoints
+    """
+    shared_dir = decode_training_images(
+        train_path=engine_params['train_path'],
+        output_dir=shared_dir,
+        pickle_path=engine_params.get('pickle_path'),
+        image_store_path=engine_params.get('image_store_path'),
+        image_height=engine_params['image_height'],
+        image_width=engine_params['image_width'])
+    resources = plan_fold_resources(n_folds=len(folds),
+                                    n_concurrent=n_concurrent)
+    tasks = []
+    for fold_dict, resource in zip(folds.values(), resources):
+        tasks.append({
+            'model_name': model_name,
+            'params': {
+                **engine_params, 'image_store_path':
+                shared_dir,
+                'train_folds':
+                fold_dict['train'],
+                'val_folds':
+                fold_dict['val'],
+                'checkpoint_path': (f"{engine_params['model_dir']}/"
+                                    f"{model_name}_bengali_fold"
+                                    f"{fold_dict['val'][0]}_checkpoint.pt"),
+                'device':
+                resource['device'],
+                'num_workers':
+                resource['num_workers']
+            },
+            'num_threads': resource['num_threads'],
+            'save_to_s3': save_to_s3,
+            'creds': creds
+        })
+    LOGGER.info(f'Training {len(tasks)} folds, {n_concurrent} at a time')
+    try:
+        results = _run_processes(tasks=tasks,
+                                 n_concurrent=n_concurrent,
+                                 start_method=start_method)
+    finally:
+        if not keep_decoded:
+            remove_decoded_images(output_dir=shared_dir)
+    results = pd.DataFrame(results)
+    results['best_score'] = results.best_score.astype(float)
+    LOGGER.info(f'Fold results:\n{results.to_string()}')
+    LOGGER.info(f'Mean best score: {results.best_score.mean():.4f}')
+    results_path = (f"{engine_params['model_dir']}/"
+                    f"{model_name}_bengali_folds.json")
+    with open(results_path, 'w') as f:
+        json.dump(results.to_dict(orient='records'), f)
+    return results
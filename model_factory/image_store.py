@@ -0,0 +1,117 @@
+import glob
+import os
+from typing import List, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+INDEX_FILE = 'index.parquet'
+
+
+def _pack_shard(file_name: str, output_dir: str, image_height: int,
+                image_width: int) -> pd.DataFrame:
+    df = pd.read_parquet(file_name)
+    shard = os.path.basename(file_name).replace('.parquet', '')
+    LOGGER.info(f'Packing {len(df)} images from {file_name}')
+    images = np.lib.format.open_memmap(f'{output_dir}/{shard}.npy',
+                                       mode='w+',
+                                       dtype=np.uint8,
+                                       shape=(len(df), image_height,
+                                              image_width))
+    images[:] = df.drop('image_id', axis=1).to_numpy(dtype=np.uint8).reshape(
+        len(df), image_height, image_width)
+    images.flush()
+    return pd.DataFrame({
+        'image_id': df.image_id.values,
+        'shard': shard,
+        'row': np.arange(len(df), dtype=np.int64)
+    })
+
+
+def pack_parquet_images(input: str,
+                        output_dir: str,
+                        image_height: int = 137,
+                        image_width: int = 236,
+                        n_jobs: int = -1) -> pd.DataFrame:
+    """
+    Converts Bengali parquet shards into one contiguous uint8 array per
+    shard plus an image_id -> (shard, row) index. Shards are converted in
+    parallel.
+
+    Args:
+        input {str} -- glob pattern matching the image parquet files
+        output_dir {str} -- directory to write the packed store to
+        image_height {int} -- height of images
+        image_width {int} -- width of images
+        n_jobs {int} -- number of shards to convert concurrently
+
+    Returns:
+        index {pd.DataFrame} -- image_id, shard and row of every image
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    file_names = sorted(glob.glob(input))
+    if not file_names:
+        raise FileNotFoundError(f'No parquet files match {input}')
+    indexes = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_pack_shard)(file_name=file_name,
+                                    output_dir=output_dir,
+                                    image_height=image_height,
+                                    image_width=image_width)
+        for file_name in file_names)
+    index = pd.concat(indexes).reset_index(drop=True)
+    index.to_parquet(f'{output_dir}/{INDEX_FILE}', index=False)
+    LOGGER.info(f'Packed {len(index)} images into {output_dir}')
+    return index
+
+
+class PackedImageStore:
+    """
+    Read-only access to images written by `pack_parquet_images`. Shards are
+    memory-mapped lazily so the store can be pickled into DataLoader workers
+    without copying image data, and every image is returned as a zero-copy
+    view of its shard.
+
+    Args:
+        store_path {str} -- directory containing the packed store
+    """
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        self.index = pd.read_parquet(f'{store_path}/{INDEX_FILE}')
+        self.shard_names = sorted(self.index.shard.unique())
+        self._shards = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+    @property
+    def shards(self) -> List[np.memmap]:
+        if self._shards is None:
+            self._shards = [
+                np.load(f'{self.store_path}/{name}.npy', mmap_mode='r')
+                for name in self.shard_names
+            ]
+        return self._shards
+
+    def locate(self, image_ids: np.array) -> Tuple[np.array, np.array]:
+        """Returns the shard number and row of each image id"""
+        positions = pd.Index(self.index.image_id).get_indexer(image_ids)
+        if (positions == -1).any():
+            missing = np.asarray(image_ids)[positions == -1]
+            raise KeyError(f'Images missing from store: {missing[:5]}')
+        shard_codes = pd.Categorical(self.index.shard.values,
+                                     categories=self.shard_names).codes
+        return (shard_codes[positions].astype(np.int64),
+                self.index.row.values[positions])
+
+    def get(self, shard: int, row: int) -> np.array:
+        return self.shards[shard][row]
@@ -2,67 +2,221 @@ from typing import Any, Dict, List, Tuple
 
 import numpy as np
 import pandas as pd
-import sklearn.metrics as metrics
 import torch
 import tensorflow as tf
-from scipy import stats
 
 import utils
 
 LOGGER = utils.get_logger(__name__)
 
 
+class StreamingMacroRecall:
+    """
+    Hierarchical macro recall of the Bengali heads, updated batch by batch.
+    Each head keeps a small confusion matrix on the device of the
+    predictions, filled with a single bincount per batch, so the score is
+    available at any point of an epoch in O(classes^2) memory. Recalls
+    follow sklearn's recall_score(average='macro'): classes present in
+    neither the targets nor the predictions are ignored and classes without
+    targets score 0.
+
+    Args:
+        n_classes {Tuple[int]} -- number of classes of every head
+        weights {Tuple[float]} -- weights of the heads in the average
+    """
+    def __init__(self,
+                 n_classes: Tuple[int] = (168, 11, 7),
+                 weights: Tuple[float] = (2, 1, 1)):
+        self.n_classes = list(n_classes)
+        self.weights = list(weights)
+        self.reset()
+
+    def reset(self) -> None:
+        # allocated on the cpu, moved to the predictions' device on update
+        self.confusion_matrices = [
+            torch.zeros(n_class**2, dtype=torch.long)
+            for n_class in self.n_classes
+        ]
+
+    def update(self, preds: torch.Tensor, y_true: torch.Tensor) -> None:
+        """
+        Args:
+            preds {torch.Tensor} -- concatenated logits of the heads
+            y_true {torch.Tensor} -- targets, one column per head
+        """
+        preds = torch.split(preds.detach(), self.n_classes, dim=1)
+        if self.confusion_matrices[0].device != preds[0].device:
+            self.confusion_matrices = [
+                confusion_matrix.to(preds[0].device)
+                for confusion_matrix in self.confusion_matrices
+            ]
+        for idx, n_class in enumerate(self.n_classes):
+            pred_labels = torch.argmax(preds[idx], dim=1)
+            cells = y_true[:, idx].to(pred_labels) * n_class + pred_labels
+            self.confusion_matrices[idx] += torch.bincount(
+                cells, minlength=n_class**2)
+
+    def recalls(self) -> List[float]:
+        recalls = []
+        for confusion_matrix, n_class in zip(self.confusion_matrices,
+                                             self.n_classes):
+            confusion_matrix = confusion_matrix.view(
+                n_class, n_class).cpu().numpy().astype(np.float64)
+            true_sum = confusion_matrix.sum(axis=1)
+            labels = (true_sum + confusion_matrix.sum(axis=0)) > 0
+            if not labels.any():
+                # nothing recorded since the last reset
+                recalls.append(0.0)
+                continue
+            recall = np.diag(confusion_matrix)[labels]
+            true_sum = true_sum[labels]
+            recall[true_sum > 0] /= true_sum[true_sum > 0]
+            recalls.append(float(np.average(recall)))
+        return recalls
+
+    def compute(self, verbose: bool = False) -> float:
+        recalls = self.recalls()
+        macro_averaged_recall = np.average(recalls, weights=self.weights)
+        if verbose:
+            LOGGER.info(
+                f'Recalls: Grapheme {recalls[0]:.3f}, Vowel {recalls[1]:.3f}, Consonant {recalls[2]:.3f}'
+            )
+            LOGGER.info(
+                f'Hierarchical Macro-Averaged Recall: {macro_averaged_recall:.3f}'
+            )
+        return macro_averaged_recall
+
+
 def macro_recall(preds: torch.Tensor,
                  y_true: torch.Tensor,
                  n_grapheme: int = 168,
                  n_vowel: int = 11,
                  n_consonant: int = 7) -> float:
-    def _split_preds(
-            preds: torch.tensor,
-            shape: List = [n_grapheme, n_vowel, n_consonant]) -> torch.tensor:
-        return torch.split(preds, shape, dim=1)
-
-    def _get_labels(preds: torch.tensor) -> List:
-        return [torch.argmax(label, dim=1).cpu().numpy() for label in preds]
-
-    def _get_recalls(y_true: torch.tensor, pred_labels: List) -> List[float]:
-        y_true = y_true.cpu().numpy()
-        return [
-            metrics.recall_score(pred_labels[idx],
-                                 y_true[:, idx],
-                                 average='macro') for idx in range(3)
-        ]
+    recall = StreamingMacroRecall(n_classes=(n_grapheme, n_vowel, n_consonant))
+    recall.update(preds=preds, y_true=y_true)
+    return recall.compute(verbose=True)
+
 
-    preds = _split_preds(preds)
-    pred_labels = _get_labels(preds)
-    recalls = _get_recalls(y_true, pred_labels)
-    macro_averaged_recall = np.average(recalls, weights=[2, 1, 1])
-    LOGGER.info(
-        f'Recalls: Grapheme {recalls[0]:.3f}, Vowel {recalls[1]:.3f}, Consonant {recalls[2]:.3f}'
-    )
-    LOGGER.info(
-        f'Hierarchical Macro-Averaged Recall: {macro_averaged_recall:.3f}')
-    return macro_averaged_recall
+def average_ranks(values: np.array) -> np.array:
+    """
+    Ranks of every column of a 2D array, starting at 1, with tied values
+    sharing the average of their ranks like scipy.stats.rankdata. All
+    columns are sorted by one argsort, and the runs of equal values of
+    every column are found in a single pass over the flattened sorted
+    array.
+    """
+    n_rows, n_columns = values.shape
+    order = np.argsort(values, axis=0, kind='mergesort')
+    sorted_values = np.take_along_axis(values, order, axis=0).T.ravel()
+    starts = np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+    # every column starts a new run of ties
+    starts[::n_rows] = True
+    run_starts = np.flatnonzero(starts)
+    run_lengths = np.diff(np.r_[run_starts, n_rows * n_columns])
+    run_ranks = run_starts % n_rows + (run_lengths + 1) / 2
+    sorted_ranks = run_ranks[np.cumsum(starts) - 1].reshape(n_columns,
+                                                            n_rows).T
+    ranks = np.empty((n_rows, n_columns))
+    np.put_along_axis(ranks, order, sorted_ranks, axis=0)
+    return ranks
+
+
+def column_spearman(predictions: np.array, targets: np.array) -> np.array:
+    """
+    Spearman correlation of every column of predictions with the same
+    column of targets, as the Pearson correlation of their average ranks
+    computed for all columns at once. Columns with missing values or
+    without variance score 0.
+    """
+    predictions = np.asarray(predictions, dtype=np.float64)
+    targets = np.asarray(targets, dtype=np.float64)
+    if predictions.ndim == 1:
+        predictions, targets = predictions[:, None], targets[:, None]
+    prediction_ranks = average_ranks(predictions)
+    target_ranks = average_ranks(targets)
+    prediction_ranks -= prediction_ranks.mean(axis=0)
+    target_ranks -= target_ranks.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coefficients = (prediction_ranks * target_ranks).sum(axis=0) / np.sqrt(
+            (prediction_ranks**2).sum(axis=0) * (target_ranks**2).sum(axis=0))
+    missing = np.isnan(predictions).any(axis=0) | np.isnan(targets).any(axis=0)
+    coefficients[missing] = np.nan
+    return np.nan_to_num(coefficients)
 
 
 def spearman_correlation(predictions: torch.Tensor,
                          targets: torch.Tensor) -> float:
-    predictions = predictions.cpu().numpy()
-    targets = targets.cpu().numpy()
-    spearman = []
-    for idx in range(targets.shape[1]):
-        p1 = list(targets[:, idx])
-        p2 = list(predictions[:, idx])
-        coef, _ = np.nan_to_num(stats.spearmanr(p1, p2))
-        spearman.append(coef)
-    return np.mean(spearman)
-
-
-def keras_auc(y_true, y_pred):
-    def fallback_auc(y_true, y_pred):
-        try:
-            return metrics.roc_auc_score(y_true, y_pred)
-        except:
-            return 0.5
-
-    return tf.py_function(fallback_auc, (y_true, y_pred), tf.double)
+    return np.mean(
+        column_spearman(predictions=predictions.cpu().numpy(),
+                        targets=targets.cpu().numpy()))
+
+
+def era_correlation(y_true: np.array, y_pred: np.array,
+                    eras: np.array) -> float:
+    """
+    Numerai score: mean over eras of the correlation between the targets
+    and the predictions ranked within their era
+    """
+    df = pd.DataFrame({'era': eras, 'y_true': y_true, 'y_pred': y_pred})
+    df['rank'] = df.groupby('era')['y_pred'].rank(pct=True, method='first')
+    per_era = df.groupby('era')[[
+        'y_true', 'rank'
+    ]].apply(lambda era: np.corrcoef(era['y_true'], era['rank'])[0, 1])
+    return float(per_era.mean())
+
+
+class StreamingAUC(tf.keras.metrics.Metric):
+    """
+    ROC AUC of binary predictions, accumulated over the batches of an
+    epoch inside the graph. Predictions in [0, 1] are counted into
+    n_buckets equal-width buckets per class, and the AUC is read from the
+    two histograms with predictions sharing a bucket counted as ties, so
+    it is exact whenever no positive and negative fall in the same bucket
+    and otherwise off by at most the share of such pairs. Like the former
+    sklearn fallback it is 0.5 while only one class has been seen.
+
+    Args:
+        n_buckets {int} -- resolution of the prediction histograms
+        name {str} -- name of the metric, "auc" logs auc and val_auc
+    """
+    def __init__(self, n_buckets: int = 10000, name: str = 'auc', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.n_buckets = n_buckets
+        self.positives = self.add_weight(name='positives',
+                                         shape=(n_buckets, ),
+                                         initializer='zeros',
+                                         dtype=tf.float64)
+        self.negatives = self.add_weight(name='negatives',
+                                         shape=(n_buckets, ),
+                                         initializer='zeros',
+                                         dtype=tf.float64)
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        y_true = tf.reshape(tf.cast(y_true, tf.float64), [-1])
+        y_pred = tf.reshape(tf.cast(y_pred, tf.float64), [-1])
+        buckets = tf.cast(tf.clip_by_value(y_pred * self.n_buckets, 0,
+                                           self.n_buckets - 1),
+                          dtype=tf.int32)
+        if sample_weight is None:
+            sample_weight = tf.ones_like(y_true)
+        weights = tf.reshape(tf.cast(sample_weight, tf.float64), [-1])
+        self.positives.assign_add(
+            tf.math.unsorted_segment_sum(y_true * weights, buckets,
+                                         self.n_buckets))
+        self.negatives.assign_add(
+            tf.math.unsorted_segment_sum((1 - y_true) * weights, buckets,
+                                         self.n_buckets))
+
+    def result(self):
+        positives_above = tf.cumsum(self.positives,
+                                    exclusive=True,
+                                    reverse=True)
+        ranked_pairs = tf.reduce_sum(self.negatives *
+                                     (positives_above + self.positives / 2))
+        pairs = tf.reduce_sum(self.positives) * tf.reduce_sum(self.negatives)
+        auc = tf.where(pairs > 0, tf.math.divide_no_nan(ranked_pairs, pairs),
+                       tf.constant(0.5, dtype=tf.float64))
+        return tf.cast(auc, self.dtype)
+
+    def get_config(self):
+        return {**super().get_config(), 'n_buckets': self.n_buckets}
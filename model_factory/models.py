@@ -31,6 +31,7 @@ from torchvision import transforms
 from tqdm import tqdm
 from xgboost import XGBRegressor
 
+import augmentations
 import utils
 from datasets import BengaliDataSetTest, BengaliDataSetTrain
 from metrics import macro_recall
@@ -64,6 +65,49 @@ class BaseModel(ABC):
         joblib.dump(self, filename)
 
 
+def fold_rgb_conv(conv: nn.Conv2d, mean: Tuple[float],
+                  std: Tuple[float]) -> nn.Conv2d:
+    """
+    Folds a pretrained RGB stem convolution into one input channel. The
+    folded conv applied to a grayscale image normalized with the collapsed
+    statistics from augmentations.single_channel_stats gives the same output
+    as the original conv applied to that image replicated to RGB and
+    normalized per channel (exact away from the zero-padded border). A conv
+    that already has a single input channel is returned unchanged, so
+    folding the same model twice is safe.
+
+    Args:
+        conv {nn.Conv2d} -- pretrained convolution with 3 input channels, or
+        an already folded one
+        mean {Tuple[float]} -- per-channel mean the conv was trained with
+        std {Tuple[float]} -- per-channel std the conv was trained with
+
+    Returns:
+        nn.Conv2d -- convolution with a single input channel
+    """
+    if conv.in_channels == 1:
+        LOGGER.info('Stem convolution is already single-channel')
+        return conv
+    gray_mean, gray_std = augmentations.single_channel_stats(mean=mean,
+                                                             std=std)
+    mean = torch.tensor(mean, dtype=torch.float).reshape(1, -1, 1, 1)
+    std = torch.tensor(std, dtype=torch.float).reshape(1, -1, 1, 1)
+    weight = conv.weight.data
+    folded = nn.Conv2d(1,
+                       conv.out_channels,
+                       kernel_size=conv.kernel_size,
+                       stride=conv.stride,
+                       padding=conv.padding,
+                       dilation=conv.dilation,
+                       bias=True)
+    folded.weight.data = (weight * gray_std / std).sum(dim=1, keepdim=True)
+    bias = (weight * (gray_mean - mean) / std).sum(dim=(1, 2, 3))
+    if conv.bias is not None:
+        bias += conv.bias.data
+    folded.bias.data = bias
+    return folded
+
+
 class ResNet34(nn.Module, BaseModel):
     def __init__(self, pretrained: bool):
         super().__init__()
@@ -85,6 +129,10 @@ class ResNet34(nn.Module, BaseModel):
         linear3 = self.linear3(features)
         return linear1, linear2, linear3
 
+    def to_single_channel(self, mean: Tuple[float], std: Tuple[float]) -> None:
+        """Replaces conv1 with its single-channel fold"""
+        self.model.conv1 = fold_rgb_conv(self.model.conv1, mean=mean, std=std)
+
 
 class ResNet50(nn.Module, BaseModel):
     def __init__(self, pretrained: bool):
@@ -107,6 +155,10 @@ class ResNet50(nn.Module, BaseModel):
         linear3 = self.linear3(features)
         return linear1, linear2, linear3
 
+    def to_single_channel(self, mean: Tuple[float], std: Tuple[float]) -> None:
+        """Replaces conv1 with its single-channel fold"""
+        self.model.conv1 = fold_rgb_conv(self.model.conv1, mean=mean, std=std)
+
 
 class SeResNext101(nn.Module, BaseModel):
     def __init__(self, pretrained: bool = True):
@@ -130,6 +182,12 @@ class SeResNext101(nn.Module, BaseModel):
         linear3 = self.linear3(features)
         return linear1, linear2, linear3
 
+    def to_single_channel(self, mean: Tuple[float], std: Tuple[float]) -> None:
+        """Replaces layer0.conv1 with its single-channel fold"""
+        self.model.layer0.conv1 = fold_rgb_conv(self.model.layer0.conv1,
+                                                mean=mean,
+                                                std=std)
+
 
 # WIP
 class ResNet34Lightning(pl.LightningModule):
@@ -279,6 +337,22 @@ class NumerAIModel(nx.Model):
                                   tree_method=tree_method,
                                   colsample_bytree=colsample_bytree,
                                   verbosity=3)
+        self.codebook = None
+
+    def _booster_input(self, data: Any) -> np.array:
+        """
+        Features in the space the booster was trained in: uint8 codes when
+        the model was fit on quantization.QuantizedData, floats otherwise.
+        Codes from a different codebook are re-encoded.
+        """
+        model_codebook = getattr(self, 'codebook', None)
+        data_codebook = getattr(data, 'codebook', None)
+        if model_codebook == data_codebook:
+            return data.x
+        x = data.x if data_codebook is None else data_codebook.decode(data.x)
+        if model_codebook is None:
+            return x
+        return model_codebook.encode(x)
 
     def fit(self,
             dfit: nx.data.Data,
@@ -286,6 +360,12 @@ class NumerAIModel(nx.Model):
             eval_set=None,
             eval_metric=None,
             early_stopping=None) -> None:
+        """
+        dfit: nx.data.Data or quantization.QuantizedData; with the latter
+        the booster is trained on the order-preserving uint8 codes, which
+        are only converted to the booster's float input inside XGBoost.
+        """
+        self.codebook = getattr(dfit, 'codebook', None)
         self.model.fit(X=dfit.x,
                        y=dfit.y[tournament],
                        eval_set=eval_set,
@@ -302,7 +382,7 @@ class NumerAIModel(nx.Model):
         data_predict = dpre.y_to_nan()
         try:
             LOGGER.info('Inference started...')
-            yhat = self.model.predict(data_predict.x)
+            yhat = self.model.predict(self._booster_input(data_predict))
             LOGGER.info(
                 'Inference complete...now preparing predictions for submission'
             )
@@ -321,7 +401,7 @@ class NumerAIModel(nx.Model):
     def fit_predict(self, dfit: nx.data.Data, dpre: nx.data.Data,
                     tournament: str) -> Tuple:
         # fit is done separately in `.fit()`
-        yhat = self.model.predict(dpre.x)
+        yhat = self.model.predict(self._booster_input(dpre))
         return dpre.ids, yhat
 
     @staticmethod
@@ -0,0 +1,185 @@
+import glob
+import json
+import os
+import shutil
+from typing import Dict, Optional
+
+import numerox as nx
+import numpy as np
+import pandas as pd
+
+import quantization
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+META_FILE = 'meta.json'
+SOURCES_FILE = 'sources.json'
+CODES_FILE = 'codes.npy'
+CODEBOOK_FILE = 'codebook.npz'
+LABELS_FILE = 'labels.npy'
+
+# data objects opened by this process, keyed by cache path
+_OPENED: Dict[str, nx.Data] = {}
+_QUANTIZED: Dict[str, quantization.QuantizedData] = {}
+
+
+class NumerAIDataCache:
+    """
+    Persistent cache of parsed Numerai datasets. A round's zip is parsed
+    once with nx.load_zip and written as a single float32 matrix (era,
+    region, features and targets, the same single-block layout numerox
+    uses) plus an id array. Later loads memory-map the matrix and wrap it
+    in nx.Data without copying, so every process shares the same pages.
+    The uint8 codes of a round's features are stored in the same entry the
+    first time they are asked for. Entries are keyed by round number and
+    zip file hash.
+
+    Args:
+        cache_dir {str} -- directory holding the cached rounds
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _file_digest(self, zip_path: str) -> str:
+        """
+        Hash of the zip, memoized on path, size and mtime so that an
+        unchanged file is not re-hashed on every engine construction
+        """
+        stat = os.stat(zip_path)
+        source = f'{os.path.abspath(zip_path)}:{stat.st_size}:{stat.st_mtime_ns}'
+        sources_path = f'{self.cache_dir}/{SOURCES_FILE}'
+        sources = {}
+        if os.path.isfile(sources_path):
+            with open(sources_path) as f:
+                sources = json.load(f)
+        if source not in sources:
+            sources[source] = utils.hash_file(zip_path)
+            tmp_path = f'{sources_path}.tmp{os.getpid()}'
+            with open(tmp_path, 'w') as f:
+                json.dump(sources, f)
+            os.replace(tmp_path, sources_path)
+        return sources[source]
+
+    def key(self, zip_path: str, round_number: int = None) -> str:
+        round_name = 'local' if round_number is None else round_number
+        return f'round{round_name}_{self._file_digest(zip_path)[:16]}'
+
+    def load(self, zip_path: str, round_number: int = None) -> nx.Data:
+        """Opens the cached round, parsing the zip the first time"""
+        path = f'{self.cache_dir}/{self.key(zip_path, round_number)}'
+        if not os.path.isfile(f'{path}/{META_FILE}'):
+            LOGGER.info(f'Parsing {zip_path} into {path}')
+            self.build(data=nx.load_zip(zip_path), path=path)
+        return self.open(path)
+
+    def load_round(self, round_number: int) -> Optional[nx.Data]:
+        """Opens any cached entry for the round, or returns None"""
+        paths = sorted(
+            glob.glob(f'{self.cache_dir}/round{round_number}_*/{META_FILE}'))
+        if not paths:
+            return None
+        return self.open(os.path.dirname(paths[-1]))
+
+    def save(self,
+             data: nx.Data,
+             zip_path: str,
+             round_number: int = None) -> nx.Data:
+        """Caches already parsed data and returns the memory-mapped copy"""
+        path = f'{self.cache_dir}/{self.key(zip_path, round_number)}'
+        if not os.path.isfile(f'{path}/{META_FILE}'):
+            self.build(data=data, path=path)
+        return self.open(path)
+
+    @staticmethod
+    def build(data: nx.Data, path: str) -> None:
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        os.makedirs(tmp_path, exist_ok=True)
+        values = np.lib.format.open_memmap(f'{tmp_path}/values.npy',
+                                           mode='w+',
+                                           dtype=np.float32,
+                                           shape=data.df.shape)
+        values[:] = data.df.values
+        values.flush()
+        np.save(f'{tmp_path}/ids.npy', data.df.index.to_numpy().astype(str))
+        with open(f'{tmp_path}/{META_FILE}', 'w') as f:
+            json.dump(
+                {
+                    'columns': list(data.df.columns),
+                    'index_name': data.df.index.name
+                }, f)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another process cached the round first, keep its entry
+            shutil.rmtree(tmp_path)
+            if not os.path.isfile(f'{path}/{META_FILE}'):
+                raise
+            return
+        LOGGER.info(f'Cached {data.df.shape} Numerai data at {path}')
+
+    @staticmethod
+    def open(path: str) -> nx.Data:
+        if path not in _OPENED:
+            with open(f'{path}/{META_FILE}') as f:
+                meta = json.load(f)
+            values = np.load(f'{path}/values.npy', mmap_mode='r')
+            ids = np.load(f'{path}/ids.npy')
+            df = pd.DataFrame(values,
+                              index=pd.Index(ids, name=meta['index_name']),
+                              columns=meta['columns'],
+                              copy=False)
+            _OPENED[path] = nx.Data(df)
+        return _OPENED[path]
+
+    def quantize(self, data: nx.Data) -> Optional[quantization.QuantizedData]:
+        """
+        Quantized features of a round opened from this cache, or None for
+        data that was not. The codes are encoded and written next to the
+        round's values the first time, and memory-mapped afterwards.
+        """
+        paths = [path for path, opened in _OPENED.items() if opened is data]
+        if not paths:
+            return None
+        path = paths[0]
+        if path not in _QUANTIZED:
+            if not os.path.isfile(f'{path}/{CODES_FILE}'):
+                self.build_codes(data=data, path=path)
+            _QUANTIZED[path] = self.open_codes(path)
+        return _QUANTIZED[path]
+
+    @staticmethod
+    def build_codes(data: nx.Data, path: str) -> None:
+        quantized = quantization.QuantizedData.from_data(data)
+        suffix = f'.tmp{os.getpid()}'
+        with open(f'{path}/{CODEBOOK_FILE}{suffix}', 'wb') as f:
+            np.savez(f,
+                     values=quantized.codebook.values,
+                     sizes=quantized.codebook.sizes,
+                     labels=np.array(quantized.data.df.columns, dtype=str))
+        with open(f'{path}/{LABELS_FILE}{suffix}', 'wb') as f:
+            np.save(f, quantized.data.df.values)
+        with open(f'{path}/{CODES_FILE}{suffix}', 'wb') as f:
+            np.save(f, quantized.codes)
+        # the codes go last, their presence marks a complete entry
+        for name in (CODEBOOK_FILE, LABELS_FILE, CODES_FILE):
+            os.replace(f'{path}/{name}{suffix}', f'{path}/{name}')
+        LOGGER.info(f'Cached quantized features at {path}')
+
+    @staticmethod
+    def open_codes(path: str) -> quantization.QuantizedData:
+        with open(f'{path}/{META_FILE}') as f:
+            meta = json.load(f)
+        with np.load(f'{path}/{CODEBOOK_FILE}') as arrays:
+            codebook = quantization.Codebook(values=arrays['values'],
+                                             sizes=arrays['sizes'])
+            columns = [str(column) for column in arrays['labels']]
+        labels = pd.DataFrame(np.load(f'{path}/{LABELS_FILE}'),
+                              index=pd.Index(np.load(f'{path}/ids.npy'),
+                                             name=meta['index_name']),
+                              columns=columns)
+        return quantization.QuantizedData(data=nx.Data(labels),
+                                          codes=np.load(f'{path}/{CODES_FILE}',
+                                                        mmap_mode='r'),
+                                          codebook=codebook)
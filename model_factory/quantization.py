@@ -0,0 +1,163 @@
+import numerox as nx
+import numpy as np
+
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+MAX_LEVELS = 256
+
+
+class Codebook:
+    """
+    Per-column sorted table of the distinct values of a feature matrix.
+    Encoding maps every value to its index in its column's table, so the
+    uint8 codes are lossless and preserve the order of the values, which
+    means tree models split the codes exactly as they would the floats.
+
+    Args:
+        values {np.array} -- (n_features, n_levels) float32 table, padded
+        with +inf past each column's size
+        sizes {np.array} -- number of distinct values of each column
+    """
+    def __init__(self, values: np.array, sizes: np.array):
+        self.values = values
+        self.sizes = sizes
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Codebook):
+            return False
+        if self.values.shape != other.values.shape:
+            return False
+        same = self.values == other.values
+        return bool((same | (np.isnan(self.values)
+                             & np.isnan(other.values))).all())
+
+    @classmethod
+    def fit(cls, x: np.array, column_block: int = 16) -> 'Codebook':
+        levels = []
+        for start in range(0, x.shape[1], column_block):
+            block = np.array(x[:, start:start + column_block],
+                             dtype=np.float32)
+            levels.extend(np.unique(column) for column in block.T)
+        sizes = np.array([len(column) for column in levels], dtype=np.int64)
+        if sizes.max() > MAX_LEVELS:
+            raise ValueError(
+                f'Column {sizes.argmax()} has {sizes.max()} distinct values, '
+                f'more than the {MAX_LEVELS} a uint8 code can hold')
+        values = np.full((len(levels), sizes.max()), np.inf, dtype=np.float32)
+        for i, column in enumerate(levels):
+            values[i, :len(column)] = column
+        return cls(values=values, sizes=sizes)
+
+    def encode(self, x: np.array, chunk_size: int = 65536) -> np.array:
+        """Returns uint8 codes, raising if a value is not in the codebook"""
+        codes = np.empty(x.shape, dtype=np.uint8)
+        for start in range(0, len(x), chunk_size):
+            chunk = np.asarray(x[start:start + chunk_size], dtype=np.float32)
+            for i in range(chunk.shape[1]):
+                levels = self.values[i, :self.sizes[i]]
+                column = np.minimum(np.searchsorted(levels, chunk[:, i]),
+                                    self.sizes[i] - 1)
+                found = levels[column]
+                exact = (found == chunk[:, i]) | (np.isnan(found)
+                                                  & np.isnan(chunk[:, i]))
+                if not exact.all():
+                    raise ValueError(
+                        f'Column {i} has values missing from the codebook: '
+                        f'{np.unique(chunk[~exact, i])[:5]}')
+                codes[start:start + len(chunk), i] = column
+        return codes
+
+    def decode(self, codes: np.array) -> np.array:
+        return self.values[np.arange(codes.shape[1]), codes]
+
+
+def label_data(data: nx.Data) -> nx.Data:
+    """Copy of data without its feature columns"""
+    n_targets = nx.tournament_count(active_only=True)
+    columns = list(data.df.columns[:2]) + list(data.df.columns[-n_targets:])
+    return nx.Data(data.df[columns].copy())
+
+
+class _Targets:
+    def __init__(self, data: nx.Data, rows: np.array):
+        self.data = data
+        self.rows = rows
+
+    def __getitem__(self, tournament) -> np.array:
+        return self.data.y[tournament][self.rows]
+
+
+class QuantizedData:
+    """
+    uint8 view of the features of an nx.Data object. Mimics the parts of
+    nx.Data the Numerai trainer uses (region indexing, x, y, ids, era_float
+    and y_to_nan) so it can be passed wherever the trainer expects data.
+    Only the era, region and target columns are kept next to the codes, so
+    the float features can be dropped once the round is quantized.
+
+    Args:
+        data {nx.Data} -- era, region and targets of the round, see
+        label_data
+        codes {np.array} -- uint8 codes of the features of every row
+        codebook {Codebook} -- codebook the codes were encoded with
+        rows {np.array} -- rows of data this object covers, all if None
+    """
+    def __init__(self,
+                 data: nx.Data,
+                 codes: np.array,
+                 codebook: Codebook,
+                 rows: np.array = None):
+        self.data = data
+        self.codes = codes
+        self.codebook = codebook
+        self.rows = np.arange(len(codes)) if rows is None else rows
+
+    @classmethod
+    def from_data(cls,
+                  data: nx.Data,
+                  codebook: Codebook = None) -> 'QuantizedData':
+        x = data.x
+        if codebook is None:
+            codebook = Codebook.fit(x)
+        codes = codebook.encode(x)
+        LOGGER.info(f'Quantized {x.shape} features from {x.nbytes / 1e9:.2f}'
+                    f' GB to {codes.nbytes / 1e9:.2f} GB')
+        return cls(data=label_data(data), codes=codes, codebook=codebook)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, region: str) -> 'QuantizedData':
+        region_codes = self.data.df['region'].values[self.rows]
+        if region == 'tournament':
+            mask = region_codes != nx.data.REGION_STR_TO_FLOAT['train']
+        else:
+            mask = region_codes == nx.data.REGION_STR_TO_FLOAT[region]
+        return QuantizedData(data=self.data,
+                             codes=self.codes,
+                             codebook=self.codebook,
+                             rows=self.rows[mask])
+
+    @property
+    def x(self) -> np.array:
+        if len(self.rows) == len(self.codes):
+            return self.codes
+        return self.codes[self.rows]
+
+    @property
+    def y(self) -> _Targets:
+        return _Targets(data=self.data, rows=self.rows)
+
+    @property
+    def era_float(self) -> np.array:
+        return self.data.df['era'].values[self.rows]
+
+    @property
+    def ids(self) -> np.array:
+        return self.data.df.index.to_numpy()[self.rows].astype(str)
+
+    def y_to_nan(self) -> 'QuantizedData':
+        # targets are never read through the quantized view
+        return self
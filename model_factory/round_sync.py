@@ -0,0 +1,244 @@
+import fcntl
+import json
+import os
+import urllib.request
+import zipfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+import numerapi
+
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+
+class FetchBackend(ABC):
+    """Source of round datasets that RoundSync downloads from"""
+    @abstractmethod
+    def size(self, round_number: int) -> int:
+        """Size in bytes of the round's dataset"""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def fetch(self, round_number: int, offset: int) -> Iterator[bytes]:
+        """Yields the round's dataset from byte offset onwards"""
+        raise NotImplementedError()
+
+    def checksum(self, round_number: int) -> Optional[str]:
+        """sha256 of the round's dataset, if the source publishes one"""
+        return None
+
+
+class DirectoryBackend(FetchBackend):
+    """
+    Serves rounds from a local directory, e.g. a mounted share or a test
+    stand-in for the Numerai API.
+
+    Args:
+        directory {str} -- directory holding the round files
+        file_pattern {str} -- file name of a round, formatted with round_number
+    """
+    def __init__(self,
+                 directory: str,
+                 file_pattern: str = 'numerai_dataset_{round_number}.zip'):
+        self.directory = directory
+        self.file_pattern = file_pattern
+
+    def _path(self, round_number: int) -> str:
+        return (f'{self.directory}/'
+                f'{self.file_pattern.format(round_number=round_number)}')
+
+    def size(self, round_number: int) -> int:
+        return os.path.getsize(self._path(round_number))
+
+    def fetch(self, round_number: int, offset: int) -> Iterator[bytes]:
+        with open(self._path(round_number), 'rb') as f:
+            f.seek(offset)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+
+
+class HttpBackend(FetchBackend):
+    """
+    Downloads rounds over HTTP, resuming with Range requests.
+
+    Args:
+        url_pattern {str} -- url of a round, formatted with round_number
+    """
+    def __init__(self, url_pattern: str):
+        self.url_pattern = url_pattern
+
+    def url(self, round_number: int) -> str:
+        return self.url_pattern.format(round_number=round_number)
+
+    def size(self, round_number: int) -> int:
+        # presigned urls are only signed for GET, so ask for the first byte
+        # instead of sending a HEAD and read the total from Content-Range
+        request = urllib.request.Request(self.url(round_number),
+                                         headers={'Range': 'bytes=0-0'})
+        with urllib.request.urlopen(request) as response:
+            if response.status == 206:
+                return int(response.headers['Content-Range'].split('/')[-1])
+            return int(response.headers['Content-Length'])
+
+    def fetch(self, round_number: int, offset: int) -> Iterator[bytes]:
+        request = urllib.request.Request(self.url(round_number))
+        if offset:
+            request.add_header('Range', f'bytes={offset}-')
+        with urllib.request.urlopen(request) as response:
+            if offset and response.status != 206:
+                raise IOError(f'Server ignored range request for '
+                              f'{self.url(round_number)}')
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                yield chunk
+
+
+class NumerAPIBackend(HttpBackend):
+    """Downloads the current round from the url published by NumerAPI"""
+    def __init__(self):
+        self.napi = numerapi.NumerAPI(verbosity="info")
+        self.urls = {}
+
+    def url(self, round_number: int) -> str:
+        if round_number not in self.urls:
+            current_round = self.napi.get_current_round()
+            if round_number != current_round:
+                raise ValueError(f'NumerAPI only serves the current round '
+                                 f'({current_round}), not {round_number}')
+            self.urls[round_number] = self.napi.get_dataset_url()
+        return self.urls[round_number]
+
+
+@contextmanager
+def _file_lock(path: str):
+    with open(path, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class RoundSync:
+    """
+    Local content-addressed cache of Numerai round datasets. Files are
+    stored once under objects/<sha256>.zip and every round points at its
+    object through rounds/<round>.json. Downloads of a round are
+    serialized across processes with a file lock, resume from the partial
+    file left by an interrupted attempt, and are verified (size, zip CRCs
+    and the backend checksum when there is one) before being published.
+
+    Args:
+        cache_dir {str} -- directory of the cache
+        backend {FetchBackend} -- source of the round datasets
+    """
+    def __init__(self, cache_dir: str, backend: FetchBackend):
+        self.cache_dir = cache_dir
+        self.backend = backend
+        for name in ('objects', 'rounds', 'partial', 'locks'):
+            os.makedirs(f'{cache_dir}/{name}', exist_ok=True)
+
+    def _manifest_path(self, round_number: int) -> str:
+        return f'{self.cache_dir}/rounds/{round_number}.json'
+
+    def _object_path(self, digest: str) -> str:
+        return f'{self.cache_dir}/objects/{digest}.zip'
+
+    def cached_path(self, round_number: int) -> Optional[str]:
+        """Path of the round's verified dataset, or None if not cached"""
+        manifest_path = self._manifest_path(round_number)
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        path = self._object_path(manifest['sha256'])
+        if not os.path.isfile(
+                path) or os.path.getsize(path) != manifest['size']:
+            return None
+        return path
+
+    def sync(self, round_number: int) -> str:
+        """Returns the local path of the round, downloading it if needed"""
+        path = self.cached_path(round_number)
+        if path is not None:
+            return path
+        with _file_lock(f'{self.cache_dir}/locks/{round_number}.lock'):
+            # another process may have finished while we waited
+            path = self.cached_path(round_number)
+            if path is not None:
+                return path
+            part_path = self._download(round_number)
+            digest, size = self._verify(round_number, part_path)
+            path = self._object_path(digest)
+            os.replace(part_path, path)
+            manifest_path = self._manifest_path(round_number)
+            with open(f'{manifest_path}.tmp', 'w') as f:
+                json.dump({'sha256': digest, 'size': size}, f)
+            os.replace(f'{manifest_path}.tmp', manifest_path)
+        LOGGER.info(f'Round {round_number} synced to {path}')
+        return path
+
+    def _download(self, round_number: int) -> str:
+        part_path = f'{self.cache_dir}/partial/{round_number}.part'
+        total = self.backend.size(round_number)
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        if offset > total:
+            offset = 0
+        if offset and offset == total:
+            # a previous run died after the last byte; servers answer a
+            # range starting at EOF with 416, so verify what we have
+            LOGGER.info(f'Round {round_number} already fully downloaded')
+            return part_path
+        if offset:
+            LOGGER.info(f'Resuming round {round_number} at {offset}/{total}')
+        with open(part_path, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            for chunk in self.backend.fetch(round_number, offset=offset):
+                f.write(chunk)
+        return part_path
+
+    def _verify(self, round_number: int, part_path: str) -> Tuple[str, int]:
+        def _fail(reason: str):
+            os.remove(part_path)
+            raise IOError(f'Round {round_number} failed verification: '
+                          f'{reason}')
+
+        size = os.path.getsize(part_path)
+        if size != self.backend.size(round_number):
+            _fail(f'expected {self.backend.size(round_number)} bytes, '
+                  f'got {size}')
+        try:
+            with zipfile.ZipFile(part_path) as archive:
+                corrupt = archive.testzip()
+        except zipfile.BadZipFile as e:
+            _fail(str(e))
+        if corrupt is not None:
+            _fail(f'bad CRC for {corrupt}')
+        digest = utils.hash_file(part_path)
+        expected = self.backend.checksum(round_number)
+        if expected is not None and expected != digest:
+            _fail(f'sha256 {digest} does not match {expected}')
+        return digest, size
+
+    def prune(self, keep_rounds: int = 2) -> None:
+        """Removes all but the newest keep_rounds rounds and their objects"""
+        rounds = sorted(
+            int(name.replace('.json', ''))
+            for name in os.listdir(f'{self.cache_dir}/rounds')
+            if name.endswith('.json'))
+        split = max(len(rounds) - keep_rounds, 0)
+        keep = set()
+        for round_number in rounds[split:]:
+            path = self.cached_path(round_number)
+            if path is not None:
+                keep.add(os.path.basename(path))
+        for round_number in rounds[:split]:
+            os.remove(self._manifest_path(round_number))
+        for name in os.listdir(f'{self.cache_dir}/objects'):
+            if name not in keep:
+                os.remove(f'{self.cache_dir}/objects/{name}')
@@ -5,6 +5,7 @@ from typing import Optional
 import click
 
 import engines
+import fold_scheduler
 import models
 import trainers
 import utils
@@ -50,18 +51,67 @@ TRAINING_PARAMS = {
               '--pickle-path',
               type=str,
               default='inputs/image_pickles')
+@click.option('-store', '--image-store-path', type=str, default=None)
 @click.option('-sub', '--submission-dir', type=str, default='inputs')
 @click.option('-model', '--model-dir', type=str, default='trained_models')
 @click.option('-trainb', '--train-batch-size', type=int, default=64)
 @click.option('-testb', '--test-batch-size', type=int, default=32)
 @click.option('-ep', '--epochs', type=int, default=5)
+@click.option('-gray', '--single-channel', type=bool, default=False)
+@click.option('-aug',
+              '--augmentation-stage',
+              type=click.Choice(['sample', 'batch']),
+              default='sample')
+@click.option('-stream', '--stream-test', type=bool, default=False)
+@click.option('-par', '--parallel-folds', type=int, default=1)
+@click.option('-shm', '--shared-dir', type=str, default='/dev/shm/bengali')
+@click.option('-prec',
+              '--precision',
+              type=click.Choice(['fp32', 'bf16']),
+              default='fp32')
+@click.option('-cmp', '--compare-precision', type=bool, default=False)
 def run_bengali_engine(model_name: str, train: bool, inference: bool,
                        train_path: str, test_path: str, pickle_path: str,
-                       submission_dir: str, model_dir: str,
-                       train_batch_size: int, test_batch_size: int,
-                       epochs: int) -> Optional:
+                       image_store_path: str, submission_dir: str,
+                       model_dir: str, train_batch_size: int,
+                       test_batch_size: int, epochs: int, single_channel: bool,
+                       augmentation_stage: str, stream_test: bool,
+                       parallel_folds: int, shared_dir: str, precision: str,
+                       compare_precision: bool) -> Optional:
     # TO DO: remove duplicated instantiation of engine and engine parameters
-    if train:
+    if train and parallel_folds > 1:
+        timestamp = utils.generate_timestamp()
+        LOGGER.info(f'Training started {timestamp}')
+        ENGINE_PARAMS = {
+            "train_path": train_path,
+            "test_path": test_path,
+            "pickle_path": pickle_path,
+            "image_store_path": image_store_path,
+            "model_dir": model_dir,
+            "submission_dir": submission_dir,
+            "train_batch_size": train_batch_size,
+            "test_batch_size": test_batch_size,
+            "epochs": epochs,
+            "image_height": 137,
+            "image_width": 236,
+            "mean": (0.485, 0.456, 0.406),
+            "std": (0.229, 0.239, 0.225),
+            "single_channel": single_channel,
+            "augmentation_stage": augmentation_stage,
+            "stream_test": stream_test,
+            "precision": precision,
+            "compare_precision": compare_precision,
+            "test_loops": 5,
+        }
+        fold_scheduler.run_folds(model_name=model_name,
+                                 engine_params=ENGINE_PARAMS,
+                                 folds=TRAINING_PARAMS,
+                                 shared_dir=shared_dir,
+                                 n_concurrent=parallel_folds,
+                                 save_to_s3=True,
+                                 creds=CREDENTIALS)
+        LOGGER.info('Training complete!')
+    elif train:
         timestamp = utils.generate_timestamp()
         LOGGER.info(f'Training started {timestamp}')
         for loop, fold_dict in TRAINING_PARAMS.items():
@@ -70,6 +120,7 @@ def run_bengali_engine(model_name: str, train: bool, inference: bool,
                 "train_path": train_path,
                 "test_path": test_path,
                 "pickle_path": pickle_path,
+                "image_store_path": image_store_path,
                 "model_dir": model_dir,
                 "submission_dir": submission_dir,
                 "train_folds": fold_dict['train'],
@@ -81,10 +132,18 @@ def run_bengali_engine(model_name: str, train: bool, inference: bool,
                 "image_width": 236,
                 "mean": (0.485, 0.456, 0.406),
                 "std": (0.229, 0.239, 0.225),
+                "single_channel": single_channel,
+                "augmentation_stage": augmentation_stage,
+                "stream_test": stream_test,
+                "precision": precision,
+                "compare_precision": compare_precision,
                 # 1 loop per test parquet file
                 "test_loops": 5,
             }
             model = MODEL_DISPATCHER.get(model_name)
+            if single_channel:
+                model.to_single_channel(mean=ENGINE_PARAMS["mean"],
+                                        std=ENGINE_PARAMS["std"])
             trainer = trainers.BengaliTrainer(model=model,
                                               model_name=model_name)
             bengali = engines.BengaliEngine(trainer=trainer,
@@ -96,6 +155,7 @@ def run_bengali_engine(model_name: str, train: bool, inference: bool,
             "train_path": train_path,
             "test_path": test_path,
             "pickle_path": pickle_path,
+            "image_store_path": image_store_path,
             "model_dir": model_dir,
             "submission_dir": submission_dir,
             "train_folds": [0],
@@ -107,11 +167,19 @@ def run_bengali_engine(model_name: str, train: bool, inference: bool,
             "image_width": 236,
             "mean": (0.485, 0.456, 0.406),
             "std": (0.229, 0.239, 0.225),
+            "single_channel": single_channel,
+            "augmentation_stage": augmentation_stage,
+            "stream_test": stream_test,
+            "precision": precision,
+            "compare_precision": compare_precision,
             "test_loops": 5,
         }
         timestamp = utils.generate_timestamp()
         LOGGER.info(f'Inference started {timestamp}')
         model = MODEL_DISPATCHER.get(model_name)
+        if single_channel:
+            model.to_single_channel(mean=ENGINE_PARAMS["mean"],
+                                    std=ENGINE_PARAMS["std"])
         trainer = trainers.BengaliTrainer(model=model, model_name=model_name)
         bengali = engines.BengaliEngine(trainer=trainer, params=ENGINE_PARAMS)
         submission = bengali.run_inference_engine(
@@ -0,0 +1,155 @@
+import collections
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+from torch.utils.data.dataloader import default_collate
+
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+TOKEN_FIELDS = ('ids', 'token_type_ids', 'attention_mask')
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler that groups samples of similar length. When shuffling,
+    indices are shuffled and split into pools of batch_size * bucket_size
+    samples, each pool is sorted by length and cut into batches, and the
+    batches are shuffled again so lengths still vary across steps. Without
+    shuffling the whole dataset is sorted by length, which is what you
+    want for evaluation.
+
+    Args:
+        lengths {Sequence[int]} -- length of every sample in the dataset
+        batch_size {int} -- number of samples per batch
+        bucket_size {int} -- number of batches sorted together in a pool
+        shuffle {bool} -- shuffle samples and batches every epoch
+        drop_last {bool} -- drop the final incomplete batch
+        seed {int} -- optional seed for reproducible batches
+    """
+    def __init__(self,
+                 lengths: Sequence[int],
+                 batch_size: int,
+                 bucket_size: int = 100,
+                 shuffle: bool = True,
+                 drop_last: bool = False,
+                 seed: int = None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.random_state = np.random.RandomState(seed)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return -(-len(self.lengths) // self.batch_size)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        if self.shuffle:
+            indices = self.random_state.permutation(len(self.lengths))
+            pool_size = self.batch_size * self.bucket_size
+        else:
+            indices = np.arange(len(self.lengths))
+            pool_size = max(len(indices), 1)
+        batches = []
+        for start in range(0, len(indices), pool_size):
+            pool = indices[start:start + pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='mergesort')]
+            batches.extend(pool[i:i + self.batch_size]
+                           for i in range(0, len(pool), self.batch_size))
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        if self.shuffle:
+            batches = [
+                batches[i] for i in self.random_state.permutation(len(batches))
+            ]
+        for batch in batches:
+            yield batch.tolist()
+
+
+class PaddingCollator:
+    """
+    Collates unpadded token samples by right-padding the token fields to
+    the longest sequence in the batch. Every other field goes through the
+    default collate function.
+
+    Args:
+        pad_fields {Sequence[str]} -- fields holding 1D token tensors
+        pad_value {int} -- value used for padding
+    """
+    def __init__(self,
+                 pad_fields: Sequence[str] = TOKEN_FIELDS,
+                 pad_value: int = 0):
+        self.pad_fields = pad_fields
+        self.pad_value = pad_value
+
+    def __call__(self, samples: List[Dict]) -> Dict[str, torch.Tensor]:
+        batch = {}
+        for key in samples[0]:
+            values = [sample[key] for sample in samples]
+            if key in self.pad_fields:
+                batch[key] = torch.nn.utils.rnn.pad_sequence(
+                    values, batch_first=True, padding_value=self.pad_value)
+            else:
+                batch[key] = default_collate(values)
+        return batch
+
+
+class BatchShapeStats:
+    """
+    Accumulates the shapes of the token batches a trainer sees so the cost
+    of padding can be reported once per epoch. When max_len is given the
+    report includes how many token slots fixed-length padding would have
+    used instead.
+
+    Args:
+        max_len {int} -- fixed padding length to compare against
+    """
+    def __init__(self, max_len: int = None):
+        self.max_len = max_len
+        self.reset()
+
+    def reset(self) -> None:
+        self.lengths = collections.Counter()
+        self.samples = 0
+        self.tokens = 0
+        self.slots = 0
+
+    def update(self, mask: torch.Tensor) -> None:
+        batch_size, length = mask.shape
+        self.lengths[length] += 1
+        self.samples += batch_size
+        self.tokens += int(mask.sum())
+        self.slots += batch_size * length
+
+    def summary(self) -> Dict[str, float]:
+        batches = sum(self.lengths.values())
+        if not batches:
+            return {}
+        lengths = np.array(list(self.lengths.elements()))
+        summary = {
+            'batches': batches,
+            'mean_length': float(lengths.mean()),
+            'p50_length': float(np.percentile(lengths, 50)),
+            'max_length': int(lengths.max()),
+            'padding_fraction': 1 - self.tokens / self.slots
+        }
+        if self.max_len:
+            summary['fixed_padding_fraction'] = (1 - self.tokens /
+                                                 (self.samples * self.max_len))
+            summary['slots_saved'] = 1 - self.slots / (self.samples *
+                                                       self.max_len)
+        return summary
+
+    def log(self, name: str) -> None:
+        summary = self.summary()
+        if not summary:
+            return
+        report = ', '.join(f'{key}={round(value, 3)}'
+                           for key, value in summary.items())
+        LOGGER.info(f'{name} batch shapes: {report}')
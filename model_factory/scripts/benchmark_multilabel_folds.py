@@ -0,0 +1,96 @@
+import time
+from typing import Dict
+
+import click
+import numpy as np
+import pandas as pd
+from iterstrat.ml_stratifiers import MultilabelStratifiedKFold
+
+import cross_validators
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+BENGALI_TARGETS = ['grapheme_root', 'vowel_diacritic', 'consonant_diacritic']
+
+
+def synthetic_targets(n_rows: int, seed: int = 0) -> np.array:
+    """Skewed class columns with the Bengali class counts (168, 11, 7)"""
+    random_state = np.random.RandomState(seed)
+    return np.stack([
+        random_state.zipf(1.3, n_rows) % 168,
+        random_state.zipf(1.5, n_rows) % 11,
+        random_state.zipf(2.0, n_rows) % 7
+    ],
+                    axis=1)
+
+
+def fold_balance(labels: np.array, folds: np.array,
+                 n_splits: int) -> Dict[str, float]:
+    """
+    Label and example distribution of Sechidis et al.: mean absolute
+    deviation of the per-fold label proportions and of the fold sizes from
+    the full dataset
+    """
+    fold_sizes = np.bincount(folds, minlength=n_splits)
+    fold_labels = np.stack(
+        [labels[folds == fold].sum(axis=0) for fold in range(n_splits)])
+    expected = labels.mean(axis=0)
+    label_distribution = np.abs(fold_labels / fold_sizes[:, None] -
+                                expected).mean()
+    return {
+        'label_distribution':
+        float(label_distribution),
+        'example_distribution':
+        float(np.abs(fold_sizes - len(folds) / n_splits).mean()),
+        'empty_label_folds':
+        int((fold_labels == 0).sum())
+    }
+
+
+def iterstrat_folds(labels: np.array, n_splits: int, seed: int) -> np.array:
+    folds = np.full(len(labels), -1, dtype=np.int8)
+    splitter = MultilabelStratifiedKFold(n_splits=n_splits,
+                                         shuffle=True,
+                                         random_state=seed)
+    for fold, (_, val_idx) in enumerate(splitter.split(labels, labels)):
+        folds[val_idx] = fold
+    return folds
+
+
+def vectorized_folds(labels: np.array, n_splits: int, seed: int) -> np.array:
+    return cross_validators.IterativeStratifiedKFold(
+        n_splits=n_splits, shuffle=True, random_state=seed).assign(labels)
+
+
+@click.command()
+@click.option('-in', '--input', type=str, default=None)
+@click.option('-n', '--n-rows', type=int, default=200000)
+@click.option('-k', '--n-splits', type=int, default=5)
+@click.option('-s', '--seed', type=int, default=123)
+def main(input: str, n_rows: int, n_splits: int, seed: int):
+    """
+    Compares runtime and fold balance of iterstrat's
+    MultilabelStratifiedKFold and IterativeStratifiedKFold on the Bengali
+    targets (or synthetic ones with the same class counts)
+    """
+    if input:
+        y = pd.read_csv(input, usecols=BENGALI_TARGETS)[BENGALI_TARGETS].values
+    else:
+        y = synthetic_targets(n_rows=n_rows, seed=seed)
+    labels = cross_validators.label_indicators(y)
+    results = {}
+    for name, assign in (('iterstrat', iterstrat_folds), ('vectorized',
+                                                          vectorized_folds)):
+        start = time.perf_counter()
+        folds = assign(labels=labels, n_splits=n_splits, seed=seed)
+        results[name] = {
+            'seconds': time.perf_counter() - start,
+            **fold_balance(labels=labels, folds=folds, n_splits=n_splits)
+        }
+    LOGGER.info(f'{labels.shape[0]} rows, {labels.shape[1]} labels\n'
+                f'{pd.DataFrame(results).T.to_string()}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import click
+import pandas as pd
+
+import cross_validators
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+
+@click.command()
+@click.option('-in',
+              '--input',
+              type=str,
+              default="inputs/bengali_grapheme/train-folds.csv")
+def main(input: str):
+    """Writes the parquet fold table for an existing train-folds csv"""
+    cross_validators.write_fold_table(train=pd.read_csv(input), csv_path=input)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import click
+
+import image_store
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+
+@click.command()
+@click.option('-in',
+              '--input',
+              type=str,
+              default="inputs/bengali_grapheme/train_*.parquet")
+@click.option('-ou',
+              '--output',
+              type=str,
+              default="inputs/bengali_grapheme/image_store")
+@click.option('-j', '--n-jobs', type=int, default=-1)
+def main(input: str, output: str, n_jobs: int):
+    image_store.pack_parquet_images(input=input,
+                                    output_dir=output,
+                                    n_jobs=n_jobs)
+
+
+if __name__ == "__main__":
+    main()
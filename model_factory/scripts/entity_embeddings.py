@@ -5,12 +5,12 @@ from typing import Dict, List, Tuple
 import numpy as np
 import pandas as pd
 import tensorflow as tf
-from sklearn import preprocessing
 from tensorflow.keras import Model, callbacks, layers, optimizers
 from tensorflow.keras import utils as keras_utils
 from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.utils import multi_gpu_model
 
+import encoders
 import metrics
 import utils
 
@@ -38,7 +38,8 @@ def combine_train_and_test(args: types.SimpleNamespace) -> pd.DataFrame:
     return combined
 
 
-def prepare_data_dictionary(df: pd.DataFrame) -> Dict:
+def prepare_data_dictionary(df: pd.DataFrame,
+                            encoder_path: str = None) -> Dict:
     def _get_feature_names(df: pd.DataFrame) -> List[str]:
         return [
             feature for feature in df.columns
@@ -52,11 +53,12 @@ def prepare_data_dictionary(df: pd.DataFrame) -> Dict:
         return train, test
 
     def _label_encode(df: pd.DataFrame, feature_names: List[str]) -> Tuple:
-        for feat in feature_names:
-            LOGGER.info(f'Preprocessing Feature {feat}')
-            encoder = preprocessing.LabelEncoder()
-            df[feat] = encoder.fit_transform(
-                df[feat].fillna("-1").astype(str).values)
+        encoder = encoders.CategoricalEncoder(columns=feature_names,
+                                              as_str=True)
+        df = encoder.fit_transform(df)
+        if encoder_path:
+            LOGGER.info(f'Saving categorical encoder to {encoder_path}')
+            encoder.save(encoder_path)
         return df
 
     feature_names = _get_feature_names(df=df)
@@ -106,7 +108,9 @@ def listify_features(df: pd.DataFrame, features: List[str]) -> List[np.array]:
 
 def main(args: types.SimpleNamespace):
     combined_data = combine_train_and_test(args=args)
-    data_dictionary = prepare_data_dictionary(df=combined_data)
+    data_dictionary = prepare_data_dictionary(
+        df=combined_data,
+        encoder_path=f'{args.model_path}/categorical_encoder.npz')
     train_feature_lists = listify_features(
         df=data_dictionary['X_train'],
         features=data_dictionary['feature_names'])
@@ -118,7 +122,7 @@ def main(args: types.SimpleNamespace):
     model = multi_gpu_model(model, gpus=args.n_gpus, cpu_relocation=True)
     model.compile(optimizer='adam',
                   loss='binary_crossentropy',
-                  metrics=[metrics.keras_auc])
+                  metrics=[metrics.StreamingAUC(name='auc')])
     early_stopping = callbacks.EarlyStopping(monitor='val_auc',
                                              min_delta=0.001,
                                              patience=5,
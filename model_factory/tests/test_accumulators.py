@@ -0,0 +1,44 @@
+import numpy as np
+import torch
+
+import accumulators
+
+
+def test_epoch_accumulator_matches_concatenation_and_samples_batches():
+    batches = [(torch.rand(4, 3, requires_grad=True), torch.rand(4, 3))
+               for _ in range(5)] + [(torch.rand(2, 3), torch.rand(2, 3))]
+    accumulator = accumulators.EpochAccumulator(n_samples=22)
+    for predictions, targets in batches:
+        loss = (predictions - targets).pow(2).mean()
+        assert accumulator.step(loss)
+        accumulator.record(predictions=predictions, targets=targets)
+    final_loss, final_preds, final_targets = accumulator.compute()
+    assert isinstance(final_loss, float)
+    assert not final_preds.requires_grad
+    np.testing.assert_allclose(final_loss,
+                               np.mean([(p - t).pow(2).mean().item()
+                                        for p, t in batches]),
+                               rtol=1e-6)
+    assert torch.equal(final_preds,
+                       torch.cat([predictions for predictions, _ in batches]))
+    assert torch.equal(final_targets, torch.cat([t for _, t in batches]))
+
+    sampled = accumulators.EpochAccumulator(n_samples=22, metrics_every_n=2)
+    recorded = [sampled.step(torch.tensor(1.0)) for _ in batches]
+    assert recorded == [True, False, True, False, True, False]
+    for (predictions, targets), record in zip(batches, recorded):
+        if record:
+            sampled.record(predictions=predictions, targets=targets)
+    assert len(sampled.compute()[1]) == 12
+
+
+def test_prediction_buffer_grows_past_capacity():
+    buffer = accumulators.PredictionBuffer(n_samples=3)
+    for _ in range(3):
+        buffer.update(predictions=torch.ones(2, 2, dtype=torch.float64),
+                      targets=torch.zeros(2, dtype=torch.long))
+    predictions, targets = buffer.compute()
+    assert predictions.shape == (6, 2)
+    assert predictions.dtype == torch.float64
+    assert targets.dtype == torch.long
+    assert (predictions == 1).all()
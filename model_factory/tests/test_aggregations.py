@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+import aggregations
+
+
+def test_statistics_match_groupby_and_reuse_codes_on_test():
+    random_state = np.random.RandomState(0)
+    train = pd.DataFrame({
+        'qid': random_state.choice(['a', 'b', 'c', 'd'], 200),
+        'length': random_state.rand(200)
+    })
+    train.loc[::7, 'length'] = np.nan
+    statistics = ['count', 'sum', 'mean', 'std', 'min', 'max']
+    builder = aggregations.AggregationFeatureBuilder(keys=['qid'],
+                                                     statistics=statistics,
+                                                     values=['length'])
+    features = builder.fit_transform(train)
+    grouped = train.groupby('qid')['length']
+    for statistic in statistics:
+        np.testing.assert_allclose(features[f'qid_length_{statistic}'],
+                                   grouped.transform(statistic))
+
+    test = pd.DataFrame({'qid': ['b', 'z'], 'length': [0.0, 0.0]})
+    test_features = builder.transform(test)
+    np.testing.assert_allclose(test_features.qid_length_mean.iloc[0],
+                               grouped.mean()['b'])
+    assert test_features.qid_length_count.iloc[1] == 0
+    assert np.isnan(test_features.qid_length_max.iloc[1])
+
+
+def test_key_frequency():
+    df = pd.DataFrame({'question1': ['x', 'y', 'x', 'x'], 'other': [1] * 4})
+    features = aggregations.AggregationFeatureBuilder(
+        keys=['question1']).fit_transform(df)
+    np.testing.assert_array_equal(features.question1_count, [3, 1, 3, 3])
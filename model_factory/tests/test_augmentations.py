@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import torch
+
+import augmentations
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.239, 0.225)
+
+
+def test_batch_normalize_rgb():
+    images = torch.randint(0, 256, (4, 1, 6, 7), dtype=torch.uint8)
+    normalized = augmentations.BatchNormalize(mean=MEAN, std=STD,
+                                              channels=3)(images)
+    expected = (images.float() / 255 - torch.tensor(MEAN).reshape(
+        1, 3, 1, 1)) / torch.tensor(STD).reshape(1, 3, 1, 1)
+    assert normalized.shape == (4, 3, 6, 7)
+    assert torch.allclose(normalized, expected, atol=1e-5)
+
+
+def test_batch_normalize_single_channel():
+    images = torch.randint(0, 256, (4, 1, 6, 7), dtype=torch.uint8)
+    normalized = augmentations.BatchNormalize(mean=MEAN, std=STD,
+                                              channels=1)(images)
+    expected = (images.float() / 255 - np.mean(MEAN)) / np.mean(STD)
+    assert normalized.shape == (4, 1, 6, 7)
+    assert torch.allclose(normalized, expected.float(), atol=1e-5)
+
+
+def test_warp_matches_cv2():
+    cv2 = pytest.importorskip('cv2')
+    image = cv2.GaussianBlur(
+        np.random.uniform(0, 255, (40, 60)).astype(np.float32), (9, 9), 3)
+    angle, scale, dx, dy = 4.0, 1.05, 0.03, -0.02
+    matrix = cv2.getRotationMatrix2D((30, 20), angle, scale)
+    matrix[0, 2] += dx * 60
+    matrix[1, 2] += dy * 40
+    expected = cv2.warpAffine(image,
+                              matrix, (60, 40),
+                              flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_REFLECT_101)
+    warped = augmentations.BatchShiftScaleRotate.warp(
+        torch.from_numpy(image)[None, None], torch.tensor([angle]),
+        torch.tensor([scale]), torch.tensor([dx]), torch.tensor([dy]))
+    # border handling differs slightly, so only the interior is compared
+    np.testing.assert_allclose(warped[0, 0, 10:-10, 10:-10].numpy(),
+                               expected[10:-10, 10:-10],
+                               atol=1e-3)
+
+
+def test_sampled_params_within_limits():
+    stage = augmentations.BatchShiftScaleRotate(p=0.9, seed=0)
+    angle, scale, dx, dy = stage.sample_params(batch_size=10000)
+    assert angle.abs().max() <= 5
+    assert (scale - 1).abs().max() <= 0.1
+    assert max(dx.abs().max(), dy.abs().max()) <= 0.0625
+    assert 0.88 < (angle != 0).float().mean() < 0.92
+
+
+def test_unseeded_stages_draw_different_params():
+    first = augmentations.BatchShiftScaleRotate(p=1.0).sample_params(100)
+    second = augmentations.BatchShiftScaleRotate(p=1.0).sample_params(100)
+    assert not torch.equal(first[0], second[0])
+    seeded = [
+        augmentations.BatchShiftScaleRotate(p=1.0, seed=3).sample_params(100)
+        for _ in range(2)
+    ]
+    assert torch.equal(seeded[0][0], seeded[1][0])
+
+
+def test_batch_augmentation_shape():
+    images = torch.randint(0, 256, (8, 1, 137, 236), dtype=torch.uint8)
+    augmented = augmentations.BatchAugmentation(mean=MEAN,
+                                                std=STD,
+                                                channels=3,
+                                                seed=0)(images)
+    assert augmented.shape == (8, 3, 137, 236)
+    assert augmented.dtype == torch.float
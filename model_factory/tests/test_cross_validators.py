@@ -0,0 +1,203 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import cross_validators
+
+
+def _write_folds(tmp_path) -> str:
+    df = pd.DataFrame({
+        'text': [f'row {i}' for i in range(20)],
+        'target': np.arange(20) % 3,
+        'kfold': np.random.RandomState(0).randint(0, 5, size=20)
+    })
+    csv_path = str(tmp_path / 'train-folds.csv')
+    df.to_csv(csv_path, index=False)
+    cross_validators.write_fold_table(train=df, csv_path=csv_path)
+    return csv_path
+
+
+def test_fold_table_has_row_group_per_fold(tmp_path):
+    csv_path = _write_folds(tmp_path)
+    parquet_file = pq.ParquetFile(cross_validators.fold_table_path(csv_path))
+    assert parquet_file.metadata.num_row_groups == 5
+    assert cross_validators._fold_row_groups(parquet_file,
+                                             folds=[1, 3]) == [1, 3]
+
+
+def test_read_folds_matches_csv(tmp_path):
+    csv_path = _write_folds(tmp_path)
+    from_table = cross_validators.read_folds(csv_path=csv_path,
+                                             folds=[0, 2],
+                                             columns=['text'])
+    os.remove(cross_validators.fold_table_path(csv_path))
+    from_csv = cross_validators.read_folds(csv_path=csv_path,
+                                           folds=[0, 2],
+                                           columns=['text'])
+    assert list(from_table.columns) == ['text', 'kfold', 'csv_row']
+    pd.testing.assert_frame_equal(from_table, from_csv, check_dtype=False)
+    df = pd.read_csv(csv_path)
+    np.testing.assert_array_equal(from_csv.csv_row,
+                                  np.flatnonzero(df.kfold.isin([0, 2])))
+
+
+@pytest.mark.parametrize('strategy', cross_validators.FoldAssigner.STRATEGIES)
+def test_fold_assigner_strategies(strategy):
+    random_state = np.random.RandomState(0)
+    y = random_state.randint(0, 2, size=(60, 2))
+    groups = np.repeat(np.arange(12), 5)
+    assigner = cross_validators.FoldAssigner(strategy=strategy, n_splits=3)
+    folds = assigner.assign(n_rows=60,
+                            y=y[:, 0] if strategy == 'stratified' else y,
+                            groups=groups)
+    assert folds.dtype == np.int8
+    assert sorted(np.unique(folds)) == [0, 1, 2]
+    if strategy == 'group':
+        assert (pd.Series(folds).groupby(groups).nunique() == 1).all()
+
+
+def test_cross_validator_writes_only_fold_index(tmp_path):
+    input_path = str(tmp_path / 'train.csv')
+    pd.DataFrame({
+        'text': [f'row {i}' for i in range(30)],
+        'target': np.arange(30) % 2
+    }).to_csv(input_path, index=False)
+    validator = cross_validators.QuoraCrossValidator(input_path=input_path,
+                                                     output_path=None,
+                                                     target='target',
+                                                     n_splits=3)
+    validator.apply_stratified_kfold()
+    assert sorted(os.listdir(tmp_path)) == ['train.csv', 'train.folds.npy']
+    assert validator.fold_mapping[1] == [0, 2]
+
+    train, valid = validator.split_data(fold=1, input_path=input_path)
+    assert len(train) + len(valid) == 30
+    assert set(valid.kfold) == {1}
+    assert valid.target.mean() == 0.5
+
+
+def test_fold_index_is_read_through_train_folds_path(tmp_path):
+    input_path = str(tmp_path / 'train.csv')
+    df = pd.DataFrame({
+        'text': [f'row {i}' for i in range(30)],
+        'target': np.arange(30) % 2
+    })
+    df.to_csv(input_path, index=False)
+    validator = cross_validators.QuoraCrossValidator(input_path=input_path,
+                                                     output_path=None,
+                                                     target='target',
+                                                     n_splits=3)
+    folds = validator.assign_folds().kfold.values
+    csv_path = cross_validators.resolve_folds_path(
+        str(tmp_path / 'train-folds.csv'))
+    assert csv_path == input_path
+    loaded = cross_validators.read_folds(csv_path=csv_path,
+                                         folds=[1],
+                                         columns=['text'])
+    rows = np.flatnonzero(folds == 1)
+    np.testing.assert_array_equal(loaded.csv_row, rows)
+    np.testing.assert_array_equal(loaded.text, df.text.values[rows])
+
+
+def test_hash_folds_are_stable_when_rows_are_appended(tmp_path):
+    input_path = str(tmp_path / 'train.csv')
+    index_path = cross_validators.fold_index_path(input_path)
+    train = pd.DataFrame({
+        'id': [f'id{i}' for i in range(500)],
+        'target': np.arange(500) % 3
+    })
+    train[:300].to_csv(input_path, index=False)
+    assigner = cross_validators.HashFoldAssigner(key='id',
+                                                 n_splits=4,
+                                                 stratify='target',
+                                                 chunk_size=64)
+    first = assigner.assign_csv(input_path, index_path=index_path)
+    train.to_csv(input_path, index=False)
+    appended = assigner.assign_csv(input_path, index_path=index_path)
+    full = cross_validators.HashFoldAssigner(key='id',
+                                             n_splits=4,
+                                             stratify='target',
+                                             chunk_size=1000)
+    os.remove(f'{index_path}.state.json')
+    assert len(appended) == 500
+    np.testing.assert_array_equal(appended[:300], first)
+    np.testing.assert_array_equal(
+        full.assign_csv(input_path, index_path=index_path), appended)
+    counts = pd.crosstab(train.target, appended)
+    assert (counts.max(axis=1) - counts.min(axis=1) <= 1).all()
+
+
+def test_hash_folds_reject_rewritten_csv(tmp_path):
+    input_path = str(tmp_path / 'train.csv')
+    index_path = cross_validators.fold_index_path(input_path)
+    pd.DataFrame({'id': range(10)}).to_csv(input_path, index=False)
+    assigner = cross_validators.HashFoldAssigner(key='id', n_splits=3)
+    folds = assigner.assign_csv(input_path, index_path=index_path)
+    assert folds.dtype == np.int8
+    pd.DataFrame({'id': range(100, 120)}).to_csv(input_path, index=False)
+    with pytest.raises(ValueError):
+        assigner.assign_csv(input_path, index_path=index_path)
+
+
+def test_cross_validator_assigns_hash_folds(tmp_path):
+    input_path = str(tmp_path / 'train.csv')
+    pd.DataFrame({
+        'id': range(60),
+        'target': np.arange(60) % 2
+    }).to_csv(input_path, index=False)
+    validator = cross_validators.CategoricalChallengeCrossValidator(
+        input_path=input_path,
+        output_path=None,
+        target='target',
+        n_splits=3,
+        hash_key='id')
+    validator.apply_stratified_kfold()
+    train, valid = validator.split_data(fold=0, input_path=input_path)
+    assert len(train) + len(valid) == 60
+    assert valid.target.mean() == 0.5
+
+
+def test_iterative_stratification_balances_bengali_style_targets():
+    random_state = np.random.RandomState(0)
+    y = np.stack([
+        random_state.zipf(1.5, 3000) % 30,
+        random_state.randint(0, 11, 3000),
+        random_state.randint(0, 7, 3000)
+    ],
+                 axis=1)
+    folds = cross_validators.IterativeStratifiedKFold(n_splits=5,
+                                                      shuffle=True,
+                                                      random_state=1).assign(y)
+    labels = cross_validators.label_indicators(y)
+    assert labels.shape == (3000, len(np.unique(y[:, 0])) + 11 + 7)
+    assert np.abs(np.bincount(folds) - 600).max() <= 3
+    fold_labels = np.stack([labels[folds == k].sum(axis=0) for k in range(5)])
+    spread = fold_labels.max(axis=0) - fold_labels.min(axis=0)
+    # rare labels are split exactly, common ones to within a small share
+    assert (spread <= np.maximum(2, 0.15 * labels.sum(axis=0) / 5)).all()
+
+
+def test_purged_era_kfold_returns_purged_index_arrays():
+    eras = np.repeat(np.arange(1, 11), 4)
+    shuffled = np.random.RandomState(0).permutation(len(eras))
+    splitter = cross_validators.PurgedEraKFold(n_splits=5,
+                                               purge_eras=1,
+                                               embargo_eras=2)
+    splits = list(splitter.split(groups=eras[shuffled]))
+    assert len(splits) == 5
+    for fold, (train, test) in enumerate(splits):
+        test_eras = np.unique(eras[shuffled][test])
+        train_eras = np.unique(eras[shuffled][train])
+        assert list(test_eras) == [2 * fold + 1, 2 * fold + 2]
+        assert train.dtype.kind == 'i' and len(test) == 8
+        assert not set(train_eras) & set(
+            range(test_eras[0] - 1, test_eras[-1] + 3))
+
+    walk_forward = cross_validators.PurgedEraKFold(n_splits=5,
+                                                   walk_forward=True)
+    splits = list(walk_forward.split(groups=eras))
+    assert len(splits) == 4
+    assert all(train.max() < test.min() for train, test in splits)
@@ -34,3 +34,22 @@ def test_data_info(bengali_train_dataset):
     assert isinstance(
         bengali_train_dataset[np.random.randint(100)]['grapheme_root'],
         torch.Tensor)
+
+
+def test_streaming_test_dataset(tmp_path):
+    images = np.random.randint(0, 256, size=(10, 4 * 5), dtype=np.uint8)
+    df = pd.DataFrame(images, columns=[str(col) for col in range(4 * 5)])
+    df.insert(0, 'image_id', [f'Test_{idx}' for idx in range(10)])
+    path = str(tmp_path / 'test_image_data_0.parquet')
+    df.to_parquet(path, row_group_size=3)
+    test_set = datasets.BengaliDataSetTestStream(parquet_paths=[path],
+                                                 image_height=4,
+                                                 image_width=5,
+                                                 single_channel=True)
+    samples = list(test_set)
+    assert len(test_set.row_groups) == 4
+    assert [sample['image_id'] for sample in samples] == list(df.image_id)
+    for sample, image in zip(samples, images):
+        assert sample['image'].dtype == torch.uint8
+        assert torch.equal(sample['image'],
+                           torch.from_numpy(image.reshape(1, 4, 5)))
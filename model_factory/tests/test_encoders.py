@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from sklearn import preprocessing
+
+import encoders
+
+
+def test_codes_match_label_encoder_and_persist(tmp_path):
+    train = pd.DataFrame({
+        'color': ['red', 'blue', np.nan, 'green', 'blue'],
+        'size': [3, 10, 2, 10, np.nan]
+    })
+    encoder = encoders.CategoricalEncoder(n_jobs=2).fit(train)
+    encoded = encoder.transform(train)
+    np.testing.assert_array_equal(
+        encoded.color,
+        preprocessing.LabelEncoder().fit_transform(
+            train.color.fillna('-1').astype(str)))
+    # numeric categories sort numerically, missing values last
+    np.testing.assert_array_equal(encoded['size'], [1, 2, 0, 2, 3])
+    assert encoded.color.dtype == np.int32
+    assert encoder.cardinalities == {'color': 5, 'size': 5}
+
+    path = str(tmp_path / 'encoder.npz')
+    encoder.save(path)
+    loaded = encoders.CategoricalEncoder.load(path)
+    test = pd.DataFrame({'color': ['green', 'purple'], 'size': [2, np.nan]})
+    pd.testing.assert_frame_equal(loaded.transform(test),
+                                  encoder.transform(test))
+    np.testing.assert_array_equal(loaded.transform(test).color, [2, 4])
+    np.testing.assert_array_equal(loaded.transform(test)['size'], [0, 3])
+
+
+def test_as_str_reads_numeric_columns_as_strings():
+    train = pd.DataFrame({'size': [3, 10, 2, 10, np.nan]})
+    encoded = encoders.CategoricalEncoder(as_str=True).fit_transform(train)
+    expected = preprocessing.LabelEncoder().fit_transform(
+        train['size'].fillna('-1').astype(str))
+    np.testing.assert_array_equal(encoded['size'], expected)
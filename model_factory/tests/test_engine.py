@@ -1,4 +1,5 @@
 import pytest
+import torch
 
 import engines
 import models
@@ -27,3 +28,28 @@ def test_attributes(params):
                       datasets.BengaliDataSetTrain)
     assert issubclass(bengali.val_constructor, datasets.BengaliDataSetTrain)
     assert issubclass(bengali.test_constructor, datasets.BengaliDataSetTest)
+
+
+def test_ordered_token_loader_keeps_dataset_order():
+    class TokenDataSet(torch.utils.data.Dataset):
+        lengths = [5, 2, 7, 3, 4]
+
+        def __len__(self):
+            return len(self.lengths)
+
+        def __getitem__(self, idx):
+            return {
+                'ids': torch.full((self.lengths[idx], ), idx + 1),
+                'targets': torch.tensor(idx)
+            }
+
+    loader = engines.get_token_loader(dataset=TokenDataSet(),
+                                      batch_size=2,
+                                      shuffle=False,
+                                      num_workers=0,
+                                      data_params={'dynamic_padding': True},
+                                      keep_order=True)
+    batches = list(loader)
+    assert torch.cat([batch['targets']
+                      for batch in batches]).tolist() == [0, 1, 2, 3, 4]
+    assert batches[0]['ids'].shape == (2, 5)
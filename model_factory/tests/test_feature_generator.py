@@ -0,0 +1,75 @@
+import nltk
+import numpy as np
+import pandas as pd
+import pytest
+
+from feature_generator import QuoraFeatureGenerator, TextPreprocessor
+
+
+def test_quora_overlap_feats_match_word_sets():
+    df = pd.DataFrame({
+        'question1': ['What is AI?', 'How do I  learn  python', 'a a b'],
+        'question2': ['what is ai?', 'Learn Python fast', np.nan]
+    })
+    features = QuoraFeatureGenerator(
+        name='quora').create_quora_overlap_feats(df)
+    np.testing.assert_array_equal(features.question1_n_words, [3, 5, 3])
+    np.testing.assert_array_equal(features.question2_n_words, [3, 3, 0])
+    np.testing.assert_array_equal(features.total_words, [6, 8, 2])
+    np.testing.assert_array_equal(features.common_words, [3, 2, 0])
+    np.testing.assert_allclose(features.shared_words, [0.5, 0.25, 0])
+
+
+def test_quora_word_feats_share_one_overlap_pass(monkeypatch):
+    df = pd.DataFrame({
+        'question1': ['What is AI?', 'a a b'],
+        'question2': ['what is ai?', 'b c']
+    })
+    generator = QuoraFeatureGenerator(name='quora')
+    calls = []
+    create_overlap_feats = generator.create_quora_overlap_feats
+
+    def _counting(df):
+        calls.append(df)
+        return create_overlap_feats(df)
+
+    monkeypatch.setattr(generator, 'create_quora_overlap_feats', _counting)
+    total = generator.create_quora_total_words_feats(df)
+    common = generator.create_quora_common_words_feats(df)
+    shared = generator.create_quora_shared_words_feats(df)
+    assert len(calls) == 1
+    np.testing.assert_allclose(shared, common / total)
+    generator.create_quora_total_words_feats(df.copy())
+    assert len(calls) == 2
+
+
+def test_text_preprocessor_returns_ragged_stems():
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        pytest.skip('punkt tokenizer data not installed')
+    df = pd.DataFrame({
+        'question1': ['How  do I learn running?', 'Cats running', np.nan],
+        'question2': ['Learning runs', '', 'cats']
+    })
+    tokenized = TextPreprocessor(n_jobs=2, chunk_size=2).transform(
+        df=df, columns=['question1', 'question2'])
+    question1, question2 = tokenized['question1'], tokenized['question2']
+    assert question1.ids.dtype == np.int32
+    assert question1.vocabulary is question2.vocabulary
+    assert question1[0] == ['how', 'do', 'i', 'learn', 'run', '?']
+    assert question1[1] == ['cat', 'run']
+    assert question1[2] == [] and question2[1] == []
+    np.testing.assert_array_equal(question2.lengths, [2, 0, 1])
+    assert question2[2] == ['cat']
+
+
+def test_frequency_feats_match_groupby_for_text_keys():
+    df = pd.DataFrame({'question1': ['b', 'a', 'b', np.nan, 'c', 'a', 'b']})
+    generator = QuoraFeatureGenerator(name='quora')
+    for stat in ['count', 'min', 'max', 'nunique']:
+        pd.testing.assert_series_equal(
+            generator.create_frequency_feats(df, feat='question1', stat=stat),
+            df.groupby('question1')['question1'].transform(stat),
+            check_dtype=False,
+            check_names=False)
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import feature_store
+
+
+def test_store_round_trip_loads_only_requested_columns(tmp_path):
+    store = feature_store.FeatureStore(str(tmp_path / 'store'))
+    data = pd.DataFrame({'text': ['a b', 'b c', 'c']})
+    key = store.key(data_hash=feature_store.hash_frame(data),
+                    generator='QuoraFeatureGenerator',
+                    version=1,
+                    method='create_quora_overlap_feats',
+                    params={'columns': ['question1', 'question2']})
+    assert not store.has(key)
+    features = pd.DataFrame({
+        'n_words': [2, 2, 1],
+        'shared': [0.5, np.nan, 0.0]
+    })
+    stored = store.save(key=key, features=features)
+    assert store.has(key)
+    assert stored.columns == ['n_words', 'shared'] and len(stored) == 3
+
+    reopened = store.open(key)
+    shared = reopened['shared']
+    assert list(reopened._columns) == ['shared']
+    pd.testing.assert_series_equal(shared, features.shared)
+    pd.testing.assert_frame_equal(reopened.load(), features)
+
+
+def test_losing_writer_reuses_stored_entry(tmp_path):
+    store = feature_store.FeatureStore(str(tmp_path / 'store'))
+    first = pd.DataFrame({'n_words': [1, 2]})
+    store.save(key='k', features=first)
+    # a writer that finished after the first one found the key missing
+    stored = store.save(key='k', features=pd.DataFrame({'n_words': [3, 4]}))
+    pd.testing.assert_frame_equal(stored.load(), first)
+    assert os.listdir(tmp_path /
+                      'store') == [os.path.basename(store.path('k'))]
+
+
+def test_key_changes_with_data_version_and_params():
+    data = pd.DataFrame({'text': ['a', 'b']})
+    changed = pd.DataFrame({'text': ['a', 'c']})
+    key = feature_store.FeatureStore.key
+    base = dict(generator='G', version=1, method='m', params={'n': 1})
+    keys = {
+        key(data_hash=feature_store.hash_frame(data), **base),
+        key(data_hash=feature_store.hash_frame(changed), **base),
+        key(data_hash=feature_store.hash_frame(data), **{
+            **base, 'version': 2
+        }),
+        key(data_hash=feature_store.hash_frame(data),
+            **{
+                **base, 'params': {
+                    'n': 2
+                }
+            })
+    }
+    assert len(keys) == 4
+    assert key(data_hash=feature_store.hash_frame(data.copy()), **base) in keys
@@ -0,0 +1,110 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+import fold_scheduler
+import image_store
+
+
+class TinyModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(3 * 8 * 8, 168 + 11 + 7)
+
+    def forward(self, x):
+        return torch.split(self.linear(x.flatten(1)), [168, 11, 7], dim=1)
+
+
+def test_decoded_images_are_removed_after_use(tmp_path):
+    images = np.random.RandomState(0).randint(0, 255, (3, 4, 5), np.uint8)
+    pd.DataFrame({
+        'image_id': ['a', 'b', 'c']
+    }).to_csv(tmp_path / 'train.csv', index=False)
+    (tmp_path / 'pickles').mkdir()
+    for image_id, image in zip('abc', images):
+        joblib.dump(image, tmp_path / 'pickles' / f'{image_id}.pkl')
+    output_dir = fold_scheduler.decode_training_images(
+        train_path=str(tmp_path / 'train.csv'),
+        output_dir=str(tmp_path / 'shm'),
+        pickle_path=str(tmp_path / 'pickles'),
+        image_height=4,
+        image_width=5)
+    store = image_store.PackedImageStore(output_dir)
+    shards, rows = store.locate(['c', 'a'])
+    np.testing.assert_array_equal(
+        [store.get(s, r) for s, r in zip(shards, rows)], images[[2, 0]])
+    del store
+    fold_scheduler.remove_decoded_images(output_dir=output_dir)
+    assert os.listdir(output_dir) == []
+
+
+def test_plan_fold_resources_splits_cores(monkeypatch):
+    monkeypatch.setattr(fold_scheduler.os, 'cpu_count', lambda: 8)
+    monkeypatch.setattr(fold_scheduler.torch.cuda, 'device_count', lambda: 0)
+    resources = fold_scheduler.plan_fold_resources(n_folds=3, n_concurrent=2)
+    assert resources == [{
+        'device': 'cpu',
+        'num_workers': 2,
+        'num_threads': 2
+    }] * 3
+
+
+def test_run_folds_trains_every_fold(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # every fold gets DataLoader workers
+    monkeypatch.setattr(fold_scheduler.os, 'cpu_count', lambda: 4)
+    monkeypatch.setattr(fold_scheduler, 'MODEL_DISPATCHER',
+                        {'tiny': TinyModel()})
+    random_state = np.random.RandomState(0)
+    image_ids = [f'img{i}' for i in range(16)]
+    pd.DataFrame({
+        'image_id': image_ids,
+        'grapheme_root': random_state.randint(0, 168, 16),
+        'vowel_diacritic': random_state.randint(0, 11, 16),
+        'consonant_diacritic': random_state.randint(0, 7, 16),
+        'kfold': np.repeat([0, 1], 8)
+    }).to_csv(tmp_path / 'train-folds.csv', index=False)
+    (tmp_path / 'pickles').mkdir()
+    for image_id in image_ids:
+        joblib.dump(random_state.randint(0, 255, 64, np.uint8),
+                    tmp_path / 'pickles' / f'{image_id}.pkl')
+    (tmp_path / 'models').mkdir()
+    engine_params = {
+        'train_path': str(tmp_path / 'train-folds.csv'),
+        'pickle_path': str(tmp_path / 'pickles'),
+        'model_dir': str(tmp_path / 'models'),
+        'train_batch_size': 4,
+        'test_batch_size': 4,
+        'epochs': 2,
+        'image_height': 8,
+        'image_width': 8,
+        'mean': (0.485, 0.456, 0.406),
+        'std': (0.229, 0.239, 0.225)
+    }
+    results = fold_scheduler.run_folds(model_name='tiny',
+                                       engine_params=engine_params,
+                                       folds={
+                                           0: {
+                                               'train': [1],
+                                               'val': [0]
+                                           },
+                                           1: {
+                                               'train': [0],
+                                               'val': [1]
+                                           }
+                                       },
+                                       shared_dir=str(tmp_path / 'shm'),
+                                       start_method='fork')
+    assert results.val_folds.tolist() == [[0], [1]]
+    assert results.best_score.between(0, 1).all()
+    for fold in (0, 1):
+        model_dir = tmp_path / 'models'
+        assert (model_dir / f'tiny_bengali_fold{fold}.pth').is_file()
+        assert (model_dir / f'tiny_bengali_fold{fold}_checkpoint.pt').is_file()
+    assert (tmp_path / 'models' / 'tiny_bengali_folds.json').is_file()
+    assert not (tmp_path / 'checkpoint.pt').exists()
+    assert os.listdir(tmp_path / 'shm') == []
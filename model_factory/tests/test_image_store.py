@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import image_store
+
+
+@pytest.fixture
+def packed_store(tmp_path):
+    images = np.random.randint(0, 256, size=(6, 4 * 5), dtype=np.uint8)
+    for shard in range(2):
+        df = pd.DataFrame(images[shard * 3:(shard + 1) * 3],
+                          columns=[str(col) for col in range(4 * 5)])
+        df.insert(0, 'image_id',
+                  [f'Train_{shard * 3 + idx}' for idx in range(3)])
+        df.to_parquet(tmp_path / f'train_image_data_{shard}.parquet')
+    image_store.pack_parquet_images(input=str(tmp_path /
+                                              'train_image_data_*.parquet'),
+                                    output_dir=str(tmp_path / 'store'),
+                                    image_height=4,
+                                    image_width=5,
+                                    n_jobs=1)
+    return image_store.PackedImageStore(str(tmp_path / 'store')), images
+
+
+def test_round_trip(packed_store):
+    store, images = packed_store
+    image_ids = np.array(['Train_4', 'Train_0', 'Train_5'])
+    shards, rows = store.locate(image_ids)
+    assert len(store) == 6
+    for image_id, shard, row in zip(image_ids, shards, rows):
+        image = store.get(shard, row)
+        expected = images[int(image_id.split('_')[1])].reshape(4, 5)
+        assert image.dtype == np.uint8
+        assert isinstance(image, np.memmap)
+        np.testing.assert_array_equal(image, expected)
+
+
+def test_missing_image(packed_store):
+    store, _ = packed_store
+    with pytest.raises(KeyError):
+        store.locate(np.array(['Train_99']))
@@ -0,0 +1,74 @@
+import numpy as np
+import torch
+from scipy import stats
+from sklearn import metrics as sk_metrics
+
+import metrics
+
+
+def test_streaming_macro_recall_matches_sklearn():
+    random_state = np.random.RandomState(0)
+    n_classes = [168, 11, 7]
+    y_true = np.column_stack(
+        [random_state.randint(0, high, 3000) for high in [150, 11, 7]])
+    preds = random_state.randn(3000, sum(n_classes)).astype(np.float32)
+    # class 160 is only ever predicted, classes 150-159 and 161+ never seen
+    preds[:20, 160] = 100
+
+    recall = metrics.StreamingMacroRecall()
+    for batch in np.array_split(np.arange(3000), 7):
+        recall.update(preds=torch.from_numpy(preds[batch]),
+                      y_true=torch.from_numpy(y_true[batch]))
+
+    expected = []
+    for idx, pred in enumerate(
+            np.split(preds, np.cumsum(n_classes)[:-1], axis=1)):
+        expected.append(
+            sk_metrics.recall_score(y_true[:, idx],
+                                    pred.argmax(axis=1),
+                                    average='macro'))
+    assert recall.recalls() == expected
+    assert recall.compute() == np.average(expected, weights=[2, 1, 1])
+    assert metrics.macro_recall(torch.from_numpy(preds),
+                                torch.from_numpy(y_true)) == recall.compute()
+
+    recall.reset()
+    assert recall.recalls() == [0.0, 0.0, 0.0]
+    assert recall.compute() == 0.0
+    assert metrics.StreamingMacroRecall().compute() == 0.0
+
+
+def test_spearman_correlation_matches_scipy_with_ties():
+    random_state = np.random.RandomState(0)
+    targets = random_state.choice([0, 1 / 3, 0.5, 2 / 3, 1], size=(500, 6))
+    predictions = random_state.rand(500, 6)
+    predictions[:100, 1] = 0.5
+    predictions[:, 2] = 0.5
+    targets[0, 3] = np.nan
+    expected = [
+        np.nan_to_num(
+            stats.spearmanr(targets[:, idx], predictions[:, idx])[0])
+        for idx in range(6)
+    ]
+    np.testing.assert_allclose(
+        metrics.column_spearman(predictions=predictions, targets=targets),
+        expected)
+    np.testing.assert_allclose(
+        metrics.spearman_correlation(torch.from_numpy(predictions),
+                                     torch.from_numpy(targets)),
+        np.mean(expected))
+
+
+def test_streaming_auc_accumulates_across_batches():
+    random_state = np.random.RandomState(0)
+    y_true = random_state.randint(0, 2, 4000)
+    y_pred = np.clip(random_state.rand(4000) * 0.6 + y_true * 0.3, 0, 1)
+    auc = metrics.StreamingAUC(n_buckets=10000)
+    assert float(auc.result()) == 0.5
+    for batch in np.array_split(np.arange(4000), 4):
+        auc.update_state(y_true[batch], y_pred[batch])
+    np.testing.assert_allclose(float(auc.result()),
+                               sk_metrics.roc_auc_score(y_true, y_pred),
+                               atol=1e-4)
+    auc.reset_state()
+    assert float(auc.result()) == 0.5
@@ -0,0 +1,28 @@
+import torch
+import torch.nn as nn
+
+import augmentations
+import models
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.239, 0.225)
+
+
+def test_fold_rgb_conv_matches_rgb_conv_and_is_idempotent():
+    torch.manual_seed(0)
+    conv = nn.Conv2d(3, 8, kernel_size=7, stride=2, padding=3, bias=False)
+    image = torch.rand(2, 1, 32, 32)
+    rgb = (image.repeat(1, 3, 1, 1) - torch.tensor(MEAN).reshape(
+        1, 3, 1, 1)) / torch.tensor(STD).reshape(1, 3, 1, 1)
+    gray_mean, gray_std = augmentations.single_channel_stats(mean=MEAN,
+                                                             std=STD)
+    folded = models.fold_rgb_conv(conv, mean=MEAN, std=STD)
+    expected = conv(rgb)
+    output = folded((image - gray_mean) / gray_std)
+    # outputs touching the zero padding differ by design
+    torch.testing.assert_close(output[..., 2:-2, 2:-2],
+                               expected[..., 2:-2, 2:-2],
+                               rtol=1e-4,
+                               atol=1e-4)
+
+    assert models.fold_rgb_conv(folded, mean=MEAN, std=STD) is folded
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+nx = pytest.importorskip('numerox')
+
+import numerai_cache
+
+
+@pytest.fixture
+def data():
+    n_rows = 12
+    values = np.random.RandomState(0).rand(n_rows, 5).astype(np.float32)
+    df = pd.DataFrame(values,
+                      index=pd.Index([f'id{i}' for i in range(n_rows)],
+                                     name='id'),
+                      columns=['era', 'region', 'x1', 'x2', 'kazutsugi'])
+    return nx.Data(df)
+
+
+def test_save_and_open_round(tmp_path, data):
+    zip_path = tmp_path / 'numerai_dataset.zip'
+    zip_path.write_bytes(b'round 200')
+    cache = numerai_cache.NumerAIDataCache(str(tmp_path / 'cache'))
+    assert cache.load_round(round_number=200) is None
+
+    cached = cache.save(data=data, zip_path=str(zip_path), round_number=200)
+    base = cached.df.values
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert base is not None
+    pd.testing.assert_frame_equal(cached.df, data.df)
+
+    reopened = cache.load_round(round_number=200)
+    pd.testing.assert_frame_equal(reopened.df, data.df)
+    # a process that parsed the round concurrently keeps the first entry
+    path = f'{cache.cache_dir}/{cache.key(str(zip_path), round_number=200)}'
+    numerai_cache.NumerAIDataCache.build(data=data, path=path)
+    assert sorted(os.listdir(cache.cache_dir)) == [
+        os.path.basename(path), numerai_cache.SOURCES_FILE
+    ]
+    assert cache.load_round(round_number=201) is None
+
+
+def test_key_tracks_file_contents(tmp_path):
+    zip_path = tmp_path / 'numerai_dataset.zip'
+    zip_path.write_bytes(b'round 200')
+    cache = numerai_cache.NumerAIDataCache(str(tmp_path / 'cache'))
+    key = cache.key(str(zip_path), round_number=200)
+    assert key == cache.key(str(zip_path), round_number=200)
+    zip_path.write_bytes(b'round 200, fixed')
+    assert key != cache.key(str(zip_path), round_number=200)
+
+
+def test_reopened_round_is_not_reencoded(tmp_path, data, monkeypatch):
+    zip_path = tmp_path / 'numerai_dataset.zip'
+    zip_path.write_bytes(b'round 200')
+    cache = numerai_cache.NumerAIDataCache(str(tmp_path / 'cache'))
+    cached = cache.save(data=data, zip_path=str(zip_path), round_number=200)
+    quantized = cache.quantize(cached)
+    assert cache.quantize(cached) is quantized
+    assert cache.quantize(data) is None
+
+    # a new process starts without the opened rounds
+    monkeypatch.setattr(numerai_cache, '_OPENED', {})
+    monkeypatch.setattr(numerai_cache, '_QUANTIZED', {})
+
+    def _encode(*args, **kwargs):
+        raise AssertionError('round was re-encoded')
+
+    monkeypatch.setattr(numerai_cache.quantization.Codebook, 'encode', _encode)
+    reopened = cache.quantize(cache.load_round(round_number=200))
+    assert isinstance(reopened.codes, np.memmap)
+    assert reopened.codebook == quantized.codebook
+    np.testing.assert_array_equal(reopened.x, quantized.x)
+    np.testing.assert_array_equal(reopened.y['kazutsugi'], data.y['kazutsugi'])
+    np.testing.assert_array_equal(reopened.ids, data.ids)
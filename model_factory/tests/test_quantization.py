@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+nx = pytest.importorskip('numerox')
+
+import quantization
+
+
+@pytest.fixture
+def data():
+    random_state = np.random.RandomState(0)
+    n_rows = 40
+    x = random_state.choice([0, 0.25, 0.5, 0.75, 1], size=(n_rows, 3))
+    df = pd.DataFrame(
+        {
+            'era': np.repeat([1., 2.], n_rows // 2),
+            'region': np.tile([0., 0., 1., 3.], n_rows // 4),
+            'x1': x[:, 0],
+            'x2': x[:, 1],
+            'x3': x[:, 2],
+            'kazutsugi': random_state.rand(n_rows)
+        },
+        index=pd.Index([f'id{i}' for i in range(n_rows)], name='id'),
+        dtype=np.float32)
+    return nx.Data(df)
+
+
+def test_codebook_is_lossless_and_ordered(data):
+    codebook = quantization.Codebook.fit(data.x)
+    codes = codebook.encode(data.x)
+    assert codes.dtype == np.uint8
+    np.testing.assert_array_equal(codebook.decode(codes), data.x)
+    order = np.argsort(data.x[:, 0], kind='mergesort')
+    assert (np.diff(codes[order, 0].astype(int)) >= 0).all()
+    with pytest.raises(ValueError):
+        codebook.encode(np.full((1, 3), 0.3, dtype=np.float32))
+
+
+def test_quantized_data_regions(data):
+    quantized = quantization.QuantizedData.from_data(data)
+    assert quantized.data.x.shape == (len(data), 0)
+    train = quantized['train']
+    np.testing.assert_array_equal(quantized.codebook.decode(train.x),
+                                  data['train'].x)
+    np.testing.assert_array_equal(train.y['kazutsugi'],
+                                  data['train'].y['kazutsugi'])
+    np.testing.assert_array_equal(quantized['tournament'].ids,
+                                  data['tournament'].ids)
+
+
+def test_trees_on_codes_match_floats(data):
+    xgboost = pytest.importorskip('xgboost')
+    quantized = quantization.QuantizedData.from_data(data)
+    y = data.y['kazutsugi']
+    params = dict(n_estimators=5, max_depth=2, tree_method='exact')
+    on_floats = xgboost.XGBRegressor(**params).fit(data.x, y)
+    on_codes = xgboost.XGBRegressor(**params).fit(quantized.x, y)
+    np.testing.assert_allclose(on_floats.predict(data.x),
+                               on_codes.predict(quantized.x),
+                               rtol=1e-6)
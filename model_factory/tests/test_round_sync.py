@@ -0,0 +1,180 @@
+import http.server
+import multiprocessing
+import os
+import threading
+import zipfile
+
+import pytest
+
+import round_sync
+
+
+class CountingBackend(round_sync.DirectoryBackend):
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.offsets = []
+
+    def fetch(self, round_number: int, offset: int):
+        self.offsets.append(offset)
+        return super().fetch(round_number, offset)
+
+
+class RangeCheckingBackend(CountingBackend):
+    """Rejects ranges at or past the end like an HTTP server's 416"""
+    def fetch(self, round_number: int, offset: int):
+        if offset and offset >= self.size(round_number):
+            raise IOError('416 Range Not Satisfiable')
+        return super().fetch(round_number, offset)
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    with zipfile.ZipFile(source / 'numerai_dataset_200.zip', 'w') as archive:
+        archive.writestr('numerai_training_data.csv', 'id,era\n' * 5000)
+    return str(source)
+
+
+def test_sync_downloads_once(tmp_path, source_dir):
+    backend = CountingBackend(source_dir)
+    sync = round_sync.RoundSync(str(tmp_path / 'cache'), backend=backend)
+    path = sync.sync(round_number=200)
+    assert sync.sync(round_number=200) == path
+    assert backend.offsets == [0]
+    with open(path, 'rb') as f, open(backend._path(200), 'rb') as source:
+        assert f.read() == source.read()
+    assert os.path.basename(path).startswith(round_sync.utils.hash_file(path))
+
+
+def test_sync_resumes_partial_download(tmp_path, source_dir):
+    backend = CountingBackend(source_dir)
+    sync = round_sync.RoundSync(str(tmp_path / 'cache'), backend=backend)
+    with open(backend._path(200), 'rb') as source:
+        head = source.read(100)
+    with open(f'{sync.cache_dir}/partial/200.part', 'wb') as f:
+        f.write(head)
+    path = sync.sync(round_number=200)
+    assert backend.offsets == [100]
+    assert zipfile.ZipFile(path).testzip() is None
+
+
+def test_sync_rejects_corrupt_download(tmp_path, source_dir):
+    backend = CountingBackend(source_dir)
+    sync = round_sync.RoundSync(str(tmp_path / 'cache'), backend=backend)
+    with open(backend._path(200), 'rb') as source:
+        head = source.read(100)
+    with open(f'{sync.cache_dir}/partial/200.part', 'wb') as f:
+        f.write(b'x' * len(head))
+    with pytest.raises(IOError):
+        sync.sync(round_number=200)
+    assert not os.path.exists(f'{sync.cache_dir}/partial/200.part')
+    assert sync.cached_path(round_number=200) is None
+    # the retry starts from scratch and succeeds
+    assert sync.sync(round_number=200) is not None
+
+
+@pytest.mark.parametrize('corrupt', [False, True])
+def test_sync_verifies_complete_partial_download(tmp_path, source_dir,
+                                                 corrupt):
+    backend = RangeCheckingBackend(source_dir)
+    sync = round_sync.RoundSync(str(tmp_path / 'cache'), backend=backend)
+    with open(backend._path(200), 'rb') as source:
+        data = source.read()
+    with open(f'{sync.cache_dir}/partial/200.part', 'wb') as f:
+        f.write(b'x' * len(data) if corrupt else data)
+    if corrupt:
+        with pytest.raises(IOError, match='verification'):
+            sync.sync(round_number=200)
+        assert not os.path.exists(f'{sync.cache_dir}/partial/200.part')
+        assert backend.offsets == []
+    path = sync.sync(round_number=200)
+    assert backend.offsets == ([0] if corrupt else [])
+    with open(path, 'rb') as f:
+        assert f.read() == data
+
+
+def _sync_in_process(cache_dir: str, source_dir: str, queue) -> None:
+    backend = CountingBackend(source_dir)
+    round_sync.RoundSync(cache_dir, backend=backend).sync(round_number=200)
+    queue.put(len(backend.offsets))
+
+
+def test_concurrent_syncs_download_once(tmp_path, source_dir):
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    processes = [
+        context.Process(target=_sync_in_process,
+                        args=(str(tmp_path / 'cache'), source_dir, queue))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert sorted(queue.get() for _ in processes) == [0, 0, 0, 1]
+
+
+def test_prune_keeps_newest_rounds(tmp_path, source_dir):
+    for round_number in (201, 202):
+        with zipfile.ZipFile(
+                f'{source_dir}/numerai_dataset_{round_number}.zip',
+                'w') as archive:
+            archive.writestr('numerai_training_data.csv', f'{round_number}\n')
+    sync = round_sync.RoundSync(str(tmp_path / 'cache'),
+                                backend=CountingBackend(source_dir))
+    paths = [sync.sync(round_number=n) for n in (200, 201, 202)]
+    sync.prune(keep_rounds=2)
+    assert sync.cached_path(round_number=200) is None
+    assert not os.path.exists(paths[0])
+    assert [sync.cached_path(round_number=n) for n in (201, 202)] == paths[1:]
+    sync.prune(keep_rounds=0)
+    assert os.listdir(f'{sync.cache_dir}/rounds') == []
+    assert os.listdir(f'{sync.cache_dir}/objects') == []
+
+
+class PresignedHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves GET with byte ranges and rejects HEAD like a presigned url"""
+    def do_HEAD(self):
+        self.send_error(403)
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if 'Range' not in self.headers:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        start, end = self.headers['Range'].replace('bytes=', '').split('-')
+        end = int(end) if end else len(data) - 1
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.send_header('Content-Length', str(end + 1 - int(start)))
+        self.end_headers()
+        self.wfile.write(data[int(start):end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_backend_reads_size_without_head(tmp_path, source_dir):
+    server = http.server.HTTPServer(
+        ('127.0.0.1', 0),
+        lambda *args: PresignedHandler(*args, directory=source_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        backend = round_sync.HttpBackend(
+            f'http://127.0.0.1:{server.server_port}/'
+            'numerai_dataset_{round_number}.zip')
+        source = f'{source_dir}/numerai_dataset_200.zip'
+        assert backend.size(round_number=200) == os.path.getsize(source)
+        sync = round_sync.RoundSync(str(tmp_path / 'cache'), backend=backend)
+        with open(sync.sync(round_number=200), 'rb') as f, open(source,
+                                                                'rb') as g:
+            assert f.read() == g.read()
+    finally:
+        server.shutdown()
+        server.server_close()
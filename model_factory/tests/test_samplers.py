@@ -0,0 +1,49 @@
+import numpy as np
+import torch
+
+import samplers
+
+
+def test_bucket_batch_sampler_covers_dataset_once():
+    lengths = np.random.RandomState(0).randint(5, 512, size=1003)
+    sampler = samplers.BucketBatchSampler(lengths=lengths,
+                                          batch_size=16,
+                                          bucket_size=8,
+                                          seed=0)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert sorted(i for batch in batches for i in batch) == list(range(1003))
+    # batches come from sorted pools so their length spread is small
+    spread = np.mean([np.ptp(lengths[batch]) for batch in batches])
+    assert spread < np.ptp(lengths) / 4
+
+
+def test_bucket_batch_sampler_sorts_without_shuffle():
+    lengths = np.array([7, 3, 9, 1, 5])
+    sampler = samplers.BucketBatchSampler(lengths=lengths,
+                                          batch_size=2,
+                                          shuffle=False,
+                                          drop_last=True)
+    assert list(sampler) == [[3, 1], [4, 0]]
+    assert len(sampler) == 2
+
+
+def test_padding_collator_pads_to_longest():
+    samples = [{
+        'ids': torch.arange(1, length + 1),
+        'token_type_ids': torch.zeros(length, dtype=torch.long),
+        'attention_mask': torch.ones(length, dtype=torch.long),
+        'targets': torch.tensor(1.0)
+    } for length in (3, 5)]
+    batch = samplers.PaddingCollator()(samples)
+    assert batch['ids'].shape == (2, 5)
+    assert batch['ids'][0].tolist() == [1, 2, 3, 0, 0]
+    assert batch['attention_mask'].sum().item() == 8
+    assert batch['targets'].shape == (2, )
+
+    stats = samplers.BatchShapeStats(max_len=10)
+    stats.update(mask=batch['attention_mask'])
+    summary = stats.summary()
+    assert summary['max_length'] == 5
+    assert np.isclose(summary['padding_fraction'], 0.2)
+    assert np.isclose(summary['slots_saved'], 0.5)
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+import transformers
+
+import token_cache
+
+VOCAB = [
+    '[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'movie', 'was',
+    'great', 'bad', 'plot', 'acting', 'how', 'do', 'i', 'fix', 'it'
+]
+
+
+@pytest.fixture
+def tokenizer_path(tmp_path):
+    vocab_file = tmp_path / 'vocab.txt'
+    vocab_file.write_text('\n'.join(VOCAB))
+    tokenizer = transformers.BertTokenizerFast(vocab_file=str(vocab_file))
+    tokenizer.save_pretrained(str(tmp_path / 'tokenizer'))
+    return str(tmp_path / 'tokenizer')
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    df = pd.DataFrame({
+        'question': ['how do i  fix it', 'the plot', 'acting'],
+        'answer': ['the movie was great', 'bad', 'the   acting was bad bad'],
+    })
+    df.to_csv(tmp_path / 'train.csv', index=False)
+    return str(tmp_path / 'train.csv')
+
+
+def test_cache_matches_tokenizer(tmp_path, tokenizer_path, data_path):
+    cache = token_cache.TokenCache(cache_dir=str(tmp_path / 'cache'),
+                                   data_path=data_path,
+                                   tokenizer_name=tokenizer_path,
+                                   max_len=8,
+                                   first_columns=['question'],
+                                   second_columns=['answer'],
+                                   n_jobs=1,
+                                   chunk_size=2)
+    tokenizer = transformers.AutoTokenizer.from_pretrained(tokenizer_path)
+    df = pd.read_csv(data_path)
+    assert len(cache) == 3
+    for row in range(3):
+        expected = tokenizer(" ".join(df.question[row].split()),
+                             " ".join(df.answer[row].split()),
+                             truncation=True,
+                             max_length=8)
+        cached = cache.get(row)
+        for field in token_cache.FIELDS:
+            assert cached[field].dtype == np.int32
+            np.testing.assert_array_equal(cached[field], expected[field])
+    assert cache.lengths.max() <= 8
+
+
+def test_cache_is_reused(tmp_path, tokenizer_path, data_path):
+    kwargs = dict(cache_dir=str(tmp_path / 'cache'),
+                  data_path=data_path,
+                  tokenizer_name=tokenizer_path,
+                  max_len=8,
+                  first_columns=['question'],
+                  n_jobs=1)
+    first = token_cache.TokenCache(**kwargs)
+    second = token_cache.TokenCache(**kwargs)
+    other = token_cache.TokenCache(**{**kwargs, 'max_len': 6})
+    assert first.path == second.path
+    assert first.path != other.path
@@ -1,3 +1,8 @@
+import types
+
+import numpy as np
+import torch
+
 import trainers
 import utils
 from models import ResNet34
@@ -19,3 +24,95 @@ def test_attributes():
     assert hasattr(test_trainer, "save_model_locally")
     assert hasattr(test_trainer, "save_model_to_s3")
     assert isinstance(test_trainer, BaseTrainer)
+
+
+def test_bf16_autocast_keeps_fp32_weights():
+    model = torch.nn.Linear(8, 3)
+    with trainers.autocast(device=torch.device('cpu'), precision='bf16'):
+        predictions = model(torch.randn(4, 8))
+        loss = torch.nn.functional.cross_entropy(predictions,
+                                                 torch.tensor([0, 1, 2, 0]))
+    loss.backward()
+    assert predictions.dtype == torch.bfloat16
+    assert loss.dtype == torch.float32
+    assert model.weight.grad.dtype == torch.float32
+    with trainers.autocast(device=torch.device('cpu'), precision='fp32'):
+        assert model(torch.randn(4, 8)).dtype == torch.float32
+
+
+def test_numerai_train_model_passes_early_stopping(monkeypatch):
+    class FakeNumerAIModel:
+        def __init__(self, **params):
+            self.params = params
+
+        def fit(self, **kwargs):
+            self.fit_kwargs = kwargs
+
+    monkeypatch.setattr(trainers.models, 'NumerAIModel', FakeNumerAIModel)
+    params = {
+        'model_params': {
+            'max_depth': 5,
+            'learning_rate': 0.01,
+            'l2': 0.1,
+            'n_estimators': 10,
+            'tree_method': 'hist',
+            'early_stopping_rounds': 7
+        }
+    }
+    validation = types.SimpleNamespace(x='x', y={'bernie': 'y'})
+    trainer = trainers.NumerAITrainer(params=params, tournament='bernie')
+    trainer.train_model(data={'train': 'train', 'validation': validation})
+    assert trainer.model.params['max_depth'] == 5
+    assert trainer.model.fit_kwargs == {
+        'dfit': 'train',
+        'tournament': 'bernie',
+        'eval_set': [('x', 'y')],
+        'early_stopping': 7
+    }
+
+
+def test_numerai_cross_validate_trains_on_views(monkeypatch):
+    class FakeBooster:
+        def __init__(self):
+            self.params = {}
+
+        def set_params(self, **params):
+            self.params.update(params)
+
+        def fit(self, x, y, **kwargs):
+            self.shares_memory = np.shares_memory(x, features)
+            self.fit_kwargs = kwargs
+
+        def predict(self, x):
+            return x[:, 0]
+
+    boosters = []
+
+    def _create_model():
+        boosters.append(FakeBooster())
+        return types.SimpleNamespace(model=boosters[-1])
+
+    features = np.random.RandomState(0).rand(60, 3)
+    data = types.SimpleNamespace(x=features,
+                                 y={'bernie': features[:, 0]},
+                                 era_float=np.repeat(np.arange(6.), 10))
+    validation = types.SimpleNamespace(x='x', y={'bernie': 'y'})
+    params = {
+        'model_params': {
+            'early_stopping_rounds': 7
+        },
+        'cross_validation': {
+            'n_splits': 3,
+            'n_jobs': 2
+        }
+    }
+    trainer = trainers.NumerAITrainer(params=params, tournament='bernie')
+    monkeypatch.setattr(trainer, 'create_model', _create_model)
+    scores = trainer.cross_validate(data=data, eval_data=validation)
+    assert len(scores) == 3
+    # only the middle fold trains on both ends and gathers a copy
+    assert sorted(booster.shares_memory
+                  for booster in boosters) == [False, True, True]
+    for booster in boosters:
+        assert booster.params['early_stopping_rounds'] == 7
+        assert booster.fit_kwargs == {'eval_set': [('x', 'y')]}
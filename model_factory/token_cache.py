@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+import transformers
+
+import utils
+
+LOGGER = utils.get_logger(__name__)
+
+FIELDS = ('input_ids', 'token_type_ids', 'attention_mask')
+
+_TOKENIZERS = {}
+
+
+def _get_tokenizer(tokenizer_name: str) -> transformers.PreTrainedTokenizer:
+    # loaded once per worker process
+    if tokenizer_name not in _TOKENIZERS:
+        tokenizer = transformers.AutoTokenizer.from_pretrained(tokenizer_name,
+                                                               use_fast=True)
+        _TOKENIZERS[tokenizer_name] = tokenizer
+    return _TOKENIZERS[tokenizer_name]
+
+
+def _tokenize_chunk(tokenizer_name: str, first: List[str], second: List[str],
+                    max_len: int) -> Tuple[np.array, Dict[str, np.array]]:
+    tokenizer = _get_tokenizer(tokenizer_name)
+    encoded = tokenizer(first,
+                        second,
+                        add_special_tokens=True,
+                        truncation=True,
+                        max_length=max_len)
+    lengths = np.array([len(ids) for ids in encoded['input_ids']],
+                       dtype=np.int64)
+    flat = {
+        field: np.fromiter((token for row in encoded[field] for token in row),
+                           dtype=np.int32,
+                           count=lengths.sum())
+        for field in FIELDS
+    }
+    return lengths, flat
+
+
+def _join_columns(df: pd.DataFrame, columns: List[str]) -> List[str]:
+    """Collapses whitespace in each column and joins columns with a space"""
+    normalized = [
+        df[column].astype(str).str.split().str.join(" ") for column in columns
+    ]
+    text = normalized[0]
+    for column in normalized[1:]:
+        text = text + " " + column
+    return text.tolist()
+
+
+class TokenCache:
+    """
+    One-time batch tokenization of a CSV file into a memory-mapped ragged
+    layout: every field is stored as a flat int32 array and row i spans
+    offsets[i]:offsets[i + 1]. The cache is keyed by the data file hash,
+    the tokenizer name, max_len and the text columns, and is built with a
+    fast tokenizer over parallel chunks the first time it is requested.
+
+    Args:
+        cache_dir {str} -- directory holding all token caches
+        data_path {str} -- csv file to tokenize
+        tokenizer_name {str} -- pretrained tokenizer name, e.g. bert-base-uncased
+        max_len {int} -- maximum length of a tokenized sequence
+        first_columns {List[str]} -- columns joined into the first segment
+        second_columns {List[str]} -- columns joined into the second segment
+        n_jobs {int} -- number of tokenization processes
+        chunk_size {int} -- rows tokenized per task
+    """
+    def __init__(self,
+                 cache_dir: str,
+                 data_path: str,
+                 tokenizer_name: str,
+                 max_len: int,
+                 first_columns: List[str],
+                 second_columns: List[str] = None,
+                 n_jobs: int = -1,
+                 chunk_size: int = 2048):
+        self.cache_dir = cache_dir
+        self.data_path = data_path
+        self.tokenizer_name = tokenizer_name
+        self.max_len = max_len
+        self.first_columns = first_columns
+        self.second_columns = second_columns
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.path = f'{cache_dir}/{self.key}'
+        self._arrays = None
+        if not os.path.isfile(f'{self.path}/offsets.npy'):
+            self.build()
+
+    @property
+    def key(self) -> str:
+        description = json.dumps({
+            'data': utils.hash_file(self.data_path),
+            'tokenizer': self.tokenizer_name,
+            'max_len': self.max_len,
+            'first_columns': self.first_columns,
+            'second_columns': self.second_columns
+        })
+        return hashlib.sha256(description.encode()).hexdigest()[:16]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __len__(self):
+        return len(self.arrays['offsets']) - 1
+
+    def build(self) -> None:
+        LOGGER.info(f'Tokenizing {self.data_path} into {self.path}')
+        columns = self.first_columns + (self.second_columns or [])
+        df = pd.read_csv(self.data_path, usecols=columns)
+        first = _join_columns(df=df, columns=self.first_columns)
+        second = None
+        if self.second_columns:
+            second = _join_columns(df=df, columns=self.second_columns)
+        chunks = range(0, len(df), self.chunk_size)
+        results = joblib.Parallel(n_jobs=self.n_jobs)(
+            joblib.delayed(_tokenize_chunk)
+            (tokenizer_name=self.tokenizer_name,
+             first=first[start:start + self.chunk_size],
+             second=second[start:start + self.chunk_size] if second else None,
+             max_len=self.max_len) for start in chunks)
+        lengths = np.concatenate(
+            [chunk_lengths for chunk_lengths, _ in results])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        tmp_path = f'{self.path}.tmp{os.getpid()}'
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(f'{tmp_path}/offsets.npy', offsets)
+        for field in FIELDS:
+            np.save(f'{tmp_path}/{field}.npy',
+                    np.concatenate([flat[field] for _, flat in results]))
+        if os.path.isdir(self.path):
+            shutil.rmtree(tmp_path)
+        else:
+            os.replace(tmp_path, self.path)
+        LOGGER.info(f'Cached {len(lengths)} rows, {offsets[-1]} tokens')
+
+    @property
+    def arrays(self) -> Dict[str, np.memmap]:
+        if self._arrays is None:
+            self._arrays = {
+                name: np.load(f'{self.path}/{name}.npy', mmap_mode='r')
+                for name in FIELDS + ('offsets', )
+            }
+        return self._arrays
+
+    @property
+    def lengths(self) -> np.array:
+        return np.diff(self.arrays['offsets'])
+
+    def get(self, row: int) -> Dict[str, np.array]:
+        """Returns the unpadded fields of a row as int32 array views"""
+        start, end = self.arrays['offsets'][row:row + 2]
+        return {field: self.arrays[field][start:end] for field in FIELDS}
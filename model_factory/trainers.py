@@ -1,4 +1,6 @@
+import contextlib
 import os
+import threading
 import warnings
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List, Tuple
@@ -18,16 +20,32 @@ from torch.optim.lr_scheduler import ReduceLROnPlateau
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
+import accumulators
+import cross_validators
 import models
+import samplers
 import utils
 from dispatcher import MODEL_DISPATCHER
-from metrics import macro_recall, spearman_correlation
+from metrics import (StreamingMacroRecall, era_correlation,
+                     spearman_correlation)
 from utils import EarlyStopping
 
 warnings.filterwarnings('ignore')
 
 LOGGER = utils.get_logger(__name__)
 
+PRECISIONS = ('fp32', 'bf16')
+
+
+def autocast(device: torch.device, precision: str = 'fp32'):
+    """
+    Context running the forward pass and loss under bfloat16 autocast when
+    precision is bf16. Weights, gradients and optimizer state stay fp32.
+    """
+    if precision == 'bf16':
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
 
 class TrainerFactory:
     @staticmethod
@@ -114,6 +132,10 @@ class BengaliTrainer(BaseTrainer):
         self.early_stopping = EarlyStopping(patience=5, verbose=True)
         self.scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
             self.optimizer, mode="max", patience=5, factor=0.3, verbose=True)
+        self.train_transform = None
+        self.eval_transform = None
+        self.metrics_every_n = 1
+        self.precision = 'fp32'
 
     @property
     def setup_device(self):
@@ -137,8 +159,13 @@ class BengaliTrainer(BaseTrainer):
     def _load_to_gpu_long(self, data: torch.Tensor) -> torch.Tensor:
         return data.to(self.device, dtype=torch.long)
 
-    def _get_image(self, data: torch.Tensor) -> torch.Tensor:
-        return self._load_to_gpu_float(data["image"])
+    def _get_image(self,
+                   data: torch.Tensor,
+                   train: bool = True) -> torch.Tensor:
+        transform = self.train_transform if train else self.eval_transform
+        if transform is None:
+            return self._load_to_gpu_float(data["image"])
+        return transform(data["image"].to(self.device))
 
     def _get_targets(self, data: torch.Tensor) -> List[torch.Tensor]:
         grapheme_root = self._load_to_gpu_long(data["grapheme_root"])
@@ -148,10 +175,8 @@ class BengaliTrainer(BaseTrainer):
         return [grapheme_root, vowel_diacritic, consonant_diacritic]
 
     @staticmethod
-    def score(preds: torch.Tensor, targets: torch.Tensor) -> float:
-        final_preds = torch.cat(preds)
-        final_targets = torch.cat(targets)
-        return macro_recall(final_preds, final_targets)
+    def score(recall: StreamingMacroRecall) -> float:
+        return recall.compute(verbose=True)
 
     @staticmethod
     def concat_tensors(tensor: torch.Tensor) -> torch.Tensor:
@@ -218,51 +243,51 @@ class BengaliTrainer(BaseTrainer):
     def train(self, data_loader: DataLoader) -> Tuple[float, float]:
         # self.model.to(self.device)
         self.model.train()
-        final_loss = 0
-        counter = 0
-        final_preds, final_targets = [], []
+        final_loss = accumulators.RunningMean()
+        recall = StreamingMacroRecall()
         for batch, data in tqdm(enumerate(data_loader)):
-            counter += 1
             image = self._get_image(data=data)
             targets = self._get_targets(data=data)
             self.optimizer.zero_grad()
-            predictions = self.model(image)
-            loss = self._loss_fn(preds=predictions, targets=targets)
+            with autocast(device=self.device, precision=self.precision):
+                predictions = self.model(image)
+                loss = self._loss_fn(preds=predictions, targets=targets)
             loss.backward()
             self.optimizer.step()
-            final_loss += loss
-            final_preds.append(self.concat_tensors(tensor=predictions))
-            final_targets.append(self.stack_tensors(tensor=targets))
-
-        macro_recall_score = self.score(preds=final_preds,
-                                        targets=final_targets)
-        LOGGER.info(f'Training Loss: {final_loss/counter}')
+            final_loss.update(loss)
+            if batch % self.metrics_every_n == 0:
+                recall.update(preds=self.concat_tensors(tensor=predictions),
+                              y_true=self.stack_tensors(tensor=targets))
+
+        final_loss = final_loss.compute()
+        macro_recall_score = self.score(recall=recall)
+        LOGGER.info(f'Training Loss: {final_loss}')
         LOGGER.info(f'Training Macro-Recall: {macro_recall_score}')
 
-        return final_loss / counter, macro_recall_score
+        return final_loss, macro_recall_score
 
     def evaluate(self, data_loader: DataLoader) -> Tuple[float, float]:
         with torch.no_grad():
             self.model.to(self.device)
             self.model.eval()
-            final_loss = 0
-            counter = 0
-            final_preds, final_targets = [], []
+            final_loss = accumulators.RunningMean()
+            recall = StreamingMacroRecall()
             for batch, data in tqdm(enumerate(data_loader)):
-                counter += 1
-                image = self._get_image(data=data)
+                image = self._get_image(data=data, train=False)
                 targets = self._get_targets(data=data)
-                predictions = self.model(image)
-                final_loss += self._loss_fn(preds=predictions, targets=targets)
-                final_preds.append(self.concat_tensors(tensor=predictions))
-                final_targets.append(self.stack_tensors(tensor=targets))
-
-            macro_recall_score = self.score(preds=final_preds,
-                                            targets=final_targets)
-        LOGGER.info(f'Validation Loss: {final_loss/counter}')
+                with autocast(device=self.device, precision=self.precision):
+                    predictions = self.model(image)
+                    loss = self._loss_fn(preds=predictions, targets=targets)
+                final_loss.update(loss)
+                recall.update(preds=self.concat_tensors(tensor=predictions),
+                              y_true=self.stack_tensors(tensor=targets))
+
+            final_loss = final_loss.compute()
+            macro_recall_score = self.score(recall=recall)
+        LOGGER.info(f'Validation Loss: {final_loss}')
         LOGGER.info(f'Validation Macro-Recall: {macro_recall_score}')
 
-        return final_loss / counter, macro_recall_score
+        return final_loss, macro_recall_score
 
     def inference(self, data_loader):
         pass
@@ -294,6 +319,9 @@ class GoogleQATrainer(BaseTrainer):
         self.optimizer = transformers.AdamW(self.model.parameters(), lr=1e-4)
         self.criterion = nn.BCEWithLogitsLoss()
         self.early_stopping = EarlyStopping(patience=5, verbose=True)
+        self.batch_stats = samplers.BatchShapeStats()
+        self.metrics_every_n = 1
+        self.precision = 'fp32'
         self.scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
             self.optimizer, mode="max", patience=5, factor=0.3, verbose=True)
 
@@ -320,14 +348,8 @@ class GoogleQATrainer(BaseTrainer):
         return self._load_to_gpu_float(data['targets'])
 
     @staticmethod
-    def score(preds: List[torch.Tensor], targets: List[torch.Tensor]) -> float:
-        final_preds = torch.cat(preds)
-        final_targets = torch.cat(targets)
-        return spearman_correlation(final_preds, final_targets)
-
-    @staticmethod
-    def stack_tensors(tensor: torch.Tensor) -> torch.Tensor:
-        return torch.stack(tensor, dim=1)
+    def score(preds: torch.Tensor, targets: torch.Tensor) -> float:
+        return spearman_correlation(preds, targets)
 
     def save_model_locally(self, model_path: str) -> None:
         LOGGER.info(f'Saving model to {model_path}')
@@ -384,61 +406,71 @@ class GoogleQATrainer(BaseTrainer):
     def train(self, data_loader: DataLoader) -> Tuple[float, float]:
         self.model.to(self.device)
         self.model.train()
-        final_loss = 0
-        counter = 0
-        final_preds, final_targets = [], []
+        accumulator = accumulators.EpochAccumulator(
+            n_samples=len(data_loader.dataset),
+            device=self.device,
+            metrics_every_n=self.metrics_every_n)
+        self.batch_stats.reset()
         for batch, data in tqdm(enumerate(data_loader)):
-            counter += 1
+            self.batch_stats.update(mask=data['attention_mask'])
             ids, mask, token_type_ids = self._get_features(data=data)
             targets = self._get_targets(data=data)
             self.optimizer.zero_grad()
-            predictions = self.model(ids=ids,
-                                     mask=mask,
-                                     token_type_ids=token_type_ids)
-            loss = self._loss_fn(preds=predictions, targets=targets)
+            with autocast(device=self.device, precision=self.precision):
+                predictions = self.model(ids=ids,
+                                         mask=mask,
+                                         token_type_ids=token_type_ids)
+                loss = self._loss_fn(predictions=predictions, targets=targets)
             loss.backward()
             self.optimizer.step()
             self.scheduler.step()
-            final_loss += loss
-            final_preds.append(self.stack_tensors(tensor=predictions))
-            final_targets.append(self.stack_tensors(tensor=targets))
+            if accumulator.step(loss):
+                accumulator.record(predictions=predictions.float(),
+                                   targets=targets)
 
+        final_loss, final_preds, final_targets = accumulator.compute()
         spearman_correlation = self.score(preds=final_preds,
                                           targets=final_targets)
-        LOGGER.info(f'Training Loss: {final_loss/counter}')
+        self.batch_stats.log(name='Training')
+        LOGGER.info(f'Training Loss: {final_loss}')
         LOGGER.info(
             f'Training Spearman Correlation Coefficient: {spearman_correlation}'
         )
 
-        return final_loss / counter, spearman_correlation
+        return final_loss, spearman_correlation
 
     def evaluate(self, data_loader: DataLoader) -> Tuple[float, float]:
         with torch.no_grad():
             self.model.to(self.device)
             self.model.eval()
-            final_loss = 0
-            counter = 0
-            final_preds, final_targets = [], []
+            n_samples = len(data_loader.dataset)
+            accumulator = accumulators.EpochAccumulator(n_samples=n_samples,
+                                                        device=self.device)
+            self.batch_stats.reset()
             for batch, data in tqdm(enumerate(data_loader)):
-                counter += 1
+                self.batch_stats.update(mask=data['attention_mask'])
                 ids, mask, token_type_ids = self._get_features(data=data)
                 targets = self._get_targets(data=data)
-                predictions = self.model(ids=ids,
-                                         mask=mask,
-                                         token_type_ids=token_type_ids)
-                loss = self._loss_fn(preds=predictions, targets=targets)
-                final_loss += self._loss_fn(preds=predictions, targets=targets)
-                final_preds.append(self.concat_tensors(tensor=predictions))
-                final_targets.append(self.stack_tensors(tensor=targets))
-
+                with autocast(device=self.device, precision=self.precision):
+                    predictions = self.model(ids=ids,
+                                             mask=mask,
+                                             token_type_ids=token_type_ids)
+                    loss = self._loss_fn(predictions=predictions,
+                                         targets=targets)
+                accumulator.step(loss)
+                accumulator.record(predictions=predictions.float(),
+                                   targets=targets)
+
+            final_loss, final_preds, final_targets = accumulator.compute()
             spearman_correlation = self.score(preds=final_preds,
                                               targets=final_targets)
-        LOGGER.info(f'Validation Loss: {final_loss/counter}')
+        self.batch_stats.log(name='Validation')
+        LOGGER.info(f'Validation Loss: {final_loss}')
         LOGGER.info(
             f'Validation Spearman Correlation Coefficient: {spearman_correlation}'
         )
 
-        return final_loss / counter, spearman_correlation
+        return final_loss, spearman_correlation
 
 
 class IMDBTrainer(BaseTrainer):
@@ -461,6 +493,9 @@ class IMDBTrainer(BaseTrainer):
             'cuda:0' if torch.cuda.is_available() else 'cpu')
         self.criterion = nn.BCEWithLogitsLoss()
         self.early_stopping = EarlyStopping(patience=5, verbose=True)
+        self.batch_stats = samplers.BatchShapeStats()
+        self.metrics_every_n = 1
+        self.precision = 'fp32'
         self.setup_optimizer_and_scheduler
 
     @property
@@ -522,14 +557,8 @@ class IMDBTrainer(BaseTrainer):
         return self._load_to_gpu_float(data['targets'])
 
     @staticmethod
-    def score(preds: List[torch.Tensor], targets: List[torch.Tensor]) -> float:
-        final_preds = torch.cat(preds)
-        final_targets = torch.cat(targets)
-        return spearman_correlation(final_preds, final_targets)
-
-    @staticmethod
-    def stack_tensors(tensor: torch.Tensor) -> torch.Tensor:
-        return torch.stack(tensor, dim=1)
+    def score(preds: torch.Tensor, targets: torch.Tensor) -> float:
+        return spearman_correlation(preds, targets)
 
     def save_model_locally(self, model_path: str) -> None:
         LOGGER.info(f'Saving model to {model_path}')
@@ -586,62 +615,78 @@ class IMDBTrainer(BaseTrainer):
     def train(self, data_loader: DataLoader) -> Tuple[float, float]:
         self.model.to(self.device)
         self.model.train()
-        final_loss = 0
-        counter = 0
-        final_preds, final_targets = [], []
+        accumulator = accumulators.EpochAccumulator(
+            n_samples=len(data_loader.dataset),
+            device=self.device,
+            metrics_every_n=self.metrics_every_n)
+        self.batch_stats.reset()
         for batch, data in tqdm(enumerate(data_loader)):
-            counter += 1
+            self.batch_stats.update(mask=data['attention_mask'])
             ids, mask, token_type_ids = self._get_features(data=data)
             targets = self._get_targets(data=data)
             self.optimizer.zero_grad()
-            predictions = self.model(ids=ids,
-                                     mask=mask,
-                                     token_type_ids=token_type_ids)
-            loss = self._loss_fn(preds=predictions, targets=targets)
+            with autocast(device=self.device, precision=self.precision):
+                predictions = self.model(ids=ids,
+                                         mask=mask,
+                                         token_type_ids=token_type_ids)
+                loss = self._loss_fn(predictions=predictions, targets=targets)
             loss.backward()
             self.optimizer.step()
             self.scheduler.step()
-            final_loss += loss
-            final_preds.append(
-                self.stack_tensors(tensor=torch.sigmoid(predictions)))
-            final_targets.append(self.stack_tensors(tensor=targets))
+            if accumulator.step(loss):
+                probabilities = torch.sigmoid(predictions.float())
+                accumulator.record(predictions=probabilities, targets=targets)
 
+        final_loss, final_preds, final_targets = accumulator.compute()
         spearman_correlation = self.score(preds=final_preds,
                                           targets=final_targets)
-        LOGGER.info(f'Training Loss: {final_loss/counter}')
+        self.batch_stats.log(name='Training')
+        LOGGER.info(f'Training Loss: {final_loss}')
         LOGGER.info(
             f'Training Spearman Correlation Coefficient: {spearman_correlation}'
         )
 
-        return final_loss / counter, spearman_correlation
+        return final_loss, spearman_correlation
 
     def evaluate(self, data_loader: DataLoader) -> Tuple[float, float]:
         with torch.no_grad():
             self.model.to(self.device)
             self.model.eval()
-            final_loss = 0
-            counter = 0
-            final_preds, final_targets = [], []
+            n_samples = len(data_loader.dataset)
+            accumulator = accumulators.EpochAccumulator(n_samples=n_samples,
+                                                        device=self.device)
+            self.batch_stats.reset()
             for batch, data in tqdm(enumerate(data_loader)):
-                counter += 1
+                self.batch_stats.update(mask=data['attention_mask'])
                 ids, mask, token_type_ids = self._get_features(data=data)
                 targets = self._get_targets(data=data)
-                predictions = self.model(ids=ids,
-                                         mask=mask,
-                                         token_type_ids=token_type_ids)
-                loss = self._loss_fn(preds=predictions, targets=targets)
-                final_loss += self._loss_fn(preds=predictions, targets=targets)
-                final_preds.append(self.stack_tensors(tensor=predictions))
-                final_targets.append(self.stack_tensors(tensor=targets))
-
+                with autocast(device=self.device, precision=self.precision):
+                    predictions = self.model(ids=ids,
+                                             mask=mask,
+                                             token_type_ids=token_type_ids)
+                    loss = self._loss_fn(predictions=predictions,
+                                         targets=targets)
+                accumulator.step(loss)
+                accumulator.record(predictions=predictions.float(),
+                                   targets=targets)
+
+            final_loss, final_preds, final_targets = accumulator.compute()
             spearman_correlation = self.score(preds=final_preds,
                                               targets=final_targets)
-        LOGGER.info(f'Validation Loss: {final_loss/counter}')
+        self.batch_stats.log(name='Validation')
+        LOGGER.info(f'Validation Loss: {final_loss}')
         LOGGER.info(
             f'Validation Spearman Correlation Coefficient: {spearman_correlation}'
         )
 
-        return final_loss / counter, spearman_correlation
+        return final_loss, spearman_correlation
+
+
+def _as_slice(rows: np.array) -> Any:
+    """Basic slice of rows when they are one contiguous run, else rows"""
+    if len(rows) and (np.diff(rows) == 1).all():
+        return slice(rows[0], rows[-1] + 1)
+    return rows
 
 
 class NumerAITrainer:
@@ -665,22 +710,80 @@ class NumerAITrainer:
             f"Trained model loaded from s3 bucket: {self.params['credentials'].get('bucket')}"
         )
 
-    def train_model(self, data: nx.Data) -> None:
+    def create_model(self) -> models.NumerAIModel:
         model_params = self.params['model_params']
         if model_params["tree_method"] == 'gpu_hist':
             LOGGER.info("Training with GPU's")
-        self.model = self.model(max_depth=model_params["max_depth"],
-                                learning_rate=model_params["learning_rate"],
-                                l2=model_params["l2"],
-                                n_estimators=model_params["n_estimators"],
-                                tree_method=model_params["tree_method"])
+        return models.NumerAIModel(max_depth=model_params["max_depth"],
+                                   learning_rate=model_params["learning_rate"],
+                                   l2=model_params["l2"],
+                                   n_estimators=model_params["n_estimators"],
+                                   tree_method=model_params["tree_method"])
+
+    def train_model(self, data: nx.Data) -> None:
+        self.model = self.create_model()
         LOGGER.info(f"Training NumerAIModel for {self.tournament}")
         eval_set = [(data['validation'].x,
                      data['validation'].y[self.tournament])]
         self.model.fit(dfit=data['train'],
                        tournament=self.tournament,
                        eval_set=eval_set,
-                       early_stopping=model_params['early_stopping_rounds'])
+                       early_stopping=self.params['model_params']
+                       ['early_stopping_rounds'])
+
+    def cross_validate(self,
+                       data: nx.Data,
+                       eval_data: nx.Data = None) -> List[float]:
+        """
+        Purged era k-fold over the training eras of data (nx.Data or
+        quantization.QuantizedData). Folds are index arrays into one shared
+        feature matrix and run in threads, since XGBoost releases the GIL.
+        Training rows that form one contiguous run, as in walk-forward
+        folds or the outer k-fold folds of era-sorted data, are passed as a
+        slice of the shared matrix; other folds gather their rows one fold
+        at a time. As in train_model, boosting stops early on eval_data.
+        """
+        cv_params = self.params['cross_validation']
+        splitter = cross_validators.PurgedEraKFold(
+            n_splits=cv_params.get('n_splits', 5),
+            purge_eras=cv_params.get('purge_eras', 0),
+            embargo_eras=cv_params.get('embargo_eras', 0),
+            walk_forward=cv_params.get('walk_forward', False))
+        n_jobs = cv_params.get('n_jobs', 1)
+        x = data.x
+        y = data.y[self.tournament]
+        eras = data.era_float
+        early_stopping = self.params['model_params'].get(
+            'early_stopping_rounds')
+        fit_params = {}
+        if eval_data is not None and early_stopping:
+            fit_params['eval_set'] = [(eval_data.x,
+                                       eval_data.y[self.tournament])]
+        gather_lock = threading.Lock()
+
+        def _score_fold(train_idx: np.array, test_idx: np.array) -> float:
+            model = self.create_model()
+            model.model.set_params(n_jobs=max(os.cpu_count() // n_jobs, 1))
+            if fit_params:
+                model.model.set_params(early_stopping_rounds=early_stopping)
+            train_rows = _as_slice(train_idx)
+            # only one fold at a time holds a gathered copy of its rows
+            gather = (contextlib.nullcontext() if isinstance(
+                train_rows, slice) else gather_lock)
+            with gather:
+                model.model.fit(x[train_rows], y[train_rows], **fit_params)
+            test_rows = _as_slice(test_idx)
+            return era_correlation(y_true=y[test_rows],
+                                   y_pred=model.model.predict(x[test_rows]),
+                                   eras=eras[test_rows])
+
+        scores = joblib.Parallel(n_jobs=n_jobs, prefer='threads')(
+            joblib.delayed(_score_fold)(train_idx, test_idx)
+            for train_idx, test_idx in splitter.split(groups=eras))
+        LOGGER.info(f'{self.tournament} CV era correlation: '
+                    f'{np.mean(scores):.4f} +/- {np.std(scores):.4f} '
+                    f'({[round(score, 4) for score in scores]})')
+        return scores
 
     def save_model_locally(self) -> None:
         LOGGER.info(f"Saving model for {self.tournament} locally")
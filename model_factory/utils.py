@@ -1,5 +1,6 @@
 import datetime
 import glob
+import hashlib
 import logging
 import os
 from typing import Any, List, Tuple
@@ -64,7 +65,11 @@ class S3Client:
 # https://github.com/Bjarten/early-stopping-pytorch
 class EarlyStopping:
     """Early stops the training if validation loss doesn't improve after a given patience."""
-    def __init__(self, patience=7, verbose=False, delta=0):
+    def __init__(self,
+                 patience=7,
+                 verbose=False,
+                 delta=0,
+                 path='checkpoint.pt'):
         """
         Args:
             patience (int): How long to wait after last time validation loss improved.
@@ -73,14 +78,17 @@ class EarlyStopping:
                             Default: False
             delta (float): Minimum change in the monitored quantity to qualify as an improvement.
                             Default: 0
+            path (str): Where the checkpoint is saved.
+                            Default: 'checkpoint.pt'
         """
         self.patience = patience
         self.verbose = verbose
         self.counter = 0
         self.best_score = None
         self.early_stop = False
-        self.val_loss_min = np.Inf
+        self.val_loss_min = np.inf
         self.delta = delta
+        self.path = path
 
     def __call__(self, val_loss, model):
 
@@ -107,7 +115,7 @@ class EarlyStopping:
             LOGGER.info(
                 f'Validation loss decreased ({self.val_loss_min:.6f} --> {val_loss:.6f}).  Saving model ...'
             )
-        torch.save(model.state_dict(), 'checkpoint.pt')
+        torch.save(model.state_dict(), self.path)
         self.val_loss_min = val_loss
 
 
@@ -123,3 +131,12 @@ def pickle_images(input: str, output_dir: str):
 def generate_timestamp() -> str:
     return datetime.datetime.today().strftime("%B -%d,- %Y -%H:%M").replace(
         " ", "").replace(",", "")
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Returns the sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()